@@ -0,0 +1,338 @@
+# -*- coding: utf-8 -*-
+"""Benchmark adapters for each supported backend. Each adapter defines agent
+and target schemas in a fresh registry on an in-memory SQLite database, and
+exposes the pieces the benchmark suite needs: a permission manager, loaders,
+and bulk population of permission rows through the raw DB-API connection.
+"""
+
+import os
+import tempfile
+import contextlib
+
+
+class Backend(object):
+    """Base class for benchmark adapters.
+
+    :attr name: Backend name, as passed to ``--backends``
+    :attr columns: Agent, target, and permission column names of permission
+        join tables
+    """
+    name = None
+    columns = ('agent_id', 'target_id', 'permission')
+
+    def setup(self):
+        """Define schemas, create tables, and build :attr:`manager`."""
+        raise NotImplementedError()
+
+    def table(self, schema):
+        """Get the table name of `schema`."""
+        raise NotImplementedError()
+
+    def cursor(self):
+        """Get a DB-API cursor sharing the manager's transaction."""
+        raise NotImplementedError()
+
+    def commit(self):
+        raise NotImplementedError()
+
+    def get(self, schema, id):
+        """Load the record of `schema` with primary key `id`."""
+        raise NotImplementedError()
+
+    def loader(self, schema, kwarg='id'):
+        """Build a loader for records of `schema` keyed on `kwarg`."""
+        raise NotImplementedError()
+
+    def flush(self):
+        """Flush pending writes to the database, if the backend defers them."""
+        pass
+
+    @contextlib.contextmanager
+    def session(self):
+        """Context in which records are loaded and permissions are checked."""
+        yield
+
+    def populate(self, agents, targets):
+        """Replace all rows with `agents` agents and `targets` targets, and
+        grant `read` to every agent on every target, for `agents * targets`
+        permission rows.
+        """
+        schema = self.registry.get_permission(self.Agent, self.Target)
+        cursor = self.cursor()
+        for each in (schema, self.Agent, self.Target):
+            cursor.execute('DELETE FROM {0}'.format(self.table(each)))
+        for each, count in ((self.Agent, agents), (self.Target, targets)):
+            cursor.executemany(
+                'INSERT INTO {0} (id) VALUES (?)'.format(self.table(each)),
+                ((id, ) for id in range(1, count + 1)),
+            )
+        cursor.executemany(
+            'INSERT INTO {0} ({1}, {2}, {3}) VALUES (?, ?, ?)'.format(
+                self.table(schema), *self.columns
+            ),
+            (
+                (agent, target, 'read')
+                for agent in range(1, agents + 1)
+                for target in range(1, targets + 1)
+            ),
+        )
+        self.commit()
+
+
+class SqlalchemyBackend(Backend):
+    name = 'sqlalchemy'
+
+    def setup(self):
+        import sqlalchemy as sa
+        from sqlalchemy.ext.declarative import declarative_base
+        from guardrail.core.registry import _Registry
+        from guardrail.ext.sqlalchemy import SqlalchemyLoader
+        from guardrail.ext.sqlalchemy import SqlalchemyPermissionManager
+        from guardrail.ext.sqlalchemy import SqlalchemyPermissionSchemaFactory
+
+        self.registry = _Registry()
+        Base = declarative_base()
+
+        @self.registry.agent
+        class Agent(Base):
+            __tablename__ = 'agent'
+            id = sa.Column(sa.Integer, primary_key=True)
+
+        @self.registry.target
+        class Target(Base):
+            __tablename__ = 'target'
+            id = sa.Column(sa.Integer, primary_key=True)
+
+        self.registry.make_schemas(SqlalchemyPermissionSchemaFactory((Base, )))
+        engine = sa.create_engine('sqlite://')
+        Base.metadata.create_all(engine)
+        self.Agent, self.Target, self.Loader = Agent, Target, SqlalchemyLoader
+        self.db = sa.orm.Session(bind=engine)
+        self.manager = SqlalchemyPermissionManager(self.db, registry=self.registry)
+
+    def table(self, schema):
+        return schema.__tablename__
+
+    def cursor(self):
+        return self.db.connection().connection.cursor()
+
+    def commit(self):
+        self.db.commit()
+        self.db.expunge_all()
+
+    def get(self, schema, id):
+        return self.db.query(schema).get(id)
+
+    def loader(self, schema, kwarg='id'):
+        return self.Loader(schema, self.db, kwarg=kwarg)
+
+    def flush(self):
+        self.db.flush()
+
+
+class MemoryBackend(SqlalchemyBackend):
+    """In-memory manager writing through to SQLAlchemy, loaded with a snapshot
+    after each population.
+    """
+    name = 'memory'
+
+    def setup(self):
+        from guardrail.ext.memory import MemoryPermissionManager
+        super(MemoryBackend, self).setup()
+        self.manager = MemoryPermissionManager(self.manager, write_through=True)
+
+    def populate(self, agents, targets):
+        super(MemoryBackend, self).populate(agents, targets)
+        self.manager.load()
+
+
+class IndexBackend(SqlalchemyBackend):
+    """Index file manager backed by SQLAlchemy, republishing the index file
+    after each population.
+    """
+    name = 'index'
+
+    def setup(self):
+        super(IndexBackend, self).setup()
+        self.backend = self.manager
+        self.path = os.path.join(tempfile.mkdtemp(), 'permissions.idx')
+
+    def populate(self, agents, targets):
+        from guardrail.ext.index import IndexPermissionManager, write_index
+        super(IndexBackend, self).populate(agents, targets)
+        write_index(self.backend, self.path)
+        self.manager = IndexPermissionManager(self.backend, self.path)
+
+
+class PeeweeBackend(Backend):
+    name = 'peewee'
+
+    def setup(self):
+        import peewee as pw
+        from guardrail.core.registry import _Registry
+        from guardrail.ext.peewee import PeeweeLoader
+        from guardrail.ext.peewee import PeeweePermissionManager
+        from guardrail.ext.peewee import PeeweePermissionSchemaFactory
+
+        self.registry = _Registry()
+        self.db = pw.SqliteDatabase(':memory:')
+
+        class Base(pw.Model):
+            class Meta:
+                database = self.db
+
+        @self.registry.agent
+        class Agent(Base):
+            id = pw.PrimaryKeyField()
+
+        @self.registry.target
+        class Target(Base):
+            id = pw.PrimaryKeyField()
+
+        self.registry.make_schemas(PeeweePermissionSchemaFactory((Base, )))
+        self.db.create_tables([Agent, Target] + self.registry.schemas)
+        self.Agent, self.Target, self.Loader = Agent, Target, PeeweeLoader
+        self.manager = PeeweePermissionManager(registry=self.registry)
+
+    def table(self, schema):
+        return schema._meta.db_table
+
+    def cursor(self):
+        return self.db.get_conn().cursor()
+
+    def commit(self):
+        self.db.get_conn().commit()
+
+    def get(self, schema, id):
+        return schema.get(schema.id == id)
+
+    def loader(self, schema, kwarg='id'):
+        return self.Loader(schema, kwarg=kwarg)
+
+
+class PonyBackend(Backend):
+    name = 'pony'
+    columns = ('agent', 'target', 'permission')
+
+    def setup(self):
+        import pony.orm as pn
+        from guardrail.core.registry import _Registry
+        from guardrail.ext.pony import PonyLoader
+        from guardrail.ext.pony import PonyPermissionManager
+        from guardrail.ext.pony import PonyPermissionSchemaFactory
+
+        self.registry = _Registry()
+        self.db = pn.Database('sqlite', ':memory:')
+
+        @self.registry.agent
+        class Agent(self.db.Entity):
+            id = pn.PrimaryKey(int, auto=True)
+
+        @self.registry.target
+        class Target(self.db.Entity):
+            id = pn.PrimaryKey(int, auto=True)
+
+        self.registry.make_schemas(PonyPermissionSchemaFactory((self.db.Entity, )))
+        self.db.generate_mapping(create_tables=True)
+        self.Agent, self.Target, self.Loader = Agent, Target, PonyLoader
+        self.manager = PonyPermissionManager(registry=self.registry)
+        self.pn = pn
+
+    def table(self, schema):
+        return schema._table_
+
+    def cursor(self):
+        return self.db.get_connection().cursor()
+
+    def commit(self):
+        self.pn.commit()
+
+    def get(self, schema, id):
+        return schema[id]
+
+    def loader(self, schema, kwarg='id'):
+        return self.Loader(schema, kwarg=kwarg)
+
+    def flush(self):
+        self.pn.flush()
+
+    @contextlib.contextmanager
+    def session(self):
+        with self.pn.db_session:
+            yield
+
+    def populate(self, agents, targets):
+        with self.session():
+            super(PonyBackend, self).populate(agents, targets)
+
+
+class DjangoBackend(Backend):
+    name = 'django'
+
+    def setup(self):
+        import django
+        from django.conf import settings
+        from django.core.management import call_command
+
+        settings.configure(
+            INSTALLED_APPS=['guardrail.ext.django', 'benchmarks.django_app'],
+            DATABASES={
+                'default': {
+                    'ENGINE': 'django.db.backends.sqlite3',
+                    'NAME': ':memory:',
+                },
+            },
+        )
+        django.setup()
+        call_command('migrate', run_syncdb=True, verbosity=0)
+
+        from django.db import connection
+        from guardrail.ext.django.models import DjangoLoader
+        from guardrail.ext.django.models import DjangoPermissionManager
+        from benchmarks.django_app import models
+
+        self.registry = models.registry
+        self.Agent, self.Target, self.Loader = models.Agent, models.Target, DjangoLoader
+        self.manager = DjangoPermissionManager(registry=self.registry)
+        self.connection = connection
+
+    def table(self, schema):
+        return schema._meta.db_table
+
+    def cursor(self):
+        self.connection.ensure_connection()
+        return self.connection.connection.cursor()
+
+    def commit(self):
+        self.connection.connection.commit()
+
+    def get(self, schema, id):
+        return schema.objects.get(pk=id)
+
+    def loader(self, schema, kwarg='id'):
+        return self.Loader(schema, kwarg=kwarg)
+
+
+class NegativeBackend(SqlalchemyBackend):
+    """SQLAlchemy manager with a negative cache, dropped after each population
+    so that filters are rebuilt from the populated tables.
+    """
+    name = 'negative'
+
+    def setup(self):
+        from guardrail.core.cache import NegativeCache
+        super(NegativeBackend, self).setup()
+        self.manager.negative_cache = NegativeCache()
+
+    def populate(self, agents, targets):
+        super(NegativeBackend, self).populate(agents, targets)
+        self.manager.negative_cache.clear()
+
+
+BACKENDS = {
+    backend.name: backend
+    for backend in (
+        SqlalchemyBackend, PeeweeBackend, PonyBackend, DjangoBackend, MemoryBackend,
+        IndexBackend, NegativeBackend,
+    )
+}
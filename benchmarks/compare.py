@@ -0,0 +1,50 @@
+# -*- coding: utf-8 -*-
+"""Compare two result files written by ``benchmarks.suite``, printing the
+ratio of median timings for each benchmark, and exit with status 1 if any
+benchmark slowed down by more than the threshold. Run with
+``python -m benchmarks.compare baseline.json current.json``.
+"""
+
+from __future__ import print_function
+
+import sys
+import json
+import argparse
+
+
+def load(path):
+    with open(path) as fp:
+        data = json.load(fp)
+    return {
+        (result['backend'], result['size'], result['name']): result
+        for result in data['results']
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('baseline')
+    parser.add_argument('current')
+    parser.add_argument('--threshold', type=float, default=0.1,
+                        help='Maximum allowed fractional slowdown of median timings')
+    args = parser.parse_args()
+
+    baseline, current = load(args.baseline), load(args.current)
+    regressions = 0
+    for key in sorted(set(baseline) & set(current)):
+        before, after = baseline[key]['median'], current[key]['median']
+        ratio = after / before
+        regressed = ratio > 1 + args.threshold
+        regressions += regressed
+        print('{0:<10} {1:>8} {2:<20} {3:10.1f} us {4:10.1f} us {5:6.2f}x{6}'.format(
+            key[0], key[1], key[2], before * 1e6, after * 1e6, ratio,
+            '  REGRESSION' if regressed else '',
+        ))
+    for key in sorted(set(baseline) ^ set(current)):
+        print('{0:<10} {1:>8} {2:<20} only in {3}'.format(
+            key[0], key[1], key[2], 'baseline' if key in baseline else 'current'))
+    sys.exit(1 if regressions else 0)
+
+
+if __name__ == '__main__':
+    main()
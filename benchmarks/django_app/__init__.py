@@ -0,0 +1,2 @@
+# -*- coding: utf-8 -*-
+"""Django app defining the schemas used by the Django benchmark adapter."""
@@ -0,0 +1,22 @@
+# -*- coding: utf-8 -*-
+
+from django import db
+
+from guardrail.core.registry import _Registry
+from guardrail.ext.django.models import DjangoPermissionSchemaFactory
+
+
+registry = _Registry()
+
+
+@registry.agent
+class Agent(db.models.Model):
+    pass
+
+
+@registry.target
+class Target(db.models.Model):
+    pass
+
+
+registry.make_schemas(DjangoPermissionSchemaFactory((db.models.Model, )))
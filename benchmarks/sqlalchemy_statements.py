@@ -0,0 +1,72 @@
+# -*- coding: utf-8 -*-
+"""Compare per-call cost of SQLAlchemy permission checks built through the ORM
+against precompiled statements. Run with ``python -m benchmarks.sqlalchemy_statements``.
+"""
+
+from __future__ import print_function
+
+import timeit
+import argparse
+
+import sqlalchemy as sa
+from sqlalchemy.ext.declarative import declarative_base
+
+from guardrail.core.registry import _Registry
+from guardrail.ext.sqlalchemy import SqlalchemyPermissionManager
+from guardrail.ext.sqlalchemy import SqlalchemyPermissionSchemaFactory
+
+
+registry = _Registry()
+Base = declarative_base()
+
+
+@registry.agent
+class Agent(Base):
+    __tablename__ = 'agent'
+    id = sa.Column(sa.Integer, primary_key=True)
+
+
+@registry.target
+class Target(Base):
+    __tablename__ = 'target'
+    id = sa.Column(sa.Integer, primary_key=True)
+
+
+def orm(query, **kwargs):
+    """No-op custom filter; forces the ORM query path."""
+    return query
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--number', type=int, default=5000)
+    args = parser.parse_args()
+
+    registry.make_schemas(SqlalchemyPermissionSchemaFactory((Base, )))
+    engine = sa.create_engine('sqlite://')
+    Base.metadata.create_all(engine)
+    session = sa.orm.Session(bind=engine)
+    manager = SqlalchemyPermissionManager(session, registry=registry)
+    agent, target = Agent(), Target()
+    session.add_all([agent, target])
+    manager.add_permission(agent, target, 'read')
+
+    cases = [
+        ('has_permission', lambda custom: manager.has_permission(
+            agent, target, 'read', custom=custom)),
+        ('get_permissions', lambda custom: manager.get_permissions(
+            agent, target, custom=custom)),
+    ]
+    for name, check in cases:
+        before = timeit.timeit(lambda: check(orm), number=args.number)
+        after = timeit.timeit(lambda: check(None), number=args.number)
+        print('{0:<16} orm: {1:8.1f} us  compiled: {2:8.1f} us  speedup: {3:.1f}x'.format(
+            name,
+            before / args.number * 1e6,
+            after / args.number * 1e6,
+            before / after,
+        ))
+
+
+if __name__ == '__main__':
+    main()
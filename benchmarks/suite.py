@@ -0,0 +1,137 @@
+# -*- coding: utf-8 -*-
+"""Benchmark permission checks, grants, loaders, and decorators across backends
+on SQLite, at increasing numbers of permission rows, and write the results as
+JSON for comparison with ``benchmarks.compare``. Run with ``python -m benchmarks.suite``.
+"""
+
+from __future__ import print_function
+
+import sys
+import json
+import time
+import timeit
+import argparse
+import platform
+import functools
+
+import guardrail
+from guardrail.core import decorators
+
+from benchmarks.backends import BACKENDS
+
+
+AGENTS = 100
+VERSION = 1
+
+
+def error_handler(code):
+    raise RuntimeError(code)
+
+
+def view(**kwargs):
+    return kwargs['target']
+
+
+def make_cases(backend, agent_id, target_id):
+    """Build benchmark cases for `backend`, checking permissions of the agent
+    with primary key `agent_id` on the target with primary key `target_id`.
+
+    :returns: List of (name, callable) tuples
+    """
+    manager = backend.manager
+    agent = backend.get(backend.Agent, agent_id)
+    target = backend.get(backend.Target, target_id)
+    target_loader = backend.loader(backend.Target, kwarg='target_id')
+    decorator = functools.partial(
+        decorators.has_permission,
+        'read',
+        manager,
+        backend.loader(backend.Agent, kwarg='agent_id'),
+        target_loader,
+        error_handler,
+    )
+    decorated = decorator()(view)
+    fused = decorator(fused=True)(view)
+
+    def add_remove():
+        manager.add_permission(agent, target, 'write')
+        backend.flush()
+        manager.remove_permission(agent, target, 'write')
+        backend.flush()
+
+    return [
+        ('has_permission', lambda: manager.has_permission(agent, target, 'read')),
+        ('has_permission_miss', lambda: manager.has_permission(agent, target, 'write')),
+        ('get_permissions', lambda: manager.get_permissions(agent, target)),
+        ('add_remove', add_remove),
+        ('loader', lambda: target_loader(target_id=target_id)),
+        ('decorator', lambda: decorated(agent_id=agent_id, target_id=target_id)),
+        ('decorator_fused', lambda: fused(agent_id=agent_id, target_id=target_id)),
+    ]
+
+
+def run_backend(backend, sizes, number, repeat):
+    backend.setup()
+    for size in sizes:
+        agents = min(AGENTS, size)
+        targets = size // agents
+        start = time.time()
+        backend.populate(agents, targets)
+        print('{0} {1}: populated in {2:.1f} s'.format(
+            backend.name, size, time.time() - start), file=sys.stderr)
+        with backend.session():
+            cases = make_cases(backend, agents // 2 or 1, targets // 2 or 1)
+            for name, func in cases:
+                times = sorted(
+                    each / number
+                    for each in timeit.repeat(func, number=number, repeat=repeat)
+                )
+                result = {
+                    'backend': backend.name,
+                    'size': size,
+                    'name': name,
+                    'number': number,
+                    'repeat': repeat,
+                    'min': times[0],
+                    'median': times[len(times) // 2],
+                    'mean': sum(times) / len(times),
+                }
+                print('{backend:<10} {size:>8} {name:<20} {median_us:10.1f} us'.format(
+                    median_us=result['median'] * 1e6, **result), file=sys.stderr)
+                yield result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--backends', nargs='+', choices=sorted(BACKENDS),
+                        default=sorted(BACKENDS))
+    parser.add_argument('--sizes', nargs='+', type=int,
+                        default=[1000, 10000, 100000, 1000000])
+    parser.add_argument('--number', type=int, default=1000)
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--output', type=argparse.FileType('w'), default=sys.stdout)
+    args = parser.parse_args()
+
+    results = []
+    for name in args.backends:
+        backend = BACKENDS[name]()
+        results.extend(run_backend(backend, args.sizes, args.number, args.repeat))
+    json.dump(
+        {
+            'version': VERSION,
+            'environment': {
+                'python': platform.python_version(),
+                'platform': platform.platform(),
+                'guardrail': guardrail.__version__,
+                'timestamp': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+            },
+            'results': results,
+        },
+        args.output,
+        indent=2,
+        sort_keys=True,
+    )
+
+
+if __name__ == '__main__':
+    main()
@@ -16,8 +16,5 @@ def ensure(app):
             post = models.Post(id=1, title='death on two legs', content='dedicated to...')
             models.db.session.add(post)
             models.db.session.commit()
-        try:
-            permissions.manager.ensure_permission(user, post, 'read')
-        except:
-            pass
+        permissions.manager.ensure_permission(user, post, 'read')
         models.db.session.commit()
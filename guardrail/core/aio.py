@@ -0,0 +1,153 @@
+# -*- coding: utf-8 -*-
+"""Asyncio support for `guardrail`. Requires Python 3.5 or later.
+
+Wrap a permission manager in :class:`AsyncPermissionManager` to await its
+methods without blocking the event loop, and protect `async def` views with
+:class:`has_permission`:
+
+.. code-block:: python
+
+    manager = AsyncPermissionManager(DjangoPermissionManager())
+
+    @has_permission('read', manager, agent_loader, target_loader, error_handler)
+    async def view_post(request, agent, target, **kwargs):
+        ...
+
+"""
+
+import timeit
+import asyncio
+import inspect
+import functools
+from concurrent import futures
+
+from guardrail.core import signals
+from guardrail.core import decorators
+
+
+async def _maybe_await(value):
+    if inspect.isawaitable(value):
+        return await value
+    return value
+
+
+def _awaitable(name):
+    def method(self, *args, **kwargs):
+        return self._run(name, *args, **kwargs)
+    method.__name__ = name
+    method.__doc__ = (
+        'Awaitable version of :meth:`BasePermissionManager.{0}`.'.format(name)
+    )
+    return method
+
+
+class AsyncPermissionManager(object):
+    """Asyncio wrapper around a synchronous permission manager. Each call runs
+    in a bounded thread pool, so the wrapped manager must be safe to use from
+    worker threads (e.g. a SQLAlchemy `scoped_session`, or a Pony manager whose
+    calls are made inside `db_session`).
+
+    :param manager: Permission manager to wrap
+    :param executor: Optional `concurrent.futures.Executor`; if not provided, a
+        `ThreadPoolExecutor` with `max_workers` threads is created on first use
+    :param int max_workers: Size of the default thread pool
+    """
+    def __init__(self, manager, executor=None, max_workers=8):
+        self.manager = manager
+        self.registry = manager.registry
+        self.executor = executor
+        self.max_workers = max_workers
+
+    async def _run(self, name, *args, **kwargs):
+        """Call method `name` on the wrapped manager in the thread pool."""
+        if self.executor is None:
+            self.executor = futures.ThreadPoolExecutor(max_workers=self.max_workers)
+        func = functools.partial(getattr(self.manager, name), *args, **kwargs)
+        return await asyncio.get_event_loop().run_in_executor(self.executor, func)
+
+    get_permissions = _awaitable('get_permissions')
+    has_permission = _awaitable('has_permission')
+    has_any_permission = _awaitable('has_any_permission')
+    has_all_permissions = _awaitable('has_all_permissions')
+    add_permission = _awaitable('add_permission')
+    ensure_permission = _awaitable('ensure_permission')
+    remove_permission = _awaitable('remove_permission')
+    get_permissions_many = _awaitable('get_permissions_many')
+    has_permission_many = _awaitable('has_permission_many')
+    add_permissions = _awaitable('add_permissions')
+    remove_permissions = _awaitable('remove_permissions')
+    add_member = _awaitable('add_member')
+    remove_member = _awaitable('remove_member')
+    get_groups = _awaitable('get_groups')
+    refresh_permissions = _awaitable('refresh_permissions')
+
+
+class has_permission(decorators.has_permission):
+    """Factory for permission-checking decorators on `async def` functions.
+    Takes the same arguments as :class:`guardrail.core.decorators.has_permission`,
+    except that `manager` should be an :class:`AsyncPermissionManager`, and
+    loaders and the error handler may return awaitables.
+    """
+    def __call__(self, func):
+        """Decorator that checks permissions before awaiting `func`. Note:
+        wrapped function will be called with the loaded agent and target.
+
+        :param func: Coroutine function to decorate
+        """
+        @functools.wraps(func)
+        async def wrapped(*args, **kwargs):
+            agent, target = await self._check_permission(*args, **kwargs)
+            kwargs.update({
+                'agent': agent,
+                'target': target,
+            })
+            return await func(*args, **kwargs)
+        return wrapped
+
+    async def _check_permission(self, *args, **kwargs):
+        agent = await self._load(self.agent_loader, self.agent_loader, *args, **kwargs)
+        if not agent:
+            return await _maybe_await(self.error_handler(decorators.AGENT_NOT_FOUND))
+        if self.fused:
+            return await self._check_permission_fused(agent, *args, **kwargs)
+        target = await self._load(self.target_loader, self.target_loader, *args, **kwargs)
+        if not target:
+            return await _maybe_await(self.error_handler(decorators.TARGET_NOT_FOUND))
+        if not await self._has_permission(agent, target):
+            await _maybe_await(self.error_handler(decorators.FORBIDDEN))
+        return agent, target
+
+    async def _check_permission_fused(self, agent, *args, **kwargs):
+        target, allowed = await self._load(
+            self.target_loader, self.target_loader.load_with_permission,
+            agent, self._get_fused_permissions(), self.manager.registry,
+            *args, **kwargs
+        )
+        if not target:
+            return await _maybe_await(self.error_handler(decorators.TARGET_NOT_FOUND))
+        if not allowed:
+            await _maybe_await(self.error_handler(decorators.FORBIDDEN))
+        return agent, target
+
+    async def _load(self, loader, load, *args, **kwargs):
+        """Call `load`, which is `loader` or one of its methods, and await the
+        result if needed, sending `signals.load` if any listeners are
+        connected. Queries are not counted, since other tasks may issue
+        queries while the load is awaited.
+        """
+        if not signals.load.receivers:
+            return await _maybe_await(load(*args, **kwargs))
+        result, error = None, None
+        start = timeit.default_timer()
+        try:
+            result = await _maybe_await(load(*args, **kwargs))
+        except Exception as exc:
+            error = exc
+        duration = timeit.default_timer() - start
+        signals.load.send(signals.Event(
+            signals.load.name, loader, getattr(loader, 'schema', None),
+            {'args': args, 'kwargs': kwargs}, result, error, duration, None,
+        ))
+        if error is not None:
+            raise error
+        return result
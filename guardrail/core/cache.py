@@ -0,0 +1,637 @@
+# -*- coding: utf-8 -*-
+"""Caches for permission lookups. A cache is attached to a permission manager
+via the `cache` argument, and stores the set of permissions linking each
+agent-target pair:
+
+.. code-block:: python
+
+    manager = PeeweePermissionManager(cache=PermissionCache())
+
+To share cached permissions between processes, use
+:class:`VersionedPermissionCache` with a shared store:
+
+.. code-block:: python
+
+    store = SqliteStore('/tmp/guardrail-cache.db', max_size=100000, timeout=300)
+    manager = PeeweePermissionManager(cache=VersionedPermissionCache(store))
+
+To answer checks for permissions that were never granted without a query,
+attach a :class:`NegativeCache` via the `negative_cache` argument:
+
+.. code-block:: python
+
+    manager = PeeweePermissionManager(negative_cache=NegativeCache(error_rate=0.01))
+
+"""
+
+import os
+import json
+import math
+import time
+import timeit
+import sqlite3
+import threading
+import collections
+
+
+class PermissionCache(object):
+    """In-process cache of permission sets, keyed on permission schema and
+    agent and target primary keys. Entries are never expired, so the cache
+    should be scoped to a single request or unit of work; call :meth:`clear`
+    when the scope ends.
+
+    Note: Entries are invalidated by writes made through the owning manager,
+    but not by writes made elsewhere (e.g. deletes cascading from agent or
+    target records).
+    """
+    def __init__(self):
+        self._data = {}
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        """Get cached permissions for `key`.
+
+        :param tuple key: Cache key
+        :returns: Frozen set of permissions, or `None` if not cached
+        """
+        try:
+            value = self._data[key]
+        except KeyError:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return value
+
+    def set(self, key, permissions):
+        """Cache permissions for `key`.
+
+        :param tuple key: Cache key
+        :param frozenset permissions: Permissions to cache
+        """
+        self._data[key] = permissions
+
+    def invalidate(self, key):
+        """Drop cached permissions for `key`, if present.
+
+        :param tuple key: Cache key
+        """
+        self._data.pop(key, None)
+
+    def clear(self):
+        """Drop all cached permissions and reset hit and miss counts."""
+        self._data.clear()
+        self.hits = 0
+        self.misses = 0
+
+
+class VersionedPermissionCache(PermissionCache):
+    """Permission cache that can be shared between processes. Each agent-target
+    pair has a version counter in `store` that is incremented on every write;
+    cached entries are tagged with the version that was current when they were
+    read, and are ignored once the version moves on. Readers therefore check
+    freshness with a single counter lookup.
+
+    Note: Managers bump versions as soon as a write is issued, which may be
+    before the surrounding transaction commits. Readers in other processes may
+    cache the pre-commit state under the new version in this window; use a
+    store `timeout` to bound how long such entries can be served.
+
+    Entries are keyed on the table name of the permission join table, so
+    managers in different registries share entries only for the same table.
+
+    The version read on each miss is held per thread until the matching `set`,
+    so that results read before a concurrent write are stored under the old
+    version; at most `max_pending` misses are held per thread.
+
+    :param store: Shared store for versions and entries, e.g. :class:`SqliteStore`
+    :param local: Optional process-local store, e.g. :class:`MemoryStore`, that
+        is checked before `store`
+    :param int max_pending: Maximum number of misses awaiting a `set` per thread
+    """
+    def __init__(self, store, local=None, max_pending=1024):
+        super(VersionedPermissionCache, self).__init__()
+        self.store = store
+        self.local = local
+        self.max_pending = max_pending
+        self._thread = threading.local()
+
+    @property
+    def _pending(self):
+        pending = getattr(self._thread, 'pending', None)
+        if pending is None:
+            pending = self._thread.pending = collections.OrderedDict()
+        return pending
+
+    @staticmethod
+    def _make_key(key):
+        schema, agent_id, target_id = key
+        table = getattr(schema, 'permission_table', None) or schema.__name__
+        return '{0}:{1}:{2}'.format(table, agent_id, target_id)
+
+    def get(self, key):
+        skey = self._make_key(key)
+        version = self.store.get_version(skey)
+        pending = self._pending
+        pending.pop(key, None)
+        layers = (self.local, self.store) if self.local is not None else (self.store, )
+        for layer in layers:
+            entry = layer.get(skey)
+            if entry is not None and entry[0] == version:
+                if layer is not self.local and self.local is not None:
+                    self.local.set(skey, entry)
+                self.hits += 1
+                return frozenset(entry[1])
+        pending[key] = version
+        while len(pending) > self.max_pending:
+            pending.popitem(last=False)
+        self.misses += 1
+        return None
+
+    def set(self, key, permissions):
+        skey = self._make_key(key)
+        version = self._pending.pop(key, None)
+        if version is None:
+            version = self.store.get_version(skey)
+        entry = (version, sorted(permissions))
+        self.store.set(skey, entry)
+        if self.local is not None:
+            self.local.set(skey, entry)
+
+    def invalidate(self, key):
+        skey = self._make_key(key)
+        self.store.incr_version(skey)
+        self._pending.pop(key, None)
+        if self.local is not None:
+            self.local.delete(skey)
+
+    def clear(self):
+        """Drop process-local entries and reset hit and miss counts. Entries in
+        the shared store are left to expire.
+        """
+        self._pending.clear()
+        if self.local is not None:
+            self.local.clear()
+        self.hits = 0
+        self.misses = 0
+
+
+def _new_version():
+    """Initial value for a version counter. Counters are created on first read,
+    starting from the current time in microseconds, so that a counter recreated
+    after eviction never returns to a value that entries may be tagged with.
+    """
+    return int(time.time() * 1000000)
+
+
+class MemoryStore(object):
+    """Process-local store with least-recently-used and time-based eviction.
+    Version counters are evicted by the same rules, counting from their last
+    increment; evicting a counter invalidates entries tagged with it.
+
+    :param int max_size: Optional maximum number of entries
+    :param float timeout: Optional entry lifetime in seconds
+    """
+    def __init__(self, max_size=None, timeout=None):
+        self.max_size = max_size
+        self.timeout = timeout
+        self._entries = collections.OrderedDict()
+        self._versions = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            try:
+                value, expires = self._entries.pop(key)
+            except KeyError:
+                return None
+            if expires is not None and expires < time.time():
+                return None
+            self._entries[key] = (value, expires)
+            return value
+
+    def set(self, key, value):
+        expires = time.time() + self.timeout if self.timeout is not None else None
+        with self._lock:
+            self._entries.pop(key, None)
+            self._entries[key] = (value, expires)
+            if self.max_size is not None:
+                while len(self._entries) > self.max_size:
+                    self._entries.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def get_version(self, key):
+        with self._lock:
+            value = self._get_version(key)
+            if value is None:
+                value = self._set_version(key, _new_version())
+            return value
+
+    def incr_version(self, key):
+        with self._lock:
+            value = self._get_version(key)
+            return self._set_version(
+                key, value + 1 if value is not None else _new_version(),
+            )
+
+    def _get_version(self, key):
+        try:
+            value, expires = self._versions[key]
+        except KeyError:
+            return None
+        if expires is not None and expires < time.time():
+            return None
+        return value
+
+    def _set_version(self, key, value):
+        now = time.time()
+        expires = now + self.timeout if self.timeout is not None else None
+        self._versions.pop(key, None)
+        self._versions[key] = (value, expires)
+        if self.max_size is not None:
+            while len(self._versions) > self.max_size:
+                self._versions.popitem(last=False)
+        # Counters are ordered by expiry, so expired counters lead
+        while self._versions:
+            oldest = next(iter(self._versions.values()))
+            if oldest[1] is None or oldest[1] >= now:
+                break
+            self._versions.popitem(last=False)
+        return value
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+class SqliteStore(object):
+    """Store backed by a SQLite file, for sharing entries and versions between
+    processes on a single host. Entries are JSON-encoded. Every
+    `prune_interval` writes, entries and version counters are each checked
+    against `max_size`, evicting the least recently written, and counters not
+    incremented within `timeout` seconds are evicted; evicting a counter
+    invalidates entries tagged with it.
+
+    :param str path: Path to database file
+    :param int max_size: Optional maximum number of entries
+    :param float timeout: Optional entry lifetime in seconds
+    :param int prune_interval: Number of writes between evictions
+    """
+    def __init__(self, path, max_size=None, timeout=None, prune_interval=64):
+        self.path = path
+        self.max_size = max_size
+        self.timeout = timeout
+        self.prune_interval = prune_interval
+        self._writes = 0
+        self._lock = threading.Lock()
+        self._pid = None
+        self._connection = None
+
+    @property
+    def connection(self):
+        """Connection to the database file, reopened after forking."""
+        if self._pid != os.getpid():
+            self._connection = sqlite3.connect(
+                self.path,
+                timeout=30,
+                isolation_level=None,
+                check_same_thread=False,
+            )
+            self._connection.execute('PRAGMA journal_mode=WAL')
+            self._connection.execute(
+                'CREATE TABLE IF NOT EXISTS guardrail_entry '
+                '(key TEXT PRIMARY KEY, value TEXT, expires REAL, written REAL)'
+            )
+            self._connection.execute(
+                'CREATE INDEX IF NOT EXISTS guardrail_entry_written '
+                'ON guardrail_entry (written)'
+            )
+            self._connection.execute(
+                'CREATE TABLE IF NOT EXISTS guardrail_version '
+                '(key TEXT PRIMARY KEY, value INTEGER NOT NULL, written REAL)'
+            )
+            self._connection.execute(
+                'CREATE INDEX IF NOT EXISTS guardrail_version_written '
+                'ON guardrail_version (written)'
+            )
+            self._pid = os.getpid()
+        return self._connection
+
+    def _execute(self, sql, params=()):
+        with self._lock:
+            return self.connection.execute(sql, params).fetchone()
+
+    def get(self, key):
+        row = self._execute(
+            'SELECT value, expires FROM guardrail_entry WHERE key = ?',
+            (key, ),
+        )
+        if row is None or (row[1] is not None and row[1] < time.time()):
+            return None
+        return json.loads(row[0])
+
+    def set(self, key, value):
+        now = time.time()
+        expires = now + self.timeout if self.timeout is not None else None
+        self._execute(
+            'INSERT OR REPLACE INTO guardrail_entry VALUES (?, ?, ?, ?)',
+            (key, json.dumps(value), expires, now),
+        )
+        self._count_write()
+
+    def _count_write(self):
+        self._writes += 1
+        if not self._writes % self.prune_interval:
+            self._prune()
+
+    def _prune(self):
+        if self.max_size is not None:
+            for table in ('guardrail_entry', 'guardrail_version'):
+                self._execute(
+                    'DELETE FROM {0} WHERE key IN ('
+                    'SELECT key FROM {0} ORDER BY written DESC '
+                    'LIMIT -1 OFFSET ?)'.format(table),
+                    (self.max_size, ),
+                )
+        if self.timeout is not None:
+            self._execute(
+                'DELETE FROM guardrail_version WHERE written < ?',
+                (time.time() - self.timeout, ),
+            )
+
+    def delete(self, key):
+        self._execute('DELETE FROM guardrail_entry WHERE key = ?', (key, ))
+
+    def get_version(self, key):
+        row = self._execute(
+            'SELECT value, written FROM guardrail_version WHERE key = ?',
+            (key, ),
+        )
+        if row is not None and (
+                self.timeout is None or row[1] >= time.time() - self.timeout):
+            return row[0]
+        return self._write_version(key, 0)
+
+    def incr_version(self, key):
+        return self._write_version(key, 1)
+
+    def _write_version(self, key, increment):
+        """Create the counter for `key` if missing or expired, then add
+        `increment` to it.
+
+        :returns: New counter value
+        """
+        now = time.time()
+        with self._lock:
+            connection = self.connection
+            connection.execute('BEGIN IMMEDIATE')
+            try:
+                if self.timeout is not None:
+                    connection.execute(
+                        'DELETE FROM guardrail_version WHERE key = ? AND written < ?',
+                        (key, now - self.timeout),
+                    )
+                connection.execute(
+                    'INSERT OR IGNORE INTO guardrail_version VALUES (?, ?, ?)',
+                    (key, _new_version(), now),
+                )
+                if increment:
+                    connection.execute(
+                        'UPDATE guardrail_version SET value = value + ?, written = ? '
+                        'WHERE key = ?',
+                        (increment, now, key),
+                    )
+                value = connection.execute(
+                    'SELECT value FROM guardrail_version WHERE key = ?',
+                    (key, ),
+                ).fetchone()[0]
+            except Exception:
+                connection.execute('ROLLBACK')
+                raise
+            connection.execute('COMMIT')
+        self._count_write()
+        return value
+
+    def clear(self):
+        self._execute('DELETE FROM guardrail_entry')
+
+
+class BloomFilter(object):
+    """Bloom filter over hashable keys, sized for `capacity` keys at a false
+    positive rate of `error_rate`. Keys are hashed with the built-in `hash`,
+    so filters must not be shared between processes.
+
+    :param int capacity: Expected number of keys
+    :param float error_rate: False positive rate at `capacity` keys
+    """
+    def __init__(self, capacity, error_rate=0.01):
+        capacity = max(int(capacity), 1)
+        self.capacity = capacity
+        self.size = max(int(math.ceil(
+            -capacity * math.log(error_rate) / math.log(2) ** 2
+        )), 8)
+        self.hashes = max(int(round(self.size / float(capacity) * math.log(2))), 1)
+        self.bits = bytearray((self.size + 7) // 8)
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def _positions(self, key):
+        # Double hashing, deriving the second hash from the high bits of the first
+        first, size = hash(key), self.size
+        position, step = first % size, ((first >> 32) | 1) % size
+        positions = []
+        for _ in range(self.hashes):
+            positions.append(position)
+            position = (position + step) % size
+        return positions
+
+    def add(self, key):
+        """Add `key` to the filter.
+
+        :param key: Hashable key
+        """
+        self.update((key, ))
+
+    def update(self, keys):
+        """Add each of `keys` to the filter.
+
+        :param keys: Iterable of hashable keys
+        """
+        size, hashes, bits = self.size, range(self.hashes), self.bits
+        count = 0
+        with self._lock:
+            for key in keys:
+                first = hash(key)
+                position, step = first % size, ((first >> 32) | 1) % size
+                for _ in hashes:
+                    bits[position >> 3] |= 1 << (position & 7)
+                    position = (position + step) % size
+                count += 1
+            self.count += count
+
+    def __contains__(self, key):
+        bits = self.bits
+        for position in self._positions(key):
+            if not bits[position >> 3] & (1 << (position & 7)):
+                return False
+        return True
+
+    @property
+    def memory(self):
+        """Size of the bit array in bytes."""
+        return len(self.bits)
+
+    @property
+    def false_positive_rate(self):
+        """Estimated false positive rate at the current number of keys."""
+        return (1 - math.exp(-self.hashes * self.count / float(self.size))) ** self.hashes
+
+
+class NegativeCache(object):
+    """Bloom filters of the permissions granted on each permission join table,
+    checked before querying so that checks for permissions that were never
+    granted return `False` without a query. Each table's filter is built from
+    the table on its first check, sized for :attr:`growth` times the number of
+    rows, and updated before each grant made through the owning manager.
+    Revocations are not removed from filters; call :meth:`rebuild` to drop them
+    and to resize filters that have outgrown their capacity.
+
+    Note: Grants made elsewhere, such as by other processes or in raw SQL, are
+    not added to filters, and checks for them wrongly return `False` until the
+    filter is rebuilt. Use only where all grants go through managers sharing
+    this cache, or rebuild on a schedule that bounds staleness.
+
+    :param float error_rate: Target false positive rate
+    :param int min_capacity: Minimum number of permissions per filter
+    :param float growth: Capacity of each filter as a multiple of the number of
+        rows when built
+    :param int recent: Number of recent grants added to each filter when built
+    """
+    def __init__(self, error_rate=0.01, min_capacity=1024, growth=2.0, recent=10000):
+        self.error_rate = error_rate
+        self.min_capacity = min_capacity
+        self.growth = growth
+        self.filters = {}
+        #: Seconds spent on the latest build of each table's filter
+        self.build_times = {}
+        #: Number of checks answered without a query
+        self.hits = 0
+        #: Number of checks passed on to the manager
+        self.misses = 0
+        self._recent = collections.deque(maxlen=recent)
+        self._building = set()
+        self._lock = threading.Lock()
+
+    def may_contain(self, manager, schema, agent_id, target_id, permissions):
+        """Check whether any of `permissions` may have been granted between
+        the agent with primary key `agent_id` and the target with primary key
+        `target_id`, building the filter for `schema` from `manager` if needed.
+
+        :returns: `False` if none of `permissions` have been granted
+        """
+        bloom = self.filters.get(schema)
+        if bloom is None:
+            bloom = self.build(manager, schema)
+            if bloom is None:
+                self.misses += 1
+                return True
+        for permission in permissions:
+            if (agent_id, target_id, permission) in bloom:
+                self.misses += 1
+                return True
+        self.hits += 1
+        return False
+
+    def add(self, schema, keys):
+        """Record grants on `schema`, before they are written.
+
+        :param keys: Iterable of (agent primary key, target primary key,
+            permission) triples
+        """
+        keys = list(keys)
+        with self._lock:
+            self._recent.extend((schema, key) for key in keys)
+            bloom = self.filters.get(schema)
+        if bloom is not None:
+            bloom.update(keys)
+
+    def build(self, manager, schema):
+        """Build the filter for `schema` from the permissions stored by
+        `manager`, replacing any existing filter once built. The most recent
+        grants recorded by :meth:`add` are added to the new filter, covering
+        grants whose transactions are open while the table is read.
+
+        :param manager: Permission manager; see
+            :meth:`BasePermissionManager._iter_permissions`
+        :param schema: Permission join table
+        :returns: New filter, or `None` if the filter is already being built
+        """
+        with self._lock:
+            if schema in self._building:
+                return None
+            self._building.add(schema)
+        try:
+            start = timeit.default_timer()
+            keys = list(manager._iter_permissions(schema))
+            bloom = BloomFilter(
+                max(len(keys) * self.growth, self.min_capacity),
+                self.error_rate,
+            )
+            bloom.update(keys)
+            with self._lock:
+                bloom.update(key for each, key in self._recent if each is schema)
+                self.filters[schema] = bloom
+            self.build_times[schema] = timeit.default_timer() - start
+            return bloom
+        finally:
+            with self._lock:
+                self._building.discard(schema)
+
+    def rebuild(self, manager, schemas=None):
+        """Rebuild filters from the permissions stored by `manager`.
+
+        :param manager: Permission manager
+        :param schemas: Optional iterable of join tables; if not provided,
+            rebuild every existing filter
+        :returns: Seconds spent rebuilding
+        """
+        start = timeit.default_timer()
+        for schema in (schemas if schemas is not None else list(self.filters)):
+            self.build(manager, schema)
+        return timeit.default_timer() - start
+
+    def get_stats(self, schema):
+        """Describe the filter for `schema`.
+
+        :returns: Dictionary with the filter's `capacity`, number of
+            permissions added (`count`), estimated `false_positive_rate`,
+            `memory` in bytes, and latest `build_time` in seconds, or `None`
+            if the filter has not been built
+        """
+        bloom = self.filters.get(schema)
+        if bloom is None:
+            return None
+        return {
+            'capacity': bloom.capacity,
+            'count': bloom.count,
+            'false_positive_rate': bloom.false_positive_rate,
+            'memory': bloom.memory,
+            'build_time': self.build_times.get(schema),
+        }
+
+    @property
+    def memory(self):
+        """Total size of all filters in bytes."""
+        return sum(bloom.memory for bloom in list(self.filters.values()))
+
+    def clear(self):
+        """Drop all filters and reset hit and miss counts. Filters are rebuilt
+        on their next check.
+        """
+        self.filters.clear()
+        self.build_times.clear()
+        self.hits = 0
+        self.misses = 0
@@ -18,3 +18,19 @@ class PermissionExists(GuardrailException):
 
 class PermissionNotFound(GuardrailException):
     pass
+
+
+class UnknownPermission(GuardrailException):
+    pass
+
+
+class CompactSchemaNotSupported(GuardrailException):
+    pass
+
+
+class MembershipExists(GuardrailException):
+    pass
+
+
+class MembershipNotFound(GuardrailException):
+    pass
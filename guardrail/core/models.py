@@ -5,17 +5,129 @@ and optionally :class:`BaseLoader` as well.
 """
 
 import abc
+import inspect
+import functools
+import contextlib
+import collections
 
 import six
 
+from guardrail.core import signals
 from guardrail.core import exceptions
 from guardrail.core.registry import registry
 
 
+#: Permission label for memberships in membership join tables
+MEMBER = 'member'
+
+
 def _get_class(value):
     return value if isinstance(value, type) else type(value)
 
 
+def _chunks(values, size):
+    for start in six.moves.range(0, len(values), size):
+        yield values[start:start + size]
+
+
+def _get_bits(schema):
+    return getattr(schema, 'permission_bits', None)
+
+
+def _compact_not_supported(obj):
+    return '{0} does not support compact schemas'.format(type(obj).__name__)
+
+
+def _instrumented(signal, effective=True):
+    """Send `signal` on each call to the decorated manager method, which takes
+    agent and target records as its first arguments. When no listeners are
+    connected, the method is called directly.
+
+    :param Signal signal: Signal to send
+    :param bool effective: Report the effective permission table, rather than
+        the direct permission table
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapped(self, *args, **kwargs):
+            if not signal.receivers:
+                return func(self, *args, **kwargs)
+            arguments = inspect.getcallargs(func, self, *args, **kwargs)
+            del arguments['self']
+            try:
+                schema = self._get_permission_schema(
+                    arguments['agent'], arguments['target'],
+                    arguments.get('Agent'), arguments.get('Target'),
+                    effective=effective,
+                )
+            except exceptions.GuardrailException:
+                schema = None
+            return signal.call(
+                lambda: func(self, *args, **kwargs),
+                self, schema, arguments, self._count_queries(schema),
+            )
+        return wrapped
+    return decorator
+
+
+class PermissionBits(object):
+    """Permission vocabulary for compact permission schemas, which store all
+    permissions linking an agent-target pair as a single integer bitmask.
+
+    :param permissions: Sequence of permissions; the permission at index `i`
+        is stored as bit `i`
+    """
+    #: Maximum number of permissions that fit in a signed 64-bit column
+    max_size = 63
+
+    def __init__(self, permissions):
+        self.permissions = tuple(permissions)
+        if len(set(self.permissions)) != len(self.permissions):
+            raise ValueError('Permissions must be unique')
+        if len(self.permissions) > self.max_size:
+            raise ValueError(
+                'Compact schemas support at most {0} permissions'.format(self.max_size)
+            )
+        self.bits = {
+            permission: 1 << index
+            for index, permission in enumerate(self.permissions)
+        }
+
+    def encode(self, permissions):
+        """Encode `permissions` as a bitmask, ignoring undeclared permissions.
+
+        :param permissions: Iterable of permissions
+        :returns: Bitmask
+        """
+        mask = 0
+        for permission in permissions:
+            mask |= self.bits.get(permission, 0)
+        return mask
+
+    def get_bit(self, permission):
+        """Get the bit for `permission`.
+
+        :param str permission: Permission
+        :raises: `UnknownPermission` if `permission` has not been declared
+        """
+        try:
+            return self.bits[permission]
+        except KeyError:
+            raise exceptions.UnknownPermission(
+                'Permission {0!r} not declared'.format(permission)
+            )
+
+    def decode(self, mask):
+        """Decode bitmask `mask` to a set of permissions."""
+        return {
+            permission for permission, bit in six.iteritems(self.bits)
+            if mask & bit
+        }
+
+    def has_any(self, mask, permissions):
+        return bool(mask & self.encode(permissions))
+
+
 @six.add_metaclass(abc.ABCMeta)
 class BasePermissionManager(object):
     """Abstract base class for permission managers. Concrete subclasses must
@@ -24,10 +136,21 @@ class BasePermissionManager(object):
 
     :param _Registry registry: Optional registry object; use global `registry`
         if not provided.
+    :param cache: Optional permission cache; see :mod:`guardrail.core.cache`
+    :param negative_cache: Optional :class:`NegativeCache`, checked before
+        querying for permissions; see :mod:`guardrail.core.cache`
     """
-    def __init__(self, registry=registry):
+    #: Maximum number of records bound to a single `IN` clause
+    chunk_size = 500
+    #: Number of rows fetched at a time when streaming query results
+    batch_size = 1000
+
+    def __init__(self, registry=registry, cache=None, negative_cache=None):
         self.registry = registry
+        self.cache = cache
+        self.negative_cache = negative_cache
 
+    @_instrumented(signals.get_permissions)
     def get_permissions(self, agent, target,
                         Agent=None, Target=None, custom=None):
         """List all permissions record `agent` has on record `target`.
@@ -43,12 +166,16 @@ class BasePermissionManager(object):
             the permission join table
         :returns: Set of permission labels between `agent` and `target`
         """
-        schema = self._get_permission_schema(agent, target, Agent, Target)
-        return self._get_permissions(
+        schema = self._get_permission_schema(agent, target, Agent, Target, effective=True)
+        key = self._get_cache_key(agent, target, schema, Agent, Target, custom)
+        if key is not None:
+            return set(self._get_cached_permissions(agent, target, schema, key))
+        return self._query_permissions(
             agent, target, schema,
             Agent=Agent, Target=Target, custom=custom
         )
 
+    @_instrumented(signals.has_permission)
     def has_permission(self, agent, target, permission,
                        Agent=None, Target=None, custom=None):
         """Check whether record `agent` has permission `permission` on record
@@ -66,24 +193,161 @@ class BasePermissionManager(object):
             the permission join table
         :returns: Record `agent` has permission `permission` on record `target`
         """
-        schema = self._get_permission_schema(agent, target, Agent, Target)
+        schema = self._get_permission_schema(agent, target, Agent, Target, effective=True)
+        permissions = self.registry.get_implying([permission])
+        if not self._may_have_permission(agent, target, schema, permissions,
+                                         Agent, Target, custom):
+            return False
+        key = self._get_cache_key(agent, target, schema, Agent, Target, custom)
+        if key is not None:
+            return permission in self._get_cached_permissions(agent, target, schema, key)
+        bits = _get_bits(schema)
+        if bits is not None:
+            return bits.has_any(self._get_mask(
+                agent, target, schema,
+                Agent=Agent, Target=Target, custom=custom,
+            ), permissions)
+        if len(permissions) > 1:
+            return self._has_any_permission(
+                agent, target, schema, permissions,
+                Agent=Agent, Target=Target, custom=custom,
+            )
         return self._has_permission(
             agent, target, schema, permission,
             Agent=Agent, Target=Target, custom=custom,
         )
 
+    @_instrumented(signals.has_any_permission)
+    def has_any_permission(self, agent, target, permissions,
+                           Agent=None, Target=None, custom=None):
+        """Check whether record `agent` has at least one of `permissions` on
+        record `target`, in a single query.
+
+        :param agent: Agent record
+        :param target: Target record
+        :param permissions: Iterable of permissions
+        :param Agent: Optional agent schema; provide if permission is not
+            directly related to `agent`
+        :param Target: Optional target schema; provide if permission is not
+            directly related to `target`
+        :param custom: Optional callable for customizing permission queries; if
+            provided, will be passed the original query, `agent`, `target`, and
+            the permission join table
+        :returns: Record `agent` has any of `permissions` on record `target`
+        """
+        permissions = set(permissions)
+        schema = self._get_permission_schema(agent, target, Agent, Target, effective=True)
+        implying = self.registry.get_implying(permissions)
+        if not self._may_have_permission(agent, target, schema, implying,
+                                         Agent, Target, custom):
+            return False
+        key = self._get_cache_key(agent, target, schema, Agent, Target, custom)
+        if key is not None:
+            cached = self._get_cached_permissions(agent, target, schema, key)
+            return not permissions.isdisjoint(cached)
+        permissions = implying
+        bits = _get_bits(schema)
+        if bits is not None:
+            return bits.has_any(self._get_mask(
+                agent, target, schema,
+                Agent=Agent, Target=Target, custom=custom,
+            ), permissions)
+        return self._has_any_permission(
+            agent, target, schema, permissions,
+            Agent=Agent, Target=Target, custom=custom,
+        )
+
+    @_instrumented(signals.has_all_permissions)
+    def has_all_permissions(self, agent, target, permissions,
+                            Agent=None, Target=None, custom=None):
+        """Check whether record `agent` has every one of `permissions` on
+        record `target`, in a single query.
+
+        :param agent: Agent record
+        :param target: Target record
+        :param permissions: Iterable of permissions
+        :param Agent: Optional agent schema; provide if permission is not
+            directly related to `agent`
+        :param Target: Optional target schema; provide if permission is not
+            directly related to `target`
+        :param custom: Optional callable for customizing permission queries; if
+            provided, will be passed the original query, `agent`, `target`, and
+            the permission join table
+        :returns: Record `agent` has all of `permissions` on record `target`
+        """
+        permissions = set(permissions)
+        schema = self._get_permission_schema(agent, target, Agent, Target, effective=True)
+        key = self._get_cache_key(agent, target, schema, Agent, Target, custom)
+        if key is not None:
+            cached = self._get_cached_permissions(agent, target, schema, key)
+            return permissions.issubset(cached)
+        implied = any(
+            len(self.registry.get_implying([permission])) > 1
+            for permission in permissions
+        )
+        if implied or _get_bits(schema) is not None:
+            return permissions.issubset(self._query_permissions(
+                agent, target, schema,
+                Agent=Agent, Target=Target, custom=custom,
+            ))
+        return self._has_all_permissions(
+            agent, target, schema, permissions,
+            Agent=Agent, Target=Target, custom=custom,
+        )
+
+    @_instrumented(signals.add_permission, effective=False)
     def add_permission(self, agent, target, permission):
         """Grant permission `permission` to record `agent` on record `target`.
 
         :param agent: Agent record
         :param target: Target record
         :param str permission: Permission
-        :returns: Created permission record
+        :returns: Created permission record, or `None` for compact schemas
         :raises: `PermissionExistsError` if permission has already been granted
+        :raises: `UnknownPermission` if `permission` has not been declared on a
+            compact schema
         """
         schema = self._get_permission_schema(agent, target)
-        return self._add_permission(agent, target, schema, permission)
+        unrecorded = self._add_negative_cache([(agent, target, permission)], schema)
+        bits = _get_bits(schema)
+        if bits is not None:
+            if not self._set_bit(agent, target, schema, bits.get_bit(permission)):
+                raise exceptions.PermissionExists()
+            row = None
+        else:
+            row = self._add_permission(agent, target, schema, permission)
+        self._add_negative_cache(unrecorded, schema)
+        self._invalidate_cache(agent, target, schema)
+        self._update_effective([(agent, target, permission)], schema, True)
+        return row
 
+    @_instrumented(signals.ensure_permission, effective=False)
+    def ensure_permission(self, agent, target, permission):
+        """Grant permission `permission` to record `agent` on record `target`
+        if it has not already been granted. Unlike :meth:`add_permission`,
+        existing grants are not treated as errors, and do not abort the
+        surrounding transaction.
+
+        :param agent: Agent record
+        :param target: Target record
+        :param str permission: Permission
+        :returns: `True` if the permission was granted, `False` if it had
+            already been granted
+        """
+        schema = self._get_permission_schema(agent, target)
+        unrecorded = self._add_negative_cache([(agent, target, permission)], schema)
+        bits = _get_bits(schema)
+        if bits is not None:
+            created = self._set_bit(agent, target, schema, bits.get_bit(permission))
+        else:
+            created = self._ensure_permission(agent, target, schema, permission)
+        self._add_negative_cache(unrecorded, schema)
+        if created:
+            self._invalidate_cache(agent, target, schema)
+            self._update_effective([(agent, target, permission)], schema, True)
+        return created
+
+    @_instrumented(signals.remove_permission, effective=False)
     def remove_permission(self, agent, target, permission):
         """Revoke permission `permission` from record `agent` on record `target`.
 
@@ -93,9 +357,422 @@ class BasePermissionManager(object):
         :raises: `PermissionNotFound` if permission has not been granted
         """
         schema = self._get_permission_schema(agent, target)
-        return self._remove_permission(agent, target, schema, permission)
+        bits = _get_bits(schema)
+        try:
+            if bits is None:
+                self._remove_permission(agent, target, schema, permission)
+            else:
+                bit = bits.encode([permission])
+                if not bit or not self._clear_bit(agent, target, schema, bit):
+                    raise exceptions.PermissionNotFound
+        finally:
+            self._invalidate_cache(agent, target, schema)
+        self._update_effective([(agent, target, permission)], schema, False)
+
+    def get_permissions_many(self, agent, targets):
+        """List all permissions record `agent` has on each record in `targets`,
+        issuing one query per permission schema and chunk of
+        :attr:`chunk_size` targets.
+
+        :param agent: Agent record
+        :param targets: Iterable of target records
+        :returns: Dictionary mapping each target to its set of permissions
+        """
+        results = {}
+        for schema, group in self._group_targets(agent, targets):
+            missing = []
+            for target in group:
+                key = self._get_cache_key(agent, target, schema)
+                cached = self.cache.get(key) if key is not None else None
+                if cached is not None:
+                    results[target] = set(cached)
+                else:
+                    missing.append(target)
+            for chunk in _chunks(missing, self.chunk_size):
+                permissions = self._query_permissions_many(agent, chunk, schema)
+                for target in chunk:
+                    results[target] = set(permissions.get(self._get_id(target), ()))
+                    key = self._get_cache_key(agent, target, schema)
+                    if key is not None:
+                        self.cache.set(key, frozenset(results[target]))
+        return results
+
+    def has_permission_many(self, agent, targets, permission):
+        """Check whether record `agent` has permission `permission` on each
+        record in `targets`, issuing one query per permission schema and chunk
+        of :attr:`chunk_size` targets.
+
+        :param agent: Agent record
+        :param targets: Iterable of target records
+        :param str permission: Permission
+        :returns: Dictionary mapping each target to whether `agent` has
+            permission `permission` on it
+        """
+        if self.cache is not None:
+            return {
+                target: permission in permissions
+                for target, permissions in
+                six.iteritems(self.get_permissions_many(agent, targets))
+            }
+        results = {}
+        for schema, group in self._group_targets(agent, targets):
+            for chunk in _chunks(group, self.chunk_size):
+                target_ids = self._query_permission_many(
+                    agent, chunk, schema, self.registry.get_implying([permission]),
+                )
+                for target in chunk:
+                    results[target] = self._get_id(target) in target_ids
+        return results
+
+    def add_permissions(self, permissions, skip_duplicates=False):
+        """Grant many permissions, batching inserts per permission schema and
+        chunk of :attr:`chunk_size` permissions.
+
+        :param permissions: Iterable of (agent, target, permission) triples
+        :param bool skip_duplicates: Skip permissions that have already been
+            granted, rather than raising `PermissionExists`
+        :returns: Number of permissions granted
+        :raises: `PermissionExists` if any permission has already been granted
+            and `skip_duplicates` is not set
+        """
+        count = 0
+        for schema, rows in self._group_permissions(permissions):
+            count += self._add_rows(rows, schema, skip_duplicates)
+            self._update_effective(rows, schema, True)
+        return count
+
+    def remove_permissions(self, permissions):
+        """Revoke many permissions, batching deletes per permission schema and
+        chunk of :attr:`chunk_size` permissions. Permissions that have not been
+        granted are ignored.
+
+        :param permissions: Iterable of (agent, target, permission) triples
+        :returns: Number of permissions revoked
+        """
+        count = 0
+        for schema, rows in self._group_permissions(permissions):
+            count += self._remove_rows(rows, schema)
+            self._update_effective(rows, schema, False)
+        return count
+
+    def filter_targets(self, agent, Target, permission):
+        """Build a query for records of schema `Target` on which record `agent`
+        has permission `permission`. The query is lazy and backend-native, so it
+        can be further filtered, ordered, and paginated in the database.
+
+        :param agent: Agent record
+        :param Target: Target schema class
+        :param str permission: Permission
+        :returns: Query over `Target` records
+        """
+        self._check_saved(agent)
+        schema = self.registry.get_effective_permission(_get_class(agent), Target)
+        permissions = self.registry.get_implying([permission])
+        return self._filter_targets(agent, Target, schema, permissions)
+
+    def agents_with_permission(self, target, permission, Agent):
+        """Iterate over records of schema `Agent` that have permission
+        `permission` on record `target`. Rows are fetched from the database in
+        batches of :attr:`batch_size` rather than loaded at once.
+
+        :param target: Target record
+        :param str permission: Permission
+        :param Agent: Agent schema class
+        :returns: Generator of `Agent` records
+        """
+        self._check_saved(target)
+        schema = self.registry.get_effective_permission(Agent, _get_class(target))
+        permissions = self.registry.get_implying([permission])
+        return self._agents_with_permission(target, Agent, schema, permissions)
+
+    def add_member(self, member, group):
+        """Add record `member` to group record `group`, so that `member`
+        inherits the permissions of `group`. The schemas of `member` and
+        `group` must have been linked with :meth:`_Registry.group`.
+
+        :param member: Member agent record
+        :param group: Group agent record
+        :raises: `MembershipExists` if `member` already belongs to `group`
+        """
+        schema = self._get_membership_schema(member, group)
+        try:
+            self._add_permission(member, group, schema, MEMBER)
+        except exceptions.PermissionExists:
+            raise exceptions.MembershipExists()
+        self._refresh_group(member, group)
+
+    def remove_member(self, member, group):
+        """Remove record `member` from group record `group`, revoking the
+        permissions `member` inherited from `group`.
+
+        :param member: Member agent record
+        :param group: Group agent record
+        :raises: `MembershipNotFound` if `member` does not belong to `group`
+        """
+        schema = self._get_membership_schema(member, group)
+        try:
+            self._remove_permission(member, group, schema, MEMBER)
+        except exceptions.PermissionNotFound:
+            raise exceptions.MembershipNotFound()
+        self._refresh_group(member, group)
+
+    def get_groups(self, member):
+        """List the group records to which record `member` belongs.
+
+        :param member: Member agent record
+        :returns: List of group agent records
+        """
+        self._check_saved(member)
+        return [
+            group
+            for Group in self.registry.get_groups(_get_class(member))
+            for group in self._filter_targets(
+                member, Group,
+                self.registry.get_membership(_get_class(member), Group),
+                {MEMBER},
+            )
+        ]
+
+    def refresh_permissions(self, agent):
+        """Rebuild the effective permissions of record `agent` from its own
+        permissions and those of its groups. Effective permissions are kept up
+        to date as permissions and memberships change through the manager; call
+        this method after changing either by other means, e.g. after deleting a
+        group record, or to populate new effective permission tables.
+
+        :param agent: Member agent record
+        """
+        self._check_saved(agent)
+        Agent = _get_class(agent)
+        groups = self.get_groups(agent)
+        for Target in self.registry.targets:
+            schemas = self._get_effective_schemas(Agent, Target)
+            if schemas is None:
+                continue
+            sources = [(agent, schemas[0]), (agent, schemas[1])]
+            sources.extend(self._get_group_sources(groups, Target))
+            targets = collections.OrderedDict()
+            for source, schema in sources:
+                for target in self._filter_targets(source, Target, schema, None):
+                    targets.setdefault(self._get_id(target), target)
+            self._refresh_effective(agent, list(targets.values()), Target, groups)
+
+    def _get_effective_schemas(self, Agent, Target):
+        """Look up the permission and effective permission tables linking
+        schemas `Agent` and `Target`.
+
+        :returns: Tuple of join tables, or `None` if the schemas are not linked
+            or `Agent` does not belong to groups
+        """
+        try:
+            schema = self.registry.get_permission(Agent, Target)
+        except exceptions.SchemaNotFound:
+            return None
+        effective = self.registry.get_effective_permission(Agent, Target)
+        return (schema, effective) if effective is not schema else None
+
+    def _get_membership_schema(self, member, group):
+        self._check_saved(member, group)
+        return self.registry.get_membership(_get_class(member), _get_class(group))
+
+    def _get_group_sources(self, groups, Target):
+        """Pair each record in `groups` with its permission join table for
+        schema `Target`, skipping groups without one.
+
+        :returns: List of (group, schema) pairs
+        """
+        sources = []
+        for group in groups:
+            try:
+                schema = self.registry.get_permission(_get_class(group), Target)
+            except exceptions.SchemaNotFound:
+                continue
+            sources.append((group, schema))
+        return sources
+
+    def _refresh_group(self, member, group):
+        """Recompute the effective permissions of `member` on each record on
+        which `group` has permissions.
+        """
+        groups = self.get_groups(member)
+        for Target in self.registry.targets:
+            sources = self._get_group_sources([group], Target)
+            if not sources:
+                continue
+            targets = list(self._filter_targets(group, Target, sources[0][1], None))
+            self._refresh_effective(member, targets, Target, groups)
+
+    def _refresh_effective(self, agent, targets, Target, groups=None):
+        """Recompute the effective permissions of `agent` on `targets`, of
+        schema `Target`, from its own permissions and those of `groups`,
+        adding and removing rows in the effective permission table as needed.
+
+        :param agent: Member agent record
+        :param list targets: Target records
+        :param Target: Target schema class
+        :param list groups: Group records of `agent`; looked up if not provided
+        """
+        schemas = self._get_effective_schemas(_get_class(agent), Target)
+        if schemas is None:
+            return
+        schema, effective = schemas
+        if groups is None:
+            groups = self.get_groups(agent)
+        sources = [(agent, schema)]
+        sources.extend(self._get_group_sources(groups, Target))
+        for chunk in _chunks(targets, self.chunk_size):
+            expected = collections.defaultdict(set)
+            for source, schema in sources:
+                for target_id, permissions in six.iteritems(
+                    self._load_permissions_many(source, chunk, schema)
+                ):
+                    expected[target_id].update(permissions)
+            current = self._load_permissions_many(agent, chunk, effective)
+            grants, revokes = [], []
+            for target in chunk:
+                target_id = self._get_id(target)
+                wanted = expected.get(target_id, set())
+                existing = current.get(target_id, set())
+                grants.extend((agent, target, each) for each in wanted - existing)
+                revokes.extend((agent, target, each) for each in existing - wanted)
+            self._add_rows(grants, effective, False)
+            self._remove_rows(revokes, effective)
+
+    def _update_effective(self, rows, schema, granted):
+        """Propagate (agent, target, permission) triples granted on or revoked
+        from permission join table `schema` to the effective permission tables
+        of the agents themselves, and of the members of agents that are groups.
+        Grants are copied directly; revocations recompute the affected pairs,
+        since revoked permissions may still be granted by other groups.
+
+        :param list rows: (agent, target, permission) triples sharing `schema`
+        :param schema: Permission join table
+        :param bool granted: Whether `rows` were granted rather than revoked
+        """
+        Agent, Target = _get_class(rows[0][0]), _get_class(rows[0][1])
+        updates = []
+        effective = self.registry.get_effective_permission(Agent, Target)
+        if effective is not schema:
+            updates.append((effective, rows))
+        for Member in self.registry.get_members(Agent):
+            schemas = self._get_effective_schemas(Member, Target)
+            if schemas is None:
+                continue
+            effective = schemas[1]
+            membership = self.registry.get_membership(Member, Agent)
+            members = {}
+            for group, _, _ in rows:
+                members.setdefault(self._get_id(group), list(
+                    self._agents_with_permission(group, Member, membership, {MEMBER})
+                ))
+            updates.append((effective, [
+                (member, target, permission)
+                for group, target, permission in rows
+                for member in members[self._get_id(group)]
+            ]))
+        for effective, effective_rows in updates:
+            if granted:
+                self._add_rows(effective_rows, effective, True)
+                continue
+            targets = collections.OrderedDict()
+            for agent, target, _ in effective_rows:
+                agent_id = self._get_id(agent)
+                targets.setdefault(agent_id, (agent, collections.OrderedDict()))
+                targets[agent_id][1].setdefault(self._get_id(target), target)
+            for agent, agent_targets in targets.values():
+                self._refresh_effective(agent, list(agent_targets.values()), Target)
+
+    def _add_rows(self, rows, schema, skip_duplicates):
+        """Grant (agent, target, permission) triples on `schema`.
+
+        :returns: Number of permissions granted
+        """
+        unrecorded = self._add_negative_cache(rows, schema)
+        if _get_bits(schema) is not None:
+            count = self._set_bits_many(rows, schema, skip_duplicates)
+        else:
+            if skip_duplicates:
+                rows = self._filter_existing(rows, schema)
+            count = 0
+            for chunk in _chunks(rows, self.chunk_size):
+                self._add_permissions(chunk, schema)
+                count += len(chunk)
+        self._add_negative_cache(unrecorded, schema)
+        self._invalidate_cache_many(rows, schema)
+        return count
+
+    def _remove_rows(self, rows, schema):
+        """Revoke (agent, target, permission) triples from `schema`.
+
+        :returns: Number of permissions revoked
+        """
+        bits = _get_bits(schema)
+        if bits is not None:
+            count = sum(
+                self._clear_bit(agent, target, schema, bits.encode([permission]))
+                for agent, target, permission in rows
+                if permission in bits.bits
+            )
+            self._invalidate_cache_many(rows, schema)
+            return count
+        count = 0
+        for chunk in _chunks(rows, self.chunk_size):
+            count += self._remove_permissions(chunk, schema)
+        self._invalidate_cache_many(rows, schema)
+        return count
+
+    def _group_permissions(self, permissions):
+        """Group (agent, target, permission) triples by permission schema.
+
+        :returns: List of (schema, triples) pairs
+        """
+        groups = collections.OrderedDict()
+        for agent, target, permission in permissions:
+            self._check_saved(agent, target)
+            key = (_get_class(agent), _get_class(target))
+            groups.setdefault(key, []).append((agent, target, permission))
+        return [
+            (self.registry.get_permission(*key), rows)
+            for key, rows in six.iteritems(groups)
+        ]
+
+    def _filter_existing(self, rows, schema):
+        """Drop duplicate triples, and triples that have already been granted.
 
-    def _get_permission_schema(self, agent, target, Agent=None, Target=None):
+        :param list rows: (agent, target, permission) triples
+        :param schema: Permission join table
+        :returns: List of new triples
+        """
+        unique = collections.OrderedDict()
+        for agent, target, permission in rows:
+            key = (self._get_id(agent), self._get_id(target), permission)
+            unique.setdefault(key, (agent, target, permission))
+        results = []
+        for chunk in _chunks(list(unique), self.chunk_size):
+            existing = self._get_existing_permissions(
+                [unique[key] for key in chunk], schema,
+            )
+            results.extend(unique[key] for key in chunk if key not in existing)
+        return results
+
+    def _group_targets(self, agent, targets):
+        """Group `targets` by the permission schema linking each to `agent`.
+
+        :returns: List of (schema, targets) pairs
+        """
+        groups = collections.OrderedDict()
+        for target in targets:
+            groups.setdefault(_get_class(target), []).append(target)
+        self._check_saved(agent)
+        for group in six.itervalues(groups):
+            self._check_saved(*group)
+        return [
+            (self.registry.get_effective_permission(_get_class(agent), Target), group)
+            for Target, group in six.iteritems(groups)
+        ]
+
+    def _get_permission_schema(self, agent, target, Agent=None, Target=None,
+                               effective=False):
         """Look up join table linking `agent` and `target`, verifying that both
         records have been persisted.
 
@@ -105,16 +782,176 @@ class BasePermissionManager(object):
             directly related to `agent`
         :param Target: Optional target schema; provide if permission is not
             directly related to `target`
+        :param bool effective: Look up the effective permission table, if any,
+            for reading permissions inherited from groups
         :returns: Join table between `agent` and `target`
         :raises: `RecordNotSaved` if either record has not been persisted
         :raises: `SchemaNotFound` if no join table exists
         """
         self._check_saved(agent, target)
-        return self.registry.get_permission(
+        lookup = (
+            self.registry.get_effective_permission if effective
+            else self.registry.get_permission
+        )
+        if Agent is None and Target is None:
+            return lookup(type(agent), type(target))
+        return lookup(
             _get_class(Agent or agent),
             _get_class(Target or target),
         )
 
+    def _get_cache_key(self, agent, target, schema,
+                       Agent=None, Target=None, custom=None):
+        """Build cache key for permissions between `agent` and `target`. Queries
+        using custom schemas or filters are not cached.
+
+        :returns: Cache key, or `None` if the lookup should not be cached
+        """
+        if self.cache is None or Agent or Target or custom:
+            return None
+        agent_id, target_id = self._get_id(agent), self._get_id(target)
+        if agent_id is None or target_id is None:
+            return None
+        return (schema, agent_id, target_id)
+
+    def _may_have_permission(self, agent, target, schema, permissions,
+                             Agent=None, Target=None, custom=None):
+        """Check the negative cache for `permissions` between `agent` and
+        `target`. Queries using custom schemas or filters are not checked.
+
+        :returns: `False` if none of `permissions` have been granted, `True`
+            if they may have been
+        """
+        if self.negative_cache is None or Agent or Target or custom:
+            return True
+        agent_id, target_id = self._get_id(agent), self._get_id(target)
+        if agent_id is None or target_id is None:
+            return True
+        return self.negative_cache.may_contain(
+            self, schema, agent_id, target_id, permissions,
+        )
+
+    def _add_negative_cache(self, rows, schema):
+        """Record (agent, target, permission) triples in the negative cache
+        before granting them on `schema`, so that concurrent checks may see
+        false positives but never false negatives.
+
+        :returns: List of triples not recorded because their records have no
+            primary key yet; record these again once granted
+        """
+        if self.negative_cache is None or not rows:
+            return []
+        keys, unrecorded = [], []
+        for agent, target, permission in rows:
+            agent_id, target_id = self._get_id(agent), self._get_id(target)
+            if agent_id is None or target_id is None:
+                unrecorded.append((agent, target, permission))
+            else:
+                keys.append((agent_id, target_id, permission))
+        self.negative_cache.add(schema, keys)
+        return unrecorded
+
+    def _get_cached_permissions(self, agent, target, schema, key):
+        permissions = self.cache.get(key)
+        if permissions is None:
+            permissions = frozenset(self._query_permissions(agent, target, schema))
+            self.cache.set(key, permissions)
+        return permissions
+
+    def _query_permissions(self, agent, target, schema,
+                           Agent=None, Target=None, custom=None):
+        """List effective permissions between `agent` and `target`, decoding
+        the stored bitmask for compact schemas and adding implied permissions.
+        """
+        bits = _get_bits(schema)
+        if bits is not None:
+            permissions = bits.decode(self._get_mask(
+                agent, target, schema,
+                Agent=Agent, Target=Target, custom=custom,
+            ))
+        else:
+            permissions = self._get_permissions(
+                agent, target, schema,
+                Agent=Agent, Target=Target, custom=custom,
+            )
+        return self.registry.get_implied(permissions)
+
+    def _query_permissions_many(self, agent, targets, schema):
+        return {
+            target_id: self.registry.get_implied(permissions)
+            for target_id, permissions in six.iteritems(
+                self._load_permissions_many(agent, targets, schema)
+            )
+        }
+
+    def _load_permissions_many(self, agent, targets, schema):
+        """List stored permissions between `agent` and each record in
+        `targets`, decoding stored bitmasks for compact schemas.
+
+        :returns: Dictionary mapping target primary keys to sets of permissions
+        """
+        bits = _get_bits(schema)
+        if bits is not None:
+            return {
+                target_id: bits.decode(mask)
+                for target_id, mask in six.iteritems(
+                    self._get_masks(agent, targets, schema)
+                )
+            }
+        return self._get_permissions_many(agent, targets, schema)
+
+    def _query_permission_many(self, agent, targets, schema, permissions):
+        bits = _get_bits(schema)
+        if bits is not None:
+            return {
+                target_id
+                for target_id, mask in six.iteritems(
+                    self._get_masks(agent, targets, schema)
+                )
+                if bits.has_any(mask, permissions)
+            }
+        return self._has_permission_many(agent, targets, schema, permissions)
+
+    def _set_bits_many(self, rows, schema, skip_duplicates):
+        """Grant (agent, target, permission) triples on compact schema
+        `schema`, one pair at a time.
+
+        :returns: Number of permissions granted
+        """
+        bits = _get_bits(schema)
+        count = 0
+        for agent, target, permission in rows:
+            if self._set_bit(agent, target, schema, bits.get_bit(permission)):
+                count += 1
+            elif not skip_duplicates:
+                raise exceptions.PermissionExists()
+        return count
+
+    def _invalidate_cache(self, agent, target, schema):
+        key = self._get_cache_key(agent, target, schema)
+        if key is not None:
+            self.cache.invalidate(key)
+
+    def _invalidate_cache_many(self, rows, schema):
+        if self.cache is None:
+            return
+        keys = {self._get_cache_key(agent, target, schema) for agent, target, _ in rows}
+        for key in keys - {None}:
+            self.cache.invalidate(key)
+
+    def _group_rows(self, rows):
+        """Group (agent, target, permission) triples by agent and permission,
+        for building compact batched queries.
+
+        :param list rows: (agent, target, permission) triples
+        :returns: Dictionary mapping (agent primary key, permission) pairs to
+            lists of target primary keys
+        """
+        groups = collections.defaultdict(list)
+        for agent, target, permission in rows:
+            groups[(self._get_id(agent), permission)].append(self._get_id(target))
+        return groups
+
     def _check_saved(self, *records):
         for record in records:
             if not self._is_saved(record):
@@ -131,6 +968,27 @@ class BasePermissionManager(object):
         """
         pass  # pragma: no cover
 
+    def _get_id(self, record):
+        """Get the primary key of `record`. Defaults to the `id` attribute;
+        backends with other primary key conventions should override.
+
+        :param record: Record to inspect
+        :returns: Primary key value, or `None` if not yet assigned
+        """
+        return getattr(record, 'id', None)
+
+    @contextlib.contextmanager
+    def _count_queries(self, schema):
+        """Count queries issued within the block, for reporting to signal
+        listeners. Subclasses should override if the backend can count queries;
+        by default, queries are not counted.
+
+        :param schema: Permission join table or record schema, or `None`
+        :returns: Context manager yielding a callable that returns the number
+            of queries issued so far, or `None` if queries are not counted
+        """
+        yield lambda: None
+
     @abc.abstractmethod
     def _get_permissions(self, agent, target, schema):
         pass  # pragma: no cover
@@ -139,6 +997,61 @@ class BasePermissionManager(object):
     def _has_permission(self, agent, target, schema, permission):
         pass  # pragma: no cover
 
+    def _has_any_permission(self, agent, target, schema, permissions,
+                            Agent=None, Target=None, custom=None):
+        """Check whether `agent` has any of `permissions` on `target`.
+        Subclasses should override with a `permission IN (...)` existence
+        query; by default, compare against all permissions between `agent` and
+        `target`.
+        """
+        return not permissions.isdisjoint(self._get_permissions(
+            agent, target, schema,
+            Agent=Agent, Target=Target, custom=custom,
+        ))
+
+    def _has_all_permissions(self, agent, target, schema, permissions,
+                             Agent=None, Target=None, custom=None):
+        """Check whether `agent` has all of `permissions` on `target`.
+        Subclasses should override with a `COUNT(DISTINCT permission)` query;
+        by default, compare against all permissions between `agent` and
+        `target`.
+        """
+        return permissions.issubset(self._get_permissions(
+            agent, target, schema,
+            Agent=Agent, Target=Target, custom=custom,
+        ))
+
+    def _get_permissions_many(self, agent, targets, schema):
+        """List permissions between `agent` and each record in `targets`.
+        Subclasses should override with a single query; by default, check
+        each target in turn.
+
+        :param agent: Agent record
+        :param targets: Target records linked to `agent` by `schema`
+        :param schema: Permission join table
+        :returns: Dictionary mapping target primary keys to sets of permissions
+        """
+        return {
+            self._get_id(target): self._get_permissions(agent, target, schema)
+            for target in targets
+        }
+
+    def _has_permission_many(self, agent, targets, schema, permissions):
+        """Find records in `targets` on which `agent` has any of permissions
+        `permissions`. Subclasses should override with a single query; by
+        default, check each target in turn.
+
+        :param agent: Agent record
+        :param targets: Target records linked to `agent` by `schema`
+        :param schema: Permission join table
+        :param set permissions: Permissions
+        :returns: Set of matching target primary keys
+        """
+        return {
+            self._get_id(target) for target in targets
+            if self._has_any_permission(agent, target, schema, permissions)
+        }
+
     @abc.abstractmethod
     def _add_permission(self, agent, target, schema, permission):
         pass  # pragma: no cover
@@ -147,64 +1060,250 @@ class BasePermissionManager(object):
     def _remove_permission(self, agent, target, schema, permission):
         pass  # pragma: no cover
 
+    def _ensure_permission(self, agent, target, schema, permission):
+        """Grant `permission` to `agent` on `target` unless already granted.
+        Subclasses should override with an insert that ignores conflicts, or
+        an insert within a savepoint; by default, call :meth:`_add_permission`
+        and treat `PermissionExists` as success.
+
+        :returns: Whether the permission was granted
+        """
+        try:
+            self._add_permission(agent, target, schema, permission)
+        except exceptions.PermissionExists:
+            return False
+        return True
+
+    def _filter_targets(self, agent, Target, schema, permissions):
+        """Build a query for records of schema `Target` on which record `agent`
+        has any of permissions `permissions`.
+
+        :param agent: Agent record
+        :param Target: Target schema class
+        :param schema: Permission join table
+        :param set permissions: Permissions, or `None` to match records on which
+            `agent` has any permission
+        :returns: Query over `Target` records
+        """
+        raise NotImplementedError()
+
+    def _agents_with_permission(self, target, Agent, schema, permissions):
+        """Iterate over records of schema `Agent` that have any of permissions
+        `permissions` on record `target`.
+
+        :param target: Target record
+        :param Agent: Agent schema class
+        :param schema: Permission join table
+        :param set permissions: Permissions
+        :returns: Generator of `Agent` records
+        """
+        raise NotImplementedError()
+
+    def _iter_permissions(self, schema):
+        """Iterate over every permission stored in join table `schema`,
+        decoding stored bitmasks for compact schemas.
+
+        :param schema: Permission join table
+        :returns: Generator of (agent primary key, target primary key,
+            permission) triples
+        """
+        bits = _get_bits(schema)
+        for agent_id, target_id, value in self._iter_rows(schema):
+            if bits is None:
+                yield agent_id, target_id, value
+                continue
+            for permission in bits.decode(value):
+                yield agent_id, target_id, permission
+
+    def _iter_rows(self, schema):
+        """Iterate over every row of join table `schema` in a single pass,
+        fetching :attr:`batch_size` rows at a time. Required for loading
+        snapshots of permissions.
+
+        :param schema: Permission join table
+        :returns: Generator of (agent primary key, target primary key, value)
+            triples, where value is the permission, or the bitmask for compact
+            schemas
+        """
+        raise NotImplementedError()
+
+    def _get_existing_permissions(self, rows, schema):
+        """Find (agent, target, permission) triples that have already been
+        granted. Subclasses should override with a single query; by default,
+        check each triple in turn.
+
+        :param list rows: (agent, target, permission) triples
+        :param schema: Permission join table
+        :returns: Set of (agent primary key, target primary key, permission)
+            triples
+        """
+        return {
+            (self._get_id(agent), self._get_id(target), permission)
+            for agent, target, permission in rows
+            if self._has_permission(agent, target, schema, permission)
+        }
+
+    def _add_permissions(self, rows, schema):
+        """Grant permissions for (agent, target, permission) triples. Subclasses
+        should override with a batched insert; by default, add each permission
+        in turn.
+
+        :param list rows: (agent, target, permission) triples
+        :param schema: Permission join table
+        :raises: `PermissionExists` if any permission has already been granted
+        """
+        for agent, target, permission in rows:
+            self._add_permission(agent, target, schema, permission)
+
+    def _remove_permissions(self, rows, schema):
+        """Revoke permissions for (agent, target, permission) triples.
+        Subclasses should override with a batched delete; by default, remove
+        each permission in turn.
+
+        :param list rows: (agent, target, permission) triples
+        :param schema: Permission join table
+        :returns: Number of permissions revoked
+        """
+        count = 0
+        for agent, target, permission in rows:
+            try:
+                self._remove_permission(agent, target, schema, permission)
+            except exceptions.PermissionNotFound:
+                continue
+            count += 1
+        return count
+
+    def _get_mask(self, agent, target, schema,
+                  Agent=None, Target=None, custom=None):
+        """Get the permission bitmask between `agent` and `target` on compact
+        schema `schema`. Managers that do not override this hook,
+        :meth:`_set_bit`, and :meth:`_clear_bit` do not support compact
+        schemas, and raise `CompactSchemaNotSupported` when used with one.
+
+        :returns: Bitmask, or `0` if no row exists
+        """
+        raise exceptions.CompactSchemaNotSupported(_compact_not_supported(self))
+
+    def _get_masks(self, agent, targets, schema):
+        """Get permission bitmasks between `agent` and each record in `targets`
+        on compact schema `schema`. Subclasses should override with a batched
+        query; by default, get the bitmask of each target in turn.
+
+        :returns: Dictionary mapping target primary keys to bitmasks
+        """
+        return {
+            self._get_id(target): self._get_mask(agent, target, schema)
+            for target in targets
+        }
+
+    def _set_bit(self, agent, target, schema, bit):
+        """Set `bit` in the bitmask between `agent` and `target` on compact
+        schema `schema`, creating the row if needed. See :meth:`_get_mask`.
+
+        :returns: Whether `bit` was newly set
+        """
+        raise exceptions.CompactSchemaNotSupported(_compact_not_supported(self))
+
+    def _clear_bit(self, agent, target, schema, bit):
+        """Clear `bit` in the bitmask between `agent` and `target` on compact
+        schema `schema`. See :meth:`_get_mask`.
+
+        :returns: Whether `bit` had been set
+        """
+        raise exceptions.CompactSchemaNotSupported(_compact_not_supported(self))
+
 
 @six.add_metaclass(abc.ABCMeta)
 class BasePermissionSchemaFactory(object):
     """Abstract base class for schema factories that create permission join
     tables. Concrete subclasses must implement :meth:`_get_table_name` and
-    :meth:`_make_schema_dict`.
+    :meth:`_make_schema_dict`, and may implement
+    :meth:`_make_compact_schema_dict` to support compact schemas.
+
+    By default, join tables store one row per agent, target, and permission. If
+    `permissions` are declared, join tables are instead compact, storing one
+    row per agent and target with the permissions between them encoded as an
+    integer bitmask; see :class:`PermissionBits`. Membership tables linking
+    members to groups are never compact, and store each membership as
+    permission :data:`MEMBER`.
 
     :param tuple bases: Base classes for created schema classes
+    :param permissions: Optional sequence of permissions; if provided, create
+        compact join tables. Permissions may be appended to the sequence later,
+        but not removed or reordered.
     """
-    def __init__(self, bases):
+    #: Table name suffixes for each kind of join table
+    suffixes = {
+        'permission': 'permission',
+        'effective': 'effective_permission',
+        'membership': 'membership',
+    }
+
+    def __init__(self, bases, permissions=None):
         self.bases = bases
+        self.bits = PermissionBits(permissions) if permissions is not None else None
 
-    def __call__(self, agent, target):
+    def __call__(self, agent, target, kind='permission'):
         """Create a join table representing permissions between `agent` and
         `target` schemas.
 
         :param agent: Agent schema class
         :param target: Target schema class
+        :param str kind: Kind of join table: `'permission'` for granted
+            permissions, `'effective'` for materialized effective permissions,
+            or `'membership'` for memberships of `agent` records in `target`
+            records
         :returns: Created schema class
         """
+        if self.bits is not None and kind != 'membership':
+            attrs = self._make_compact_schema_dict(agent, target, kind)
+            attrs['permission_bits'] = self.bits
+        else:
+            attrs = self._make_schema_dict(agent, target, kind)
+        attrs['permission_table'] = self._make_table_name(agent, target, kind)
         schema = type(
-            self._make_schema_name(agent, target),
+            self._make_schema_name(agent, target, kind),
             self.bases,
-            self._make_schema_dict(agent, target),
+            attrs,
         )
-        self._update_parents(agent, target, schema)
+        self._update_parents(agent, target, schema, kind)
         return schema
 
-    def _update_parents(self, agent, target, schema):
+    def _update_parents(self, agent, target, schema, kind='permission'):
         """Creating a permission join table may require mutating the `agent`
         and `target` schemas. By default, take no action.
 
         :param agent: Agent schema class
         :param target: Target schema class
         :param schema: Created schema class
+        :param str kind: Kind of join table
         """
         pass
 
-    def _make_schema_name(self, agent, target):
+    def _make_schema_name(self, agent, target, kind='permission'):
         """Build class name for permission join table.
 
         :param agent: Agent schema class
         :param target: Target schema class
+        :param str kind: Kind of join table
         """
-        return '{0}{1}Permission'.format(
+        return '{0}{1}{2}'.format(
             agent.__name__,
             target.__name__,
+            ''.join(each.capitalize() for each in self.suffixes[kind].split('_')),
         )
 
-    def _make_table_name(self, agent, target):
+    def _make_table_name(self, agent, target, kind='permission'):
         """Build table name for permission join table.
 
         :param agent: Agent schema class
         :param target: Target schema class
+        :param str kind: Kind of join table
         """
-        return '{0}_{1}_permission'.format(
+        return '{0}_{1}_{2}'.format(
             self._get_table_name(agent),
             self._get_table_name(target),
+            self.suffixes[kind],
         )
 
     @abc.abstractmethod
@@ -216,15 +1315,29 @@ class BasePermissionSchemaFactory(object):
         pass  # pragma: no cover
 
     @abc.abstractmethod
-    def _make_schema_dict(self, agent, target):
+    def _make_schema_dict(self, agent, target, kind='permission'):
         """Build class dictionary for permission join table.
 
         :param agent: Agent schema class
         :param target: Target schema class
+        :param str kind: Kind of join table
         :returns: Dictionary of class members
         """
         pass  # pragma: no cover
 
+    def _make_compact_schema_dict(self, agent, target, kind='permission'):
+        """Build class dictionary for compact permission join table, with
+        `agent`, `target`, and integer `mask` columns, and a unique constraint
+        on `agent` and `target`.
+
+        :param agent: Agent schema class
+        :param target: Target schema class
+        :param str kind: Kind of join table
+        :returns: Dictionary of class members
+        :raises: `CompactSchemaNotSupported` unless overridden
+        """
+        raise exceptions.CompactSchemaNotSupported(_compact_not_supported(self))
+
 
 class BaseLoader(object):
 
@@ -236,3 +1349,17 @@ class BaseLoader(object):
     @abc.abstractmethod
     def __call__(self, *args, **kwargs):
         pass  # pragma: no cover
+
+    @abc.abstractmethod
+    def load_with_permission(self, agent, permissions, registry, *args, **kwargs):
+        """Load a target record and check whether record `agent` has any of
+        `permissions` on it, in a single query that selects the target along
+        with an `EXISTS` check on the permission join table.
+
+        :param agent: Agent record
+        :param list permissions: Permissions, any of which grants access
+        :param _Registry registry: Registry containing the permission join table
+        :returns: Tuple of target record, or `None` if not found, and whether
+            `agent` has permission on it
+        """
+        pass  # pragma: no cover
@@ -1,17 +1,51 @@
 # -*- coding: utf-8 -*-
 
+import itertools
+import threading
+
 from guardrail.core import exceptions
 
 
+def _get_mro(schema):
+    return getattr(schema, '__mro__', (schema, ))
+
+
 class _Registry(object):
     """Registry of schemas designated as permission agents and targets, as well
     as the permission tables linking each agent-target pair. Should be used as
     a singleton in ordinary use, but can be instantiated for use in tests.
+
+    Permissions may also be arranged in a hierarchy with :meth:`imply`, so that
+    granting one permission grants every permission it implies, and agents may
+    inherit the permissions of group agents declared with :meth:`group`.
+
+    Join tables are resolved along the method resolution order of the agent and
+    target schemas, so that subclasses of registered schemas (e.g. polymorphic
+    SQLAlchemy models or Django proxy models) share the join tables of their
+    nearest registered ancestors. Resolved join tables are memoized per schema
+    pair until another join table is registered.
+
+    By default, :meth:`make_schemas` creates join tables for every pair of
+    registered agent and target; declare the pairs that are needed with
+    :meth:`link` to create only those, and pass `lazy=True` to defer creating
+    each join table until it is first looked up.
     """
     def __init__(self):
         self._agents = set()
         self._targets = set()
         self._permissions = dict()
+        self._implies = dict()
+        self._implied = dict()
+        self._implying = dict()
+        self._groups = dict()
+        self._memberships = dict()
+        self._effective = dict()
+        self._pairs = set()
+        self._factory = None
+        self._lock = threading.RLock()
+        self._resolved = dict()
+        self._resolved_effective = dict()
+        self._resolved_memberships = dict()
 
     @property
     def agents(self):
@@ -25,6 +59,17 @@ class _Registry(object):
     def permissions(self):
         return self._permissions.values()
 
+    @property
+    def schemas(self):
+        """All join tables created by :meth:`make_schemas`, including
+        effective permission and membership tables.
+        """
+        return list(itertools.chain(
+            self._permissions.values(),
+            self._effective.values(),
+            self._memberships.values(),
+        ))
+
     def agent(self, agent):
         """Decorator that registers the decorated schema as a permission agent.
 
@@ -63,9 +108,11 @@ class _Registry(object):
         :param schema: Permission join table
         """
         self._permissions[(agent, target)] = permission
+        self._invalidate()
 
     def get_permission(self, agent, target):
-        """Get the join table linking schemas `agent` and `target`.
+        """Get the join table linking schemas `agent` and `target`, or their
+        nearest registered ancestors.
 
         :param agent: Agent schema class
         :param target: Target schema class
@@ -74,26 +121,361 @@ class _Registry(object):
             exist
         """
         try:
-            return self._permissions[(agent, target)]
+            schema = self._resolved[agent][target]
         except KeyError:
+            schema = self._resolve(self._permissions, self._resolved, agent, target)
+        if schema is None and self._factory is not None:
+            schema = self._make_lazy(agent, target)
+        if schema is None:
             raise exceptions.SchemaNotFound(
                 'Could not find permission schema linking models {0} and {1}'.format(
                     agent.__name__,
                     target.__name__,
                 )
             )
+        return schema
+
+    @staticmethod
+    def _resolve(schemas, resolved, agent, target):
+        """Find the join table in `schemas` linking the nearest registered
+        ancestors of `agent` and `target`, preferring the nearest agent, and
+        memoize the result, including misses, in `resolved`.
+
+        :param dict schemas: Dictionary mapping (agent, target) pairs to join
+            tables
+        :param dict resolved: Dictionary mapping agents to dictionaries mapping
+            targets to resolved join tables
+        :returns: Join table, or `None` if not found
+        """
+        schema = schemas.get((agent, target))
+        if schema is None:
+            pair = _Registry._find_pair(schemas, agent, target)
+            schema = schemas[pair] if pair is not None else None
+        resolved.setdefault(agent, {})[target] = schema
+        return schema
+
+    @staticmethod
+    def _find_pair(pairs, agent, target):
+        """Find the first pair of ancestors of `agent` and `target` in `pairs`,
+        preferring the nearest agent.
+
+        :returns: (agent, target) pair, or `None` if not found
+        """
+        return next(
+            (
+                (each_agent, each_target)
+                for each_agent in _get_mro(agent)
+                for each_target in _get_mro(target)
+                if (each_agent, each_target) in pairs
+            ),
+            None,
+        )
+
+    def _invalidate(self):
+        self._resolved.clear()
+        self._resolved_effective.clear()
+        self._resolved_memberships.clear()
+
+    def get_agent_permissions(self, agent):
+        """Get the join tables linking schema `agent` to each target.
+
+        :param agent: Agent schema class
+        :returns: Dictionary mapping target schema classes to join tables
+        """
+        results = {}
+        for each in reversed(_get_mro(agent)):
+            results.update(
+                (target, permission)
+                for (other, target), permission in self._permissions.items()
+                if other is each
+            )
+        return results
+
+    def imply(self, permission, *implied):
+        """Declare that permission `permission` implies each of `implied`.
+        Implications are transitive, and the transitive closure is computed
+        when implications are declared rather than when permissions are
+        checked.
+
+        Example:
+
+        .. code-block:: python
+
+            registry.imply('admin', 'write')
+            registry.imply('write', 'read')
+
+            manager.add_permission(user, post, 'admin')
+            manager.has_permission(user, post, 'read')     # True
+
+        :param str permission: Implying permission
+        :param implied: Implied permissions
+        """
+        implies = dict(self._implies)
+        implies[permission] = implies.get(permission, frozenset()).union(implied)
+        self._implies = implies
+        self._implied, self._implying = self._make_closure(implies)
+
+    @staticmethod
+    def _make_closure(implies):
+        """Compute the permissions implied by and implying each permission in
+        hierarchy `implies`.
+
+        :returns: Tuple of dictionaries mapping each permission to the frozen
+            sets of permissions it implies, and of permissions implying it
+        """
+        implied = {}
+        for permission in implies:
+            seen, stack = {permission}, [permission]
+            while stack:
+                for each in implies.get(stack.pop(), ()):
+                    if each not in seen:
+                        seen.add(each)
+                        stack.append(each)
+            implied[permission] = frozenset(seen)
+        implying = {}
+        for permission, permissions in implied.items():
+            for each in permissions:
+                implying.setdefault(each, {each}).add(permission)
+        return implied, {
+            permission: frozenset(permissions)
+            for permission, permissions in implying.items()
+        }
+
+    def get_implied(self, permissions):
+        """Get the permissions granted by `permissions`, including implied
+        permissions.
+
+        :param permissions: Iterable of permissions
+        :returns: Set of permissions
+        """
+        results = set()
+        for permission in permissions:
+            results.update(self._implied.get(permission, (permission, )))
+        return results
+
+    def get_implying(self, permissions):
+        """Get the permissions that grant any of `permissions`, including
+        `permissions` themselves.
+
+        :param permissions: Iterable of permissions
+        :returns: Set of permissions
+        """
+        results = set()
+        for permission in permissions:
+            results.update(self._implying.get(permission, (permission, )))
+        return results
+
+    def group(self, member, group):
+        """Declare that records of agent schema `member` may belong to records
+        of agent schema `group`, inheriting their permissions. Groups are not
+        nested: records of `group` do not inherit the permissions of their own
+        groups.
+
+        Inherited permissions are materialized in an effective permission table
+        for each target of `member`, maintained by the permission manager as
+        permissions and memberships change, so that checks remain a single
+        lookup regardless of the number of groups.
+
+        Example:
+
+        .. code-block:: python
+
+            registry.group(User, Team)
+
+        :param member: Member agent schema class
+        :param group: Group agent schema class
+        """
+        self._groups.setdefault(member, set()).add(group)
+
+    def get_groups(self, member):
+        """Get the group schemas declared for schema `member` or its ancestors.
+
+        :param member: Member agent schema class
+        :returns: Set of group agent schema classes
+        """
+        return set().union(*[
+            self._groups.get(each, ())
+            for each in _get_mro(member)
+        ])
+
+    def get_members(self, group):
+        """Get the member schemas declared for schema `group` or its ancestors.
+
+        :param group: Group agent schema class
+        :returns: Set of member agent schema classes
+        """
+        return {
+            member for member, groups in self._groups.items()
+            if any(issubclass(group, each) for each in groups)
+        }
+
+    def add_membership(self, member, group, membership):
+        self._memberships[(member, group)] = membership
+        self._invalidate()
+
+    def get_membership(self, member, group):
+        """Get the join table linking members of schema `member` to groups of
+        schema `group`.
+
+        :param member: Member agent schema class
+        :param group: Group agent schema class
+        :returns: Membership join table
+        :raises: guardian.core.exceptions.SchemaNotFound if join table does not
+            exist
+        """
+        try:
+            schema = self._resolved_memberships[member][group]
+        except KeyError:
+            schema = self._resolve(
+                self._memberships, self._resolved_memberships, member, group,
+            )
+        if schema is None and self._factory is not None:
+            schema = self._make_lazy_membership(member, group)
+        if schema is None:
+            raise exceptions.SchemaNotFound(
+                'Could not find membership schema linking models {0} and {1}'.format(
+                    member.__name__,
+                    group.__name__,
+                )
+            )
+        return schema
+
+    def add_effective_permission(self, agent, target, permission):
+        self._effective[(agent, target)] = permission
+        self._invalidate()
+
+    def get_effective_permission(self, agent, target):
+        """Get the join table holding the effective permissions of schema
+        `agent` on schema `target`: the materialized effective permission table
+        if `agent` belongs to groups, else the permission join table.
+
+        :param agent: Agent schema class
+        :param target: Target schema class
+        :returns: Permission join table
+        :raises: guardian.core.exceptions.SchemaNotFound if join table does not
+            exist
+        """
+        try:
+            return self._resolved_effective[agent][target]
+        except KeyError:
+            pass
+        permission = self.get_permission(agent, target)
+        schema = self._resolve(self._effective, {}, agent, target) or permission
+        self._resolved_effective.setdefault(agent, {})[target] = schema
+        return schema
+
+    def link(self, agent, *targets):
+        """Declare that records of agent schema `agent` may be granted
+        permissions on records of each of target schemas `targets`, registering
+        the schemas as agent and targets. Once any pair is declared,
+        :meth:`make_schemas` creates join tables for declared pairs only, rather
+        than for every pair of registered agent and target.
+
+        Example:
+
+        .. code-block:: python
+
+            registry.link(User, Post, Comment)
+            registry.link(Team, Post)
+
+        :param agent: Agent schema class
+        :param targets: Target schema classes
+        """
+        self.agent(agent)
+        for target in targets:
+            self.target(target)
+            self._pairs.add((agent, target))
+
+    def get_pairs(self):
+        """Get the agent-target pairs for which join tables are created: the
+        pairs declared with :meth:`link`, if any, else every pair of registered
+        agent and target.
+
+        :returns: Set of (agent, target) pairs
+        """
+        if self._pairs:
+            return set(self._pairs)
+        return {
+            (agent, target)
+            for agent in self.agents
+            for target in self.targets
+        }
+
+    def make_schemas(self, factory, lazy=False):
+        """Create and register join tables linking agent-target pairs (see
+        :meth:`get_pairs`), as well as membership tables for agents that belong
+        to groups, and effective permission tables for each of their pairs.
+
+        In lazy mode, join tables are instead created the first time they are
+        looked up, so that unused pairs cost nothing at startup. Note: Lazily
+        created tables must still exist in the database; lazy mode is not
+        suitable for backends that require all schemas to be defined up front,
+        such as Django migrations and Pony mappings.
+
+        :param factory: Callable that takes agent and target schemas and an
+            optional kind of join table, and returns the schema for the join
+            table
+        :param bool lazy: Defer creating each join table until first lookup
+        """
+        if lazy:
+            self._factory = factory
+            return
+        for agent, target in self.get_pairs():
+            self._make_schema(factory, agent, target)
+        for member, groups in self._groups.items():
+            for group in groups:
+                membership = factory(member, group, kind='membership')
+                self.add_membership(member, group, membership)
+
+    def _make_schema(self, factory, agent, target):
+        """Create and register the join table linking `agent` and `target`,
+        and the effective permission table if `agent` belongs to groups.
+
+        :returns: Permission join table
+        """
+        permission = factory(agent, target)
+        self.add_permission(agent, target, permission)
+        if self.get_groups(agent):
+            effective = factory(agent, target, kind='effective')
+            self.add_effective_permission(agent, target, effective)
+        return permission
+
+    def _make_lazy(self, agent, target):
+        """Create the join table linking the nearest ancestors of `agent` and
+        `target` that form a pair, in lazy mode.
+
+        :returns: Permission join table, or `None` if no pair matches
+        """
+        with self._lock:
+            pair = self._find_pair(self._permissions, agent, target)
+            if pair is not None:
+                return self._permissions[pair]
+            pair = self._find_pair(self.get_pairs(), agent, target)
+            if pair is None:
+                return None
+            return self._make_schema(self._factory, *pair)
 
-    def make_schemas(self, factory):
-        """Create and register join tables linking all registered agent-target
-        pairs.
+    def _make_lazy_membership(self, member, group):
+        """Create the membership table linking the nearest ancestors of
+        `member` and `group` declared with :meth:`group`, in lazy mode.
 
-        :param factory: Callable that takes agent and target schemas and returns
-            the schema for a permission join table
+        :returns: Membership join table, or `None` if no pair matches
         """
-        for agent in self.agents:
-            for target in self.targets:
-                permission = factory(agent, target)
-                self.add_permission(agent, target, permission)
+        with self._lock:
+            pair = self._find_pair(self._memberships, member, group)
+            if pair is not None:
+                return self._memberships[pair]
+            pairs = {
+                (each, other)
+                for each, groups in self._groups.items()
+                for other in groups
+            }
+            pair = self._find_pair(pairs, member, group)
+            if pair is None:
+                return None
+            membership = self._factory(pair[0], pair[1], kind='membership')
+            self.add_membership(pair[0], pair[1], membership)
+            return membership
 
 
 registry = _Registry()
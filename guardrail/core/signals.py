@@ -0,0 +1,126 @@
+# -*- coding: utf-8 -*-
+"""Signals for instrumenting permission managers and loaders. Connect a
+listener to a signal to receive an :class:`Event` after each operation, e.g. to
+feed a tracer or metrics client:
+
+.. code-block:: python
+
+    from guardrail.core import signals
+
+    @signals.has_permission.connect
+    def trace(event):
+        statsd.timing('guardrail.has_permission', event.duration * 1000)
+
+Listeners are called synchronously, in the thread that performed the operation,
+after the operation completes or raises. Operations are only timed, and queries
+only counted, while at least one listener is connected to the signal.
+"""
+
+import sys
+import timeit
+import contextlib
+import collections
+
+import six
+
+
+#: Record of a single instrumented operation.
+#:
+#: :attr name: Signal name
+#: :attr sender: Permission manager or loader that performed the operation
+#: :attr schema: Permission join table, or target schema for loaders; `None`
+#:     if unknown
+#: :attr arguments: Dictionary of call arguments
+#: :attr result: Return value, or `None` if the operation raised
+#: :attr error: Exception raised by the operation, or `None`
+#: :attr float duration: Wall time in seconds
+#: :attr queries: Number of queries issued, or `None` if the backend cannot
+#:     count queries
+Event = collections.namedtuple(
+    'Event',
+    ['name', 'sender', 'schema', 'arguments', 'result', 'error', 'duration', 'queries'],
+)
+
+
+@contextlib.contextmanager
+def _no_queries():
+    yield lambda: None
+
+
+class Signal(object):
+    """Named list of listeners, each called with an :class:`Event`.
+
+    :param str name: Signal name
+    """
+    def __init__(self, name):
+        self.name = name
+        self.receivers = ()
+
+    def connect(self, receiver):
+        """Call `receiver` with each event sent on this signal. Returns
+        `receiver`, so that this method can be used as a decorator.
+
+        :param receiver: Callable taking an :class:`Event`
+        """
+        self.receivers = self.receivers + (receiver, )
+        return receiver
+
+    def disconnect(self, receiver):
+        """Stop calling `receiver`, if connected.
+
+        :param receiver: Previously connected callable
+        """
+        self.receivers = tuple(
+            each for each in self.receivers
+            if each != receiver
+        )
+
+    def send(self, event):
+        """Call each listener with `event`.
+
+        :param Event event: Event to send
+        """
+        for receiver in self.receivers:
+            receiver(event)
+
+    def call(self, func, sender, schema, arguments, queries=None):
+        """Call `func`, timing it and counting the queries it issues, and send
+        an :class:`Event` describing the call. Exceptions raised by `func` are
+        re-raised after the event is sent.
+
+        :param func: Callable taking no arguments
+        :param sender: Permission manager or loader performing the operation
+        :param schema: Permission join table or target schema
+        :param dict arguments: Call arguments
+        :param queries: Optional context manager yielding a callable that
+            returns the number of queries issued within the block; see
+            :meth:`BasePermissionManager._count_queries`
+        :returns: Return value of `func`
+        """
+        result, error, info = None, None, None
+        with (queries or _no_queries()) as count:
+            start = timeit.default_timer()
+            try:
+                result = func()
+            except Exception as exc:
+                error, info = exc, sys.exc_info()
+            duration = timeit.default_timer() - start
+            issued = count()
+        self.send(Event(
+            self.name, sender, schema, arguments,
+            result, error, duration, issued,
+        ))
+        if info is not None:
+            six.reraise(*info)
+        return result
+
+
+get_permissions = Signal('get_permissions')
+has_permission = Signal('has_permission')
+has_any_permission = Signal('has_any_permission')
+has_all_permissions = Signal('has_all_permissions')
+add_permission = Signal('add_permission')
+ensure_permission = Signal('ensure_permission')
+remove_permission = Signal('remove_permission')
+#: Sent when the `has_permission` decorator loads an agent or target record
+load = Signal('load')
@@ -2,4 +2,6 @@
 
 from .models import DjangoPermissionManager  # noqa
 from .models import DjangoPermissionSchemaFactory  # noqa
+from .models import annotate_permissions  # noqa
+from .models import prefetch_permissions  # noqa
 from .backends import ObjectPermissionBackend  # noqa
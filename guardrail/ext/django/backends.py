@@ -1,14 +1,26 @@
 # -*- coding: utf-8 -*-
 """Custom object permissions backend for Django plugin"""
 
-from .models import DjangoPermissionManager
+import collections
+
+from guardrail.core import models
+from guardrail.core import exceptions
+from guardrail.core.registry import registry
 
 
 class ObjectPermissionBackend(object):
     """Custom authentication backend for object-level permissions. Must be used
     in conjunction with a backend that handles the `authenticate` and `get_user`
     methods, such as the default `django.contrib.auth.backends.ModelBackend`.
+
+    Permissions are cached on the user object, as in Django's `ModelBackend`:
+    the first check against a target type loads all of the user's permissions
+    on targets of that type in a single query. Cached permissions are not
+    invalidated by later grants or revokes; reload the user to refresh them.
     """
+    registry = registry
+    cache_attr = '_guardrail_perm_cache'
+
     def authenticate(self, username=None, password=None, *kwargs):
         return None
 
@@ -16,9 +28,53 @@ class ObjectPermissionBackend(object):
         return None
 
     def has_perm(self, user, perm, target=None):
-        manager = DjangoPermissionManager()
-        return manager.has_permission(user, target, perm)
+        if target is None:
+            return False
+        return perm in self.get_all_permissions(user, target)
 
     def get_all_permissions(self, user, target=None):
-        manager = DjangoPermissionManager()
-        return manager.get_permissions(user, target)
+        """Get permissions `user` has on `target`, or on any target if `target`
+        is not provided.
+        """
+        if not getattr(user, 'is_active', True) or user.pk is None:
+            return set()
+        if target is None:
+            schemas = self.registry.get_agent_permissions(type(user))
+            return set().union(*[
+                permissions
+                for Target in schemas
+                for permissions in self._get_cached_permissions(user, Target).values()
+            ])
+        if target.pk is None:
+            return set()
+        return self._get_cached_permissions(user, type(target)).get(target.pk, set())
+
+    def _get_cached_permissions(self, user, Target):
+        """Get permissions `user` has on each record of schema `Target`, loading
+        them in a single query on first access.
+
+        :returns: Dictionary mapping target primary keys to sets of permissions
+        """
+        cache = user.__dict__.setdefault(self.cache_attr, {})
+        if Target not in cache:
+            cache[Target] = self._get_permissions(user, Target)
+        return cache[Target]
+
+    def _get_permissions(self, user, Target):
+        try:
+            schema = self.registry.get_effective_permission(type(user), Target)
+        except exceptions.SchemaNotFound:
+            return {}
+        bits = models._get_bits(schema)
+        if bits is not None:
+            query = schema.objects.filter(agent=user).values_list('target', 'mask')
+            results = {target_id: bits.decode(mask) for target_id, mask in query}
+        else:
+            query = schema.objects.filter(agent=user).values_list('target', 'permission')
+            results = collections.defaultdict(set)
+            for target_id, permission in query:
+                results[target_id].add(permission)
+        return {
+            target_id: self.registry.get_implied(permissions)
+            for target_id, permissions in results.items()
+        }
@@ -6,10 +6,31 @@ can detect permission schemas.
 
 from __future__ import absolute_import
 
+import operator
+import functools
+import contextlib
+import collections
+
 from django import db
 
 from guardrail.core import models
 from guardrail.core import exceptions
+from guardrail.core.registry import registry
+
+
+def _filter_permissions(query, schema, permissions):
+    """Filter `query` on `schema` to rows that grant any of `permissions`, or
+    leave `query` unfiltered if `permissions` is `None`.
+    """
+    if permissions is None:
+        return query
+    bits = models._get_bits(schema)
+    if bits is not None:
+        query = query.annotate(
+            granted=db.models.F('mask').bitand(bits.encode(permissions)),
+        )
+        return query.exclude(granted=0)
+    return query.filter(permission__in=permissions)
 
 
 class DjangoPermissionManager(models.BasePermissionManager):
@@ -19,6 +40,29 @@ class DjangoPermissionManager(models.BasePermissionManager):
         """Django cannot create references to unsaved records."""
         return record.pk is not None
 
+    @staticmethod
+    def _get_id(record):
+        return record.pk
+
+    @contextlib.contextmanager
+    def _count_queries(self, schema):
+        """Count queries through the connection's query log, forcing the debug
+        cursor within the block. Note: counts stop increasing once the query
+        log reaches its maximum length.
+        """
+        if schema is not None:
+            alias = db.router.db_for_read(schema)
+        else:
+            alias = db.DEFAULT_DB_ALIAS
+        connection = db.connections[alias]
+        debug = connection.force_debug_cursor
+        connection.force_debug_cursor = True
+        start = len(connection.queries_log)
+        try:
+            yield lambda: len(connection.queries_log) - start
+        finally:
+            connection.force_debug_cursor = debug
+
     @staticmethod
     def _build_query(query, agent, target, schema,
                      Agent=None, Target=None, custom=None):
@@ -49,6 +93,89 @@ class DjangoPermissionManager(models.BasePermissionManager):
         )
         return query.exists()
 
+    def _has_any_permission(self, agent, target, schema, permissions,
+                            Agent=None, Target=None, custom=None):
+        query = schema.objects.only('permission')
+        query = query.filter(permission__in=permissions)
+        query = self._build_query(
+            query, agent, target, schema,
+            Agent=Agent, Target=Target, custom=custom,
+        )
+        return query.exists()
+
+    def _has_all_permissions(self, agent, target, schema, permissions,
+                             Agent=None, Target=None, custom=None):
+        query = schema.objects.filter(permission__in=permissions)
+        query = self._build_query(
+            query, agent, target, schema,
+            Agent=Agent, Target=Target, custom=custom,
+        )
+        count = db.models.Count('permission', distinct=True)
+        return query.aggregate(count=count)['count'] == len(permissions)
+
+    def _get_permissions_many(self, agent, targets, schema):
+        query = schema.objects.filter(
+            agent=agent,
+            target__in=[self._get_id(target) for target in targets],
+        )
+        results = collections.defaultdict(set)
+        for target_id, permission in query.values_list('target', 'permission'):
+            results[target_id].add(permission)
+        return results
+
+    def _has_permission_many(self, agent, targets, schema, permissions):
+        query = schema.objects.filter(
+            agent=agent,
+            permission__in=permissions,
+            target__in=[self._get_id(target) for target in targets],
+        )
+        return set(query.values_list('target', flat=True))
+
+    def _filter_targets(self, agent, Target, schema, permissions):
+        subquery = schema.objects.filter(agent=agent)
+        subquery = _filter_permissions(subquery, schema, permissions)
+        return Target.objects.filter(pk__in=subquery.values('target'))
+
+    def _agents_with_permission(self, target, Agent, schema, permissions):
+        subquery = schema.objects.filter(target=target)
+        subquery = _filter_permissions(subquery, schema, permissions)
+        query = Agent.objects.filter(pk__in=subquery.values('agent'))
+        for agent in query.iterator():
+            yield agent
+
+    def _iter_rows(self, schema):
+        value = 'mask' if models._get_bits(schema) is not None else 'permission'
+        query = schema.objects.values_list('agent_id', 'target_id', value)
+        for row in query.iterator():
+            yield row
+
+    def _match_rows(self, rows, schema):
+        return functools.reduce(operator.or_, [
+            db.models.Q(agent=agent_id, permission=permission, target__in=target_ids)
+            for (agent_id, permission), target_ids in self._group_rows(rows).items()
+        ])
+
+    def _get_existing_permissions(self, rows, schema):
+        query = schema.objects.filter(self._match_rows(rows, schema))
+        return set(query.values_list('agent', 'target', 'permission'))
+
+    def _add_permissions(self, rows, schema):
+        try:
+            schema.objects.bulk_create([
+                schema(
+                    agent_id=self._get_id(agent),
+                    target_id=self._get_id(target),
+                    permission=permission,
+                )
+                for agent, target, permission in rows
+            ])
+        except db.IntegrityError:
+            raise exceptions.PermissionExists()
+
+    def _remove_permissions(self, rows, schema):
+        count, _ = schema.objects.filter(self._match_rows(rows, schema)).delete()
+        return count
+
     def _add_permission(self, agent, target, schema, permission):
         try:
             return schema.objects.create(
@@ -59,15 +186,69 @@ class DjangoPermissionManager(models.BasePermissionManager):
         except db.IntegrityError:
             raise exceptions.PermissionExists()
 
+    def _ensure_permission(self, agent, target, schema, permission):
+        """Insert within a savepoint, so that conflicts do not break the
+        surrounding transaction.
+        """
+        try:
+            with db.transaction.atomic():
+                schema.objects.create(agent=agent, target=target, permission=permission)
+        except db.IntegrityError:
+            return False
+        return True
+
+    def _get_mask(self, agent, target, schema,
+                  Agent=None, Target=None, custom=None):
+        query = self._build_query(
+            schema.objects.all(), agent, target, schema,
+            Agent=Agent, Target=Target, custom=custom,
+        )
+        return functools.reduce(operator.or_, query.values_list('mask', flat=True), 0)
+
+    def _get_masks(self, agent, targets, schema):
+        query = schema.objects.filter(
+            agent=agent,
+            target__in=[self._get_id(target) for target in targets],
+        )
+        return dict(query.values_list('target', 'mask'))
+
+    def _update_bit(self, agent, target, schema, bit, value):
+        """Set or clear `bit` with a single conditional `UPDATE`.
+
+        :returns: Whether the bitmask was changed
+        """
+        mask = db.models.F('mask')
+        query = schema.objects.filter(
+            agent=agent,
+            target=target,
+        ).annotate(
+            granted=mask.bitand(bit),
+        )
+        if value:
+            return query.filter(granted=0).update(mask=mask + bit) > 0
+        return query.exclude(granted=0).update(mask=mask - bit) > 0
+
+    def _set_bit(self, agent, target, schema, bit):
+        if self._update_bit(agent, target, schema, bit, True):
+            return True
+        try:
+            with db.transaction.atomic():
+                schema.objects.create(agent=agent, target=target, mask=bit)
+        except db.IntegrityError:
+            # Row exists, but may have been created concurrently without `bit`
+            return self._update_bit(agent, target, schema, bit, True)
+        return True
+
+    def _clear_bit(self, agent, target, schema, bit):
+        return self._update_bit(agent, target, schema, bit, False)
+
     def _remove_permission(self, agent, target, schema, permission):
         query = schema.objects.only('permission')
         query = query.filter(permission=permission)
         query = self._build_query(query, agent, target, schema)
-        # Note: This emits an unnecessary extra query. This can be fixed once
-        # patch once ticket 16891 is resolved.
-        if not query.count():
+        count, _ = query.delete()
+        if not count:
             raise exceptions.PermissionNotFound
-        query.delete()
 
 
 class DjangoPermissionSchemaFactory(models.BasePermissionSchemaFactory):
@@ -76,19 +257,20 @@ class DjangoPermissionSchemaFactory(models.BasePermissionSchemaFactory):
     def _get_table_name(schema):
         return schema._meta.db_table
 
-    def _make_schema_meta(self, agent, target):
+    def _make_schema_meta(self, agent, target, kind='permission',
+                          columns=('agent', 'target', 'permission')):
         return type(
             'Meta',
             (object, ),
             dict(
-                db_table=self._make_table_name(agent, target),
-                unique_together=(('agent', 'target', 'permission'), )
+                db_table=self._make_table_name(agent, target, kind),
+                unique_together=(columns, )
             ),
         )
 
-    def _make_schema_dict(self, agent, target):
+    def _make_schema_dict(self, agent, target, kind='permission'):
         return dict(
-            Meta=self._make_schema_meta(agent, target),
+            Meta=self._make_schema_meta(agent, target, kind),
             __module__=__name__,
             id=db.models.AutoField(primary_key=True),
             agent=db.models.ForeignKey(agent, null=False, db_index=True),
@@ -96,6 +278,16 @@ class DjangoPermissionSchemaFactory(models.BasePermissionSchemaFactory):
             permission=db.models.CharField(max_length=255, null=False, db_index=True),
         )
 
+    def _make_compact_schema_dict(self, agent, target, kind='permission'):
+        return dict(
+            Meta=self._make_schema_meta(agent, target, kind, columns=('agent', 'target')),
+            __module__=__name__,
+            id=db.models.AutoField(primary_key=True),
+            agent=db.models.ForeignKey(agent, null=False, db_index=True),
+            target=db.models.ForeignKey(target, null=False, db_index=True),
+            mask=db.models.BigIntegerField(null=False, default=0),
+        )
+
 
 class DjangoLoader(models.BaseLoader):
 
@@ -105,3 +297,71 @@ class DjangoLoader(models.BaseLoader):
     def __call__(self, *args, **kwargs):
         query = {self.column: kwargs.get(self.kwarg)}
         return self.schema.objects.filter(**query).first()
+
+    def load_with_permission(self, agent, permissions, registry, *args, **kwargs):
+        schema = registry.get_effective_permission(models._get_class(agent), self.schema)
+        permissions = registry.get_implying(permissions)
+        allowed = schema.objects.filter(
+            target=db.models.OuterRef('pk'),
+            agent=agent,
+        )
+        allowed = _filter_permissions(allowed, schema, permissions)
+        query = {self.column: kwargs.get(self.kwarg)}
+        record = self.schema.objects.filter(
+            **query
+        ).annotate(
+            allowed=db.models.Exists(allowed)
+        ).first()
+        if record is None:
+            return None, False
+        return record, record.allowed
+
+
+def annotate_permissions(queryset, agent, permissions, registry=registry):
+    """Annotate each record in `queryset` with whether `agent` has each of
+    `permissions` on it, so that permissions for a list of records are loaded
+    with the records themselves. Each permission is added as a boolean
+    `Exists` annotation named `can_<permission>`:
+
+    .. code-block:: python
+
+        posts = annotate_permissions(Post.objects.all(), user, ['read', 'edit'])
+        for post in posts[:20]:
+            print(post.can_read, post.can_edit)
+
+    :param queryset: Queryset over target records
+    :param agent: Agent record
+    :param permissions: Iterable of permissions
+    :param _Registry registry: Optional registry object; use global `registry`
+        if not provided.
+    :returns: Annotated queryset
+    """
+    schema = registry.get_effective_permission(models._get_class(agent), queryset.model)
+    return queryset.annotate(**{
+        'can_{0}'.format(permission): db.models.Exists(_filter_permissions(
+            schema.objects.filter(target=db.models.OuterRef('pk'), agent=agent),
+            schema,
+            registry.get_implying([permission]),
+        ))
+        for permission in permissions
+    })
+
+
+def prefetch_permissions(queryset, agent, attr='permissions', registry=registry):
+    """Evaluate `queryset` and set attribute `attr` on each record to the set of
+    permissions `agent` has on it, loading permissions in one extra query, as
+    with `prefetch_related`.
+
+    :param queryset: Queryset or iterable of target records
+    :param agent: Agent record
+    :param str attr: Name of attribute to set on each record
+    :param _Registry registry: Optional registry object; use global `registry`
+        if not provided.
+    :returns: List of target records
+    """
+    records = list(queryset)
+    manager = DjangoPermissionManager(registry=registry)
+    permissions = manager.get_permissions_many(agent, records)
+    for record in records:
+        setattr(record, attr, permissions[record])
+    return records
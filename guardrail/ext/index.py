@@ -0,0 +1,321 @@
+# -*- coding: utf-8 -*-
+"""Read-only permission index files for worker processes. Export every
+permission join table in the registry to a compact binary file with
+:func:`write_index`, and serve checks from a memory-mapped copy with
+:class:`IndexPermissionManager`:
+
+.. code-block:: python
+
+    # Publisher
+    write_index(SqlalchemyPermissionManager(session), '/var/lib/app/permissions.idx')
+
+    # Workers
+    manager = IndexPermissionManager(
+        SqlalchemyPermissionManager(session),
+        '/var/lib/app/permissions.idx',
+    )
+
+Index files store agent and target primary keys as 64-bit integers, so all
+agent and target schemas must have integer primary keys.
+
+File layout (all integers big-endian):
+
+* Header: magic ``GRIX``, format version, number of strings, number of tables
+* String table: for each string, its length in bytes and its UTF-8 encoding
+* Table directory: for each join table, the string index of its table name,
+  its number of records, and the file offset of its records
+* Records: for each join table, (agent primary key, target primary key,
+  permission string index) records, sorted; primary keys are offset by 2^63
+  so that byte order matches numeric order
+"""
+
+from __future__ import absolute_import
+
+import os
+import mmap
+import time
+import bisect
+import struct
+import tempfile
+
+import six
+
+from guardrail.ext.memory import MemoryPermissionManager
+
+
+MAGIC = b'GRIX'
+VERSION = 2
+
+_HEADER = struct.Struct('>4sIII')
+_LENGTH = struct.Struct('>I')
+_TABLE = struct.Struct('>IQQ')
+_KEY = struct.Struct('>QQ')
+_PERMISSION = struct.Struct('>I')
+_RECORD_SIZE = _KEY.size + _PERMISSION.size
+_OFFSET = 2 ** 63
+
+# Atomic on POSIX; `os.replace` also overwrites existing files on Windows
+_replace = getattr(os, 'replace', os.rename)
+
+
+def _get_name(schema):
+    """Get the table name of join table `schema`, which is unique per database,
+    unlike schema class names.
+    """
+    return getattr(schema, 'permission_table', None) or schema.__name__
+
+
+def _pack_key(agent_id, target_id):
+    try:
+        return _KEY.pack(agent_id + _OFFSET, target_id + _OFFSET)
+    except (TypeError, struct.error):
+        raise ValueError('Index files require integer primary keys; got {0!r}'.format(
+            (agent_id, target_id),
+        ))
+
+
+def write_index(manager, path, schemas=None):
+    """Export the permission join tables of `manager` to an index file at
+    `path`. The file is written to a temporary file in the same directory and
+    renamed into place, so readers see either the previous snapshot or the new
+    one.
+
+    :param manager: Permission manager to export; see
+        :meth:`BasePermissionManager._iter_permissions`
+    :param str path: Index file path
+    :param schemas: Optional iterable of join tables to export; if not
+        provided, export every join table in the registry
+    :returns: Number of permissions exported
+    """
+    strings = {}
+
+    def intern(value):
+        return strings.setdefault(value, len(strings))
+
+    tables = []
+    for schema in (schemas if schemas is not None else manager.registry.schemas):
+        records = sorted(
+            _pack_key(agent_id, target_id) + _PERMISSION.pack(intern(permission))
+            for agent_id, target_id, permission in manager._iter_permissions(schema)
+        )
+        tables.append((intern(_get_name(schema)), records))
+
+    encoded = [value.encode('utf-8') for value in sorted(strings, key=strings.get)]
+    offset = _HEADER.size + _TABLE.size * len(tables)
+    offset += sum(_LENGTH.size + len(value) for value in encoded)
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, temp = tempfile.mkstemp(dir=directory, prefix='.guardrail-', suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as fp:
+            fp.write(_HEADER.pack(MAGIC, VERSION, len(encoded), len(tables)))
+            for value in encoded:
+                fp.write(_LENGTH.pack(len(value)))
+                fp.write(value)
+            for name, records in tables:
+                fp.write(_TABLE.pack(name, len(records), offset))
+                offset += _RECORD_SIZE * len(records)
+            for _, records in tables:
+                fp.write(b''.join(records))
+            fp.flush()
+            os.fsync(fp.fileno())
+        _replace(temp, path)
+    except Exception:
+        os.unlink(temp)
+        raise
+    return sum(len(records) for _, records in tables)
+
+
+class _Keys(object):
+    """Sequence of the (agent, target) keys of a table's records, for
+    bisection without copying records out of the mapping. Every
+    :attr:`fence_size`-th key is copied into a list on first search, so that
+    most bisection steps run over the list rather than the mapping.
+    """
+    fence_size = 64
+
+    def __init__(self, data, offset, count):
+        self.data = data
+        self.offset = offset
+        self.count = count
+        self.fences = None
+
+    def __len__(self):
+        return self.count
+
+    def __getitem__(self, index):
+        start = self.offset + index * _RECORD_SIZE
+        return self.data[start:start + _KEY.size]
+
+    def search(self, key):
+        """Find the index of the first record whose key is not less than `key`."""
+        if self.fences is None:
+            self.fences = [
+                self[index]
+                for index in six.moves.range(0, self.count, self.fence_size)
+            ]
+        block = bisect.bisect_left(self.fences, key)
+        if block == 0:
+            return 0
+        low = (block - 1) * self.fence_size
+        return bisect.bisect_left(self, key, low, min(low + self.fence_size, self.count))
+
+
+class PermissionIndex(object):
+    """Memory-mapped, read-only view of an index file written by
+    :func:`write_index`. Lookups bisect each table's sorted records, so take
+    time logarithmic in the size of the table.
+
+    :param str path: Index file path
+    """
+    def __init__(self, path):
+        with open(path, 'rb') as fp:
+            self.stat = os.fstat(fp.fileno())
+            self.data = mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, string_count, table_count = _HEADER.unpack_from(self.data, 0)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError(
+                '{0!r} is not a version {1} index file'.format(path, VERSION)
+            )
+        position = _HEADER.size
+        self.strings = []
+        for _ in six.moves.range(string_count):
+            length, = _LENGTH.unpack_from(self.data, position)
+            position += _LENGTH.size
+            self.strings.append(self.data[position:position + length].decode('utf-8'))
+            position += length
+        self.tables = {}
+        for _ in six.moves.range(table_count):
+            name, count, offset = _TABLE.unpack_from(self.data, position)
+            position += _TABLE.size
+            self.tables[self.strings[name]] = _Keys(self.data, offset, count)
+        self._resolved = {}
+
+    def __len__(self):
+        return sum(len(keys) for keys in six.itervalues(self.tables))
+
+    def _get_keys(self, schema):
+        try:
+            return self._resolved[schema]
+        except KeyError:
+            keys = self._resolved[schema] = self.tables.get(_get_name(schema))
+            return keys
+
+    def get(self, schema, agent_id, target_id):
+        """Get the permissions between the agent with primary key `agent_id`
+        and the target with primary key `target_id` on join table `schema`.
+
+        :returns: Set of permissions
+        """
+        keys = self._get_keys(schema)
+        if keys is None or agent_id is None or target_id is None:
+            return set()
+        key = _pack_key(agent_id, target_id)
+        index = keys.search(key)
+        permissions = set()
+        while index < keys.count and keys[index] == key:
+            position = keys.offset + index * _RECORD_SIZE + _KEY.size
+            permissions.add(self.strings[_PERMISSION.unpack_from(self.data, position)[0]])
+            index += 1
+        return permissions
+
+    def iter_permissions(self, schema):
+        """Iterate over every permission in join table `schema`.
+
+        :returns: Generator of (agent primary key, target primary key,
+            permission) triples
+        """
+        keys = self._get_keys(schema)
+        if keys is None:
+            return
+        for index in six.moves.range(keys.count):
+            position = keys.offset + index * _RECORD_SIZE
+            agent_id, target_id = _KEY.unpack_from(self.data, position)
+            permission, = _PERMISSION.unpack_from(self.data, position + _KEY.size)
+            yield agent_id - _OFFSET, target_id - _OFFSET, self.strings[permission]
+
+
+class IndexPermissionManager(MemoryPermissionManager):
+    """Permission manager that serves reads from a memory-mapped index file,
+    without copying it into the process or querying the database. Writes go to
+    the backing manager only, and become visible once a new snapshot is
+    published with :func:`write_index`. The manager checks for new snapshots at
+    most every `check_interval` seconds, and swaps in the new file without
+    blocking concurrent readers.
+
+    As with :class:`MemoryPermissionManager`, checks with custom schemas or
+    filters, and operations that return records, are delegated to the backing
+    manager.
+
+    :param backend: Backing permission manager
+    :param str path: Index file path
+    :param float check_interval: Minimum number of seconds between checks for
+        new snapshots, or `None` to check only when :meth:`load` is called
+    :param _Registry registry: Optional registry object; use the backing
+        manager's registry if not provided.
+    :param cache: Optional permission cache; see :mod:`guardrail.core.cache`
+    :param negative_cache: Optional negative cache; see
+        :class:`guardrail.core.cache.NegativeCache`
+    """
+    def __init__(self, backend, path, check_interval=1.0, registry=None, cache=None,
+                 negative_cache=None):
+        super(IndexPermissionManager, self).__init__(
+            backend, write_through=True, registry=registry, cache=cache,
+            negative_cache=negative_cache,
+        )
+        self.path = path
+        self.check_interval = check_interval
+        self.index = PermissionIndex(path)
+        self._next_check = self._get_next_check()
+
+    def load(self, schemas=None):
+        """Swap in the snapshot currently published at :attr:`path`, if it
+        differs from the mapped snapshot.
+
+        :param schemas: Ignored; index files are swapped as a whole
+        :returns: Whether a new snapshot was swapped in
+        """
+        self._next_check = self._get_next_check()
+        stat = os.stat(self.path)
+        current = self.index.stat
+        if (stat.st_ino, stat.st_mtime, stat.st_size) == (
+                current.st_ino, current.st_mtime, current.st_size):
+            return False
+        # The previous mapping is closed once readers holding it finish
+        self.index = PermissionIndex(self.path)
+        if self.cache is not None:
+            self.cache.clear()
+        if self.negative_cache is not None:
+            self.negative_cache.clear()
+        return True
+
+    def _get_next_check(self):
+        if self.check_interval is None:
+            return None
+        return time.time() + self.check_interval
+
+    def _get_index(self):
+        if self._next_check is not None and time.time() >= self._next_check:
+            self.load()
+        return self.index
+
+    def _lookup(self, agent, target, schema):
+        return self._get_index().get(schema, self._get_id(agent), self._get_id(target))
+
+    def _lookup_many(self, agent, targets, schema):
+        index, agent_id = self._get_index(), self._get_id(agent)
+        results = {}
+        for target in targets:
+            target_id = self._get_id(target)
+            permissions = index.get(schema, agent_id, target_id)
+            if permissions:
+                results[target_id] = permissions
+        return results
+
+    def _store(self, agent, target, schema, permission):
+        return False
+
+    def _discard(self, agent, target, schema, permission):
+        return False
+
+    def _iter_permissions(self, schema):
+        return self._get_index().iter_permissions(schema)
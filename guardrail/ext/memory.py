@@ -0,0 +1,310 @@
+# -*- coding: utf-8 -*-
+"""In-memory plugin for guardrail. Keeps permissions in dictionaries keyed on
+agent and target primary keys, for fast checks on hot read paths and for tests.
+Load a snapshot of the permission tables of any other backend with
+:meth:`MemoryPermissionManager.load`:
+
+.. code-block:: python
+
+    backend = SqlalchemyPermissionManager(session)
+    manager = MemoryPermissionManager(backend, write_through=True)
+    manager.load()
+
+"""
+
+from __future__ import absolute_import
+
+import contextlib
+
+import six
+
+from guardrail.core import models
+from guardrail.core import exceptions
+from guardrail.core.registry import registry as default_registry
+
+
+class MemoryPermissionManager(models.BasePermissionManager):
+    """Permission manager that stores permissions in memory. For each
+    permission join table, the permissions linking each agent and target are
+    indexed both by agent and by target, with both indexes sharing a single set
+    per pair.
+
+    Checks with custom schemas or filters, and operations that return records
+    (:meth:`filter_targets`, :meth:`agents_with_permission`, and group
+    membership lookups), are delegated to the backing manager, and so read the
+    backing store rather than the in-memory permissions; set `write_through` to
+    keep the two consistent.
+
+    :param backend: Optional backing permission manager, used to identify
+        records, load snapshots, and write through changes; if not provided,
+        records are identified by their `id` attribute
+    :param bool write_through: Apply each change to the backing manager before
+        applying it in memory; errors raised by the backing manager, such as
+        `PermissionExists`, abort the change
+    :param _Registry registry: Optional registry object; use the backing
+        manager's registry, or the global `registry`, if not provided.
+    :param cache: Optional permission cache; see :mod:`guardrail.core.cache`
+    :param negative_cache: Optional negative cache; see
+        :class:`guardrail.core.cache.NegativeCache`
+    """
+    def __init__(self, backend=None, write_through=False, registry=None, cache=None,
+                 negative_cache=None):
+        if write_through and backend is None:
+            raise ValueError('Write-through requires a backing manager')
+        if registry is None:
+            registry = backend.registry if backend is not None else default_registry
+        super(MemoryPermissionManager, self).__init__(registry, cache, negative_cache)
+        self.backend = backend
+        self.write_through = write_through
+        #: Permissions keyed on join table, agent primary key, and target primary key
+        self._by_agent = {}
+        #: Permissions keyed on join table, target primary key, and agent primary key
+        self._by_target = {}
+
+    def load(self, schemas=None):
+        """Replace in-memory permissions with a snapshot of the backing
+        manager's permission join tables. Each table is streamed in a single
+        pass, and swapped in once fully loaded.
+
+        :param schemas: Optional iterable of join tables to load; if not
+            provided, load every join table in the registry
+        :returns: Number of permissions loaded
+        :raises: `ValueError` if no backing manager is configured
+        """
+        self._get_backend()
+        count = 0
+        for schema in (schemas if schemas is not None else self.registry.schemas):
+            by_agent, by_target = {}, {}
+            for agent_id, target_id, permission in self.backend._iter_permissions(schema):
+                permissions = by_agent.setdefault(agent_id, {}).get(target_id)
+                if permissions is None:
+                    permissions = by_agent[agent_id][target_id] = set()
+                    by_target.setdefault(target_id, {})[agent_id] = permissions
+                permissions.add(permission)
+                count += 1
+            self._by_agent[schema], self._by_target[schema] = by_agent, by_target
+        if self.cache is not None:
+            self.cache.clear()
+        if self.negative_cache is not None:
+            self.negative_cache.clear()
+        return count
+
+    def clear(self):
+        """Drop all in-memory permissions."""
+        self._by_agent, self._by_target = {}, {}
+        if self.cache is not None:
+            self.cache.clear()
+        if self.negative_cache is not None:
+            self.negative_cache.clear()
+
+    def _get_backend(self):
+        if self.backend is None:
+            raise ValueError('Operation requires a backing manager')
+        return self.backend
+
+    def _write(self, name, *args):
+        """Call hook `name` on the backing manager if writing through.
+
+        :returns: Tuple of whether the call was made, and its return value
+        """
+        if not self.write_through:
+            return False, None
+        return True, getattr(self.backend, name)(*args)
+
+    def _lookup(self, agent, target, schema):
+        """Get the stored permissions between `agent` and `target`.
+
+        :returns: Set of permissions; do not modify
+        """
+        return self._by_agent.get(schema, {}).get(
+            self._get_id(agent), {}
+        ).get(self._get_id(target), frozenset())
+
+    def _lookup_many(self, agent, targets, schema):
+        """Get the stored permissions between `agent` and each of `targets`.
+
+        :returns: Dictionary mapping target primary keys to sets of
+            permissions, omitting targets without permissions; do not modify
+        """
+        stored = self._by_agent.get(schema, {}).get(self._get_id(agent), {})
+        return {
+            target_id: stored[target_id]
+            for target_id in (self._get_id(target) for target in targets)
+            if target_id in stored
+        }
+
+    def _store(self, agent, target, schema, permission):
+        """Store `permission` between `agent` and `target`.
+
+        :returns: Whether `permission` was newly stored
+        """
+        agent_id, target_id = self._get_id(agent), self._get_id(target)
+        targets = self._by_agent.setdefault(schema, {}).setdefault(agent_id, {})
+        permissions = targets.get(target_id)
+        if permissions is None:
+            permissions = targets[target_id] = set()
+            agents = self._by_target.setdefault(schema, {}).setdefault(target_id, {})
+            agents[agent_id] = permissions
+        if permission in permissions:
+            return False
+        permissions.add(permission)
+        return True
+
+    def _discard(self, agent, target, schema, permission):
+        """Drop `permission` between `agent` and `target`, along with the
+        index entries of pairs left without permissions.
+
+        :returns: Whether `permission` had been stored
+        """
+        agent_id, target_id = self._get_id(agent), self._get_id(target)
+        permissions = self._lookup(agent, target, schema)
+        if permission not in permissions:
+            return False
+        permissions.remove(permission)
+        if not permissions:
+            for index, outer, inner in (
+                (self._by_agent[schema], agent_id, target_id),
+                (self._by_target[schema], target_id, agent_id),
+            ):
+                del index[outer][inner]
+                if not index[outer]:
+                    del index[outer]
+        return True
+
+    def _is_saved(self, record):
+        return self.backend._is_saved(record) if self.backend is not None else True
+
+    def _get_id(self, record):
+        if self.backend is not None:
+            return self.backend._get_id(record)
+        return super(MemoryPermissionManager, self)._get_id(record)
+
+    def _count_queries(self, schema):
+        """Count queries issued by the backing manager, if any."""
+        if self.backend is not None:
+            return self.backend._count_queries(schema)
+        return _no_queries()
+
+    def _get_permissions(self, agent, target, schema,
+                         Agent=None, Target=None, custom=None):
+        if Agent is not None or Target is not None or custom is not None:
+            return self._get_backend()._get_permissions(
+                agent, target, schema,
+                Agent=Agent, Target=Target, custom=custom,
+            )
+        return set(self._lookup(agent, target, schema))
+
+    def _has_permission(self, agent, target, schema, permission,
+                        Agent=None, Target=None, custom=None):
+        if Agent is not None or Target is not None or custom is not None:
+            return self._get_backend()._has_permission(
+                agent, target, schema, permission,
+                Agent=Agent, Target=Target, custom=custom,
+            )
+        return permission in self._lookup(agent, target, schema)
+
+    def _get_permissions_many(self, agent, targets, schema):
+        return {
+            target_id: set(permissions)
+            for target_id, permissions in six.iteritems(
+                self._lookup_many(agent, targets, schema)
+            )
+        }
+
+    def _has_permission_many(self, agent, targets, schema, permissions):
+        return {
+            target_id
+            for target_id, stored in six.iteritems(
+                self._lookup_many(agent, targets, schema)
+            )
+            if not permissions.isdisjoint(stored)
+        }
+
+    def _add_permission(self, agent, target, schema, permission):
+        written, row = self._write('_add_permission', agent, target, schema, permission)
+        if not self._store(agent, target, schema, permission) and not written:
+            raise exceptions.PermissionExists()
+        return row
+
+    def _remove_permission(self, agent, target, schema, permission):
+        written, _ = self._write('_remove_permission', agent, target, schema, permission)
+        if not self._discard(agent, target, schema, permission) and not written:
+            raise exceptions.PermissionNotFound()
+
+    def _ensure_permission(self, agent, target, schema, permission):
+        written, created = self._write(
+            '_ensure_permission', agent, target, schema, permission,
+        )
+        stored = self._store(agent, target, schema, permission)
+        return created if written else stored
+
+    def _filter_targets(self, agent, Target, schema, permissions):
+        return self._get_backend()._filter_targets(agent, Target, schema, permissions)
+
+    def _agents_with_permission(self, target, Agent, schema, permissions):
+        return self._get_backend()._agents_with_permission(
+            target, Agent, schema, permissions,
+        )
+
+    def _iter_permissions(self, schema):
+        for agent_id, targets in list(six.iteritems(self._by_agent.get(schema, {}))):
+            for target_id, permissions in list(six.iteritems(targets)):
+                for permission in list(permissions):
+                    yield agent_id, target_id, permission
+
+    def _get_existing_permissions(self, rows, schema):
+        return {
+            (self._get_id(agent), self._get_id(target), permission)
+            for agent, target, permission in rows
+            if permission in self._lookup(agent, target, schema)
+        }
+
+    def _add_permissions(self, rows, schema):
+        written, _ = self._write('_add_permissions', rows, schema)
+        if not written and self._get_existing_permissions(rows, schema):
+            raise exceptions.PermissionExists()
+        for agent, target, permission in rows:
+            self._store(agent, target, schema, permission)
+
+    def _remove_permissions(self, rows, schema):
+        written, count = self._write('_remove_permissions', rows, schema)
+        removed = sum(
+            self._discard(agent, target, schema, permission)
+            for agent, target, permission in rows
+        )
+        return count if written else removed
+
+    def _get_mask(self, agent, target, schema,
+                  Agent=None, Target=None, custom=None):
+        if Agent is not None or Target is not None or custom is not None:
+            return self._get_backend()._get_mask(
+                agent, target, schema,
+                Agent=Agent, Target=Target, custom=custom,
+            )
+        return models._get_bits(schema).encode(self._lookup(agent, target, schema))
+
+    def _get_masks(self, agent, targets, schema):
+        bits = models._get_bits(schema)
+        return {
+            target_id: bits.encode(permissions)
+            for target_id, permissions in six.iteritems(
+                self._get_permissions_many(agent, targets, schema)
+            )
+        }
+
+    def _set_bit(self, agent, target, schema, bit):
+        written, created = self._write('_set_bit', agent, target, schema, bit)
+        permission, = models._get_bits(schema).decode(bit)
+        stored = self._store(agent, target, schema, permission)
+        return created if written else stored
+
+    def _clear_bit(self, agent, target, schema, bit):
+        written, cleared = self._write('_clear_bit', agent, target, schema, bit)
+        permission, = models._get_bits(schema).decode(bit)
+        discarded = self._discard(agent, target, schema, permission)
+        return cleared if written else discarded
+
+
+@contextlib.contextmanager
+def _no_queries():
+    yield lambda: 0
@@ -3,12 +3,24 @@
 
 from __future__ import absolute_import
 
+import operator
+import functools
+import collections
+
 import peewee as pw
 
 from guardrail.core import models
 from guardrail.core import exceptions
 
 
+def _match_permissions(schema, permissions):
+    """Build a condition matching rows that grant any of `permissions`."""
+    bits = models._get_bits(schema)
+    if bits is not None:
+        return schema.mask.bin_and(bits.encode(permissions)) != 0
+    return schema.permission << list(permissions)
+
+
 class PeeweePermissionManager(models.BasePermissionManager):
 
     @staticmethod
@@ -16,6 +28,10 @@ class PeeweePermissionManager(models.BasePermissionManager):
         """Peewee cannot create references to unsaved records."""
         return record.get_id() is not None
 
+    @staticmethod
+    def _get_id(record):
+        return record.get_id()
+
     @staticmethod
     def _build_query(query, agent, target, schema, Agent=None, Target=None, custom=None):
         if Agent is None:
@@ -45,6 +61,121 @@ class PeeweePermissionManager(models.BasePermissionManager):
         )
         return bool(query.first())
 
+    def _has_any_permission(self, agent, target, schema, permissions,
+                            Agent=None, Target=None, custom=None):
+        query = schema.select(schema.permission)
+        query = query.where(schema.permission << list(permissions))
+        query = self._build_query(
+            query, agent, target, schema,
+            Agent=Agent, Target=Target, custom=custom,
+        )
+        return bool(query.first())
+
+    def _has_all_permissions(self, agent, target, schema, permissions,
+                             Agent=None, Target=None, custom=None):
+        query = schema.select(pw.fn.COUNT(pw.fn.DISTINCT(schema.permission)))
+        query = query.where(schema.permission << list(permissions))
+        query = self._build_query(
+            query, agent, target, schema,
+            Agent=Agent, Target=Target, custom=custom,
+        )
+        return query.scalar() == len(permissions)
+
+    def _get_permissions_many(self, agent, targets, schema):
+        query = schema.select(schema.target, schema.permission)
+        query = query.where(
+            schema.agent == agent,
+            schema.target << [self._get_id(target) for target in targets],
+        )
+        results = collections.defaultdict(set)
+        for target_id, permission in query.tuples():
+            results[target_id].add(permission)
+        return results
+
+    def _has_permission_many(self, agent, targets, schema, permissions):
+        query = schema.select(schema.target).distinct()
+        query = query.where(
+            schema.agent == agent,
+            schema.permission << list(permissions),
+            schema.target << [self._get_id(target) for target in targets],
+        )
+        return {target_id for target_id, in query.tuples()}
+
+    def _filter_targets(self, agent, Target, schema, permissions):
+        subquery = schema.select(schema.target)
+        subquery = subquery.where(schema.agent == agent)
+        if permissions is not None:
+            subquery = subquery.where(_match_permissions(schema, permissions))
+        return Target.select().where(Target._meta.primary_key << subquery)
+
+    def _agents_with_permission(self, target, Agent, schema, permissions):
+        """Peewee does not use server-side cursors, so page through matching
+        agents by primary key instead.
+        """
+        subquery = schema.select(schema.agent)
+        subquery = subquery.where(
+            schema.target == target,
+            _match_permissions(schema, permissions),
+        )
+        primary = Agent._meta.primary_key
+        query = Agent.select().where(primary << subquery)
+        query = query.order_by(primary).limit(self.batch_size)
+        last = None
+        while True:
+            page = query if last is None else query.where(primary > last)
+            agents = list(page)
+            for agent in agents:
+                yield agent
+            if len(agents) < self.batch_size:
+                return
+            last = agents[-1].get_id()
+
+    def _iter_rows(self, schema):
+        """Page through rows by primary key; see :meth:`_agents_with_permission`."""
+        value = schema.mask if models._get_bits(schema) is not None else schema.permission
+        query = schema.select(schema.id, schema.agent, schema.target, value)
+        query = query.order_by(schema.id).limit(self.batch_size).tuples()
+        last = None
+        while True:
+            page = query if last is None else query.where(schema.id > last)
+            rows = list(page)
+            for row in rows:
+                yield row[1:]
+            if len(rows) < self.batch_size:
+                return
+            last = rows[-1][0]
+
+    def _match_rows(self, rows, schema):
+        clauses = []
+        for (agent_id, permission), target_ids in self._group_rows(rows).items():
+            match = (schema.agent == agent_id) & (schema.permission == permission)
+            clauses.append(match & (schema.target << target_ids))
+        return functools.reduce(operator.or_, clauses)
+
+    def _get_existing_permissions(self, rows, schema):
+        query = schema.select(schema.agent, schema.target, schema.permission)
+        query = query.where(self._match_rows(rows, schema))
+        return set(query.tuples())
+
+    def _add_permissions(self, rows, schema):
+        query = schema.insert_many([
+            dict(
+                agent=self._get_id(agent),
+                target=self._get_id(target),
+                permission=permission,
+            )
+            for agent, target, permission in rows
+        ])
+        try:
+            query.execute()
+        except pw.IntegrityError:
+            raise exceptions.PermissionExists()
+
+    def _remove_permissions(self, rows, schema):
+        query = schema.delete()
+        query = query.where(self._match_rows(rows, schema))
+        return query.execute()
+
     def _add_permission(self, agent, target, schema, permission):
         try:
             return schema.create(
@@ -55,6 +186,72 @@ class PeeweePermissionManager(models.BasePermissionManager):
         except pw.IntegrityError:
             raise exceptions.PermissionExists()
 
+    def _ensure_permission(self, agent, target, schema, permission):
+        """Insert with `INSERT OR IGNORE` on SQLite; on other databases, insert
+        within a savepoint.
+        """
+        database = schema._meta.database
+        if not isinstance(database, pw.SqliteDatabase):
+            try:
+                with database.atomic():
+                    schema.create(agent=agent, target=target, permission=permission)
+            except pw.IntegrityError:
+                return False
+            return True
+        query = schema.insert(
+            agent=agent,
+            target=target,
+            permission=permission,
+        ).on_conflict('IGNORE')
+        cursor = database.execute_sql(*query.sql())
+        return database.rows_affected(cursor) > 0
+
+    def _get_mask(self, agent, target, schema,
+                  Agent=None, Target=None, custom=None):
+        query = schema.select(schema.mask)
+        query = self._build_query(
+            query, agent, target, schema,
+            Agent=Agent, Target=Target, custom=custom,
+        )
+        return functools.reduce(operator.or_, [mask for mask, in query.tuples()], 0)
+
+    def _get_masks(self, agent, targets, schema):
+        query = schema.select(schema.target, schema.mask)
+        query = query.where(
+            schema.agent == agent,
+            schema.target << [self._get_id(target) for target in targets],
+        )
+        return dict(query.tuples())
+
+    def _update_bit(self, agent, target, schema, bit, value):
+        """Set or clear `bit` with a single conditional `UPDATE`.
+
+        :returns: Whether the bitmask was changed
+        """
+        masked = schema.mask.bin_and(bit)
+        query = schema.update(
+            mask=schema.mask + bit if value else schema.mask - bit,
+        ).where(
+            schema.agent == agent,
+            schema.target == target,
+            masked == 0 if value else masked != 0,
+        )
+        return query.execute() > 0
+
+    def _set_bit(self, agent, target, schema, bit):
+        if self._update_bit(agent, target, schema, bit, True):
+            return True
+        try:
+            with schema._meta.database.atomic():
+                schema.insert(agent=agent, target=target, mask=bit).execute()
+        except pw.IntegrityError:
+            # Row exists, but may have been created concurrently without `bit`
+            return self._update_bit(agent, target, schema, bit, True)
+        return True
+
+    def _clear_bit(self, agent, target, schema, bit):
+        return self._update_bit(agent, target, schema, bit, False)
+
     def _remove_permission(self, agent, target, schema, permission):
         query = schema.delete()
         query = query.where(schema.permission == permission)
@@ -91,27 +288,37 @@ class PeeweePermissionSchemaFactory(models.BasePermissionSchemaFactory):
     def _get_table_name(schema):
         return schema._meta.db_table
 
-    def _make_schema_meta(self, agent, target):
+    def _make_schema_meta(self, agent, target, kind='permission',
+                          columns=('agent', 'target', 'permission')):
         return type(
             'Meta',
             (object, ),
             dict(
-                db_table=self._make_table_name(agent, target),
+                db_table=self._make_table_name(agent, target, kind),
                 indexes=(
-                    (('agent', 'target', 'permission'), True),
+                    (columns, True),
                 ),
             ),
         )
 
-    def _make_schema_dict(self, agent, target):
+    def _make_schema_dict(self, agent, target, kind='permission'):
         return dict(
-            Meta=self._make_schema_meta(agent, target),
+            Meta=self._make_schema_meta(agent, target, kind),
             id=pw.PrimaryKeyField(),
             agent=_reference_column(agent, null=False, index=True),
             target=_reference_column(target, null=False, index=True),
             permission=pw.CharField(null=False, index=True),
         )
 
+    def _make_compact_schema_dict(self, agent, target, kind='permission'):
+        return dict(
+            Meta=self._make_schema_meta(agent, target, kind, columns=('agent', 'target')),
+            id=pw.PrimaryKeyField(),
+            agent=_reference_column(agent, null=False, index=True),
+            target=_reference_column(target, null=False, index=True),
+            mask=pw.BigIntegerField(null=False, default=0),
+        )
+
 
 class PeeweeLoader(models.BaseLoader):
 
@@ -123,3 +330,20 @@ class PeeweeLoader(models.BaseLoader):
         return self.schema.select().where(
             self.column == kwargs.get(self.kwarg)
         ).first()
+
+    def load_with_permission(self, agent, permissions, registry, *args, **kwargs):
+        schema = registry.get_effective_permission(models._get_class(agent), self.schema)
+        permissions = registry.get_implying(permissions)
+        allowed = schema.select(schema.id).where(
+            schema.target == self.schema._meta.primary_key,
+            schema.agent == agent,
+            _match_permissions(schema, permissions),
+        )
+        record = self.schema.select(
+            self.schema, pw.fn.EXISTS(allowed).alias('allowed')
+        ).where(
+            self.column == kwargs.get(self.kwarg)
+        ).first()
+        if record is None:
+            return None, False
+        return record, bool(record.allowed)
@@ -3,47 +3,280 @@
 
 from __future__ import absolute_import
 
+import operator
+import functools
+import contextlib
+import collections
+
 import pony.orm as pn
 
 from guardrail.core import models
 from guardrail.core import exceptions
 
 
+def _count_stats(database):
+    """Count queries executed by `database` in the current thread, from Pony
+    query statistics.
+    """
+    total = database.local_stats.get(None)
+    return total.db_count if total is not None else 0
+
+
+def _has_bits(alias, mask):
+    """Build a raw SQL condition matching rows of query variable `alias` whose
+    bitmask shares a bit with `mask`, for use inside Pony queries. Pony cannot
+    translate bitwise operators; `raw_sql` binds `$mask` from this function's
+    arguments.
+    """
+    return pn.raw_sql('({0}.mask & $mask) <> 0'.format(alias))
+
+
+def _get_cached(schema, agent, target, permission):
+    """Get the row for the unique (agent, target, permission) key if it is
+    loaded in the current session, without querying the database.
+    """
+    values = {schema.agent: agent, schema.target: target, schema.permission: permission}
+    try:
+        row, _ = schema._find_in_cache_(None, values)
+    except pn.ObjectNotFound:
+        return None
+    return row
+
+
 class PonyPermissionManager(models.BasePermissionManager):
+    """Permission manager for use with Pony. Queries on permission schemas are
+    built from keyword filters and unique-key lookups rather than lambdas or
+    generator expressions where possible, since Pony translates the latter on
+    each call.
+    """
 
     @staticmethod
     def _is_saved(record):
         return True
 
+    @staticmethod
+    def _get_id(record):
+        return record.get_pk()
+
+    @contextlib.contextmanager
+    def _count_queries(self, schema):
+        if schema is None:
+            yield lambda: None
+            return
+        database = schema._database_
+        start = _count_stats(database)
+        yield lambda: _count_stats(database) - start
+
     @staticmethod
     def _build_query(query, agent, target, schema,
                      Agent=None, Target=None, custom=None):
         if Agent is None:
-            query = query.filter(lambda row: row.agent == agent)
+            query = query.filter(agent=agent)
         if Target is None:
-            query = query.filter(lambda row: row.target == target)
+            query = query.filter(target=target)
         if custom is not None:
             query = custom(query, agent=agent, target=target, schema=schema)
         return query
 
     def _get_permissions(self, agent, target, schema,
                          Agent=None, Target=None, custom=None):
-        query = pn.select(row for row in schema)
         query = self._build_query(
-            query, agent, target, schema,
+            schema.select(), agent, target, schema,
             Agent=Agent, Target=Target, custom=custom,
         )
         return {row.permission for row in query}
 
     def _has_permission(self, agent, target, schema, permission,
                         Agent=None, Target=None, custom=None):
-        query = pn.select(row for row in schema if row.permission == permission)
+        if Agent is None and Target is None and custom is None:
+            return schema.exists(agent=agent, target=target, permission=permission)
         query = self._build_query(
-            query, agent, target, schema,
+            schema.select(permission=permission), agent, target, schema,
             Agent=Agent, Target=Target, custom=custom,
         )
         return query.exists()
 
+    def _get_permissions_many(self, agent, targets, schema):
+        query = pn.select(
+            (row.target, row.permission) for row in schema
+            if row.agent == agent and row.target in targets
+        )
+        results = collections.defaultdict(set)
+        for target, permission in query:
+            results[target.get_pk()].add(permission)
+        return results
+
+    def _has_permission_many(self, agent, targets, schema, permissions):
+        permissions = list(permissions)
+        query = pn.select(
+            row.target for row in schema
+            if row.agent == agent and row.permission in permissions
+            if row.target in targets
+        )
+        return {target.get_pk() for target in query}
+
+    def _filter_targets(self, agent, Target, schema, permissions):
+        if permissions is None:
+            return pn.select(
+                target for target in Target
+                if pn.exists(
+                    row for row in schema
+                    if row.target == target and row.agent == agent
+                )
+            )
+        bits = models._get_bits(schema)
+        if bits is not None:
+            matches = _has_bits('row', bits.encode(permissions))
+            return pn.select(
+                target for target in Target
+                if pn.exists(
+                    row for row in schema
+                    if row.target == target and row.agent == agent and matches
+                )
+            )
+        permissions = list(permissions)
+        return pn.select(
+            target for target in Target
+            if pn.exists(
+                row for row in schema
+                if row.target == target and row.agent == agent
+                if row.permission in permissions
+            )
+        )
+
+    def _agents_with_permission(self, target, Agent, schema, permissions):
+        """Pony does not stream query results, so page through matching agents
+        by primary key instead. Note: Loaded agents are retained in the Pony
+        session cache until the session ends.
+        """
+        bits = models._get_bits(schema)
+        if bits is not None:
+            matches = _has_bits('row', bits.encode(permissions))
+            query = pn.select(
+                agent for agent in Agent
+                if pn.exists(
+                    row for row in schema
+                    if row.agent == agent and row.target == target and matches
+                )
+            )
+        else:
+            permissions = list(permissions)
+            query = pn.select(
+                agent for agent in Agent
+                if pn.exists(
+                    row for row in schema
+                    if row.agent == agent and row.target == target
+                    if row.permission in permissions
+                )
+            )
+        query = query.order_by(Agent._pk_)
+        column, last = Agent._pk_.name, None
+        while True:
+            page = query
+            if last is not None:
+                page = page.filter(lambda agent: getattr(agent, column) > last)
+            agents = page.limit(self.batch_size)[:]
+            for agent in agents:
+                yield agent
+            if len(agents) < self.batch_size:
+                return
+            last = agents[-1].get_pk()
+
+    def _iter_rows(self, schema):
+        """Page through rows by primary key; see :meth:`_agents_with_permission`."""
+        column = 'mask' if models._get_bits(schema) is not None else 'permission'
+        query = schema.select().order_by(schema.id)
+        last = None
+        while True:
+            page = query
+            if last is not None:
+                page = page.filter(lambda row: row.id > last)
+            rows = page.limit(self.batch_size)[:]
+            for row in rows:
+                yield row.agent.get_pk(), row.target.get_pk(), getattr(row, column)
+            if len(rows) < self.batch_size:
+                return
+            last = rows[-1].id
+
+    def _get_existing_permissions(self, rows, schema):
+        agents = list({agent for agent, _, _ in rows})
+        targets = list({target for _, target, _ in rows})
+        query = pn.select(
+            (row.agent, row.target, row.permission) for row in schema
+            if row.agent in agents and row.target in targets
+        )
+        return {
+            (agent.get_pk(), target.get_pk(), permission)
+            for agent, target, permission in query
+        }
+
+    def _ensure_permission(self, agent, target, schema, permission):
+        """Pony does not support savepoints, so check the unique (agent,
+        target, permission) key before creating the row. Note: A concurrent
+        grant committed between the check and the flush raises on flush.
+        """
+        if schema.exists(agent=agent, target=target, permission=permission):
+            return False
+        schema(agent=agent, target=target, permission=permission)
+        return True
+
+    def _get_mask(self, agent, target, schema,
+                  Agent=None, Target=None, custom=None):
+        query = self._build_query(
+            schema.select(), agent, target, schema,
+            Agent=Agent, Target=Target, custom=custom,
+        )
+        return functools.reduce(operator.or_, [row.mask for row in query], 0)
+
+    def _get_masks(self, agent, targets, schema):
+        query = pn.select(
+            (row.target, row.mask) for row in schema
+            if row.agent == agent and row.target in targets
+        )
+        return {target.get_pk(): mask for target, mask in query}
+
+    def _set_bit(self, agent, target, schema, bit):
+        """Pony does not support conditional updates, so modify the row in the
+        session. Concurrent modifications are detected by Pony's optimistic
+        checks on flush.
+        """
+        row = schema.get(agent=agent, target=target)
+        if row is None:
+            schema(agent=agent, target=target, mask=bit)
+            return True
+        if row.mask & bit:
+            return False
+        row.mask |= bit
+        return True
+
+    def _clear_bit(self, agent, target, schema, bit):
+        row = schema.get(agent=agent, target=target)
+        if row is None or not row.mask & bit:
+            return False
+        row.mask &= ~bit
+        return True
+
+    def _remove_permissions(self, rows, schema):
+        """Delete rows loaded in the current session through the session, so
+        that Pony drops them from its cache, then delete the remaining rows
+        with one bulk `DELETE` per agent and permission.
+        """
+        count = 0
+        groups = collections.defaultdict(list)
+        for agent, target, permission in rows:
+            row = _get_cached(schema, agent, target, permission)
+            if row is not None:
+                row.delete()
+                count += 1
+            else:
+                groups[(agent, permission)].append(target)
+        schema._database_.flush()
+        for (agent, permission), targets in groups.items():
+            query = schema.select(agent=agent, permission=permission)
+            query = query.filter(lambda row: row.target in targets)
+            count += query.delete(bulk=True)
+        return count
+
     def _add_permission(self, agent, target, schema, permission):
         try:
             return schema(
@@ -55,10 +288,11 @@ class PonyPermissionManager(models.BasePermissionManager):
             raise exceptions.PermissionExists()
 
     def _remove_permission(self, agent, target, schema, permission):
-        query = pn.select(row for row in schema if row.permission == permission)
-        query = self._build_query(query, agent, target, schema)
-        row = query.first()
-        if not row:
+        """Look up the row on the unique (agent, target, permission) key, which
+        is served from the session cache if the row has already been loaded.
+        """
+        row = schema.get(agent=agent, target=target, permission=permission)
+        if row is None:
             raise exceptions.PermissionNotFound
         row.delete()
 
@@ -75,35 +309,49 @@ class PonyPermissionSchemaFactory(models.BasePermissionSchemaFactory):
         schema._attrs_.append(reverse)
         schema._new_attrs_.append(reverse)
 
-    def _update_agent(self, agent, target, schema):
+    def _make_reverse_name(self, prefix, schema, kind):
+        name = '{0}_{1}'.format(prefix, self._get_table_name(schema).lower())
+        if kind != 'permission':
+            name = '{0}_{1}'.format(name, self.suffixes[kind])
+        return name
+
+    def _update_agent(self, agent, target, schema, kind='permission'):
         reverse = pn.Set(schema)
-        name = 'targets_{0}'.format(self._get_table_name(target).lower())
+        name = self._make_reverse_name('targets', target, kind)
         self._update_schema(agent, name, reverse)
 
-    def _update_target(self, agent, target, schema):
+    def _update_target(self, agent, target, schema, kind='permission'):
         reverse = pn.Set(schema)
-        name = 'agents_{0}'.format(self._get_table_name(agent).lower())
+        name = self._make_reverse_name('agents', agent, kind)
         self._update_schema(target, name, reverse)
 
-    def _update_parents(self, agent, target, schema):
-        self._update_agent(agent, target, schema)
-        self._update_target(agent, target, schema)
+    def _update_parents(self, agent, target, schema, kind='permission'):
+        self._update_agent(agent, target, schema, kind)
+        self._update_target(agent, target, schema, kind)
 
-    def _make_schema_dict(self, agent, target):
+    def _make_index(self, *columns):
+        return pn.core.Index(*columns, is_pk=False, is_unique=True)
+
+    def _make_schema_dict(self, agent, target, kind='permission'):
         return dict(
-            _table_=self._make_table_name(agent, target),
-            _indexes_=[
-                pn.core.Index(
-                    'agent', 'target', 'permission',
-                    is_pk=False, is_unique=True,
-                )
-            ],
+            _table_=self._make_table_name(agent, target, kind),
+            _indexes_=[self._make_index('agent', 'target', 'permission')],
             id=pn.PrimaryKey(int, auto=True),
             agent=pn.Required(agent, index=True),
             target=pn.Required(target, index=True),
             permission=pn.Required(str, 255, index=True),
         )
 
+    def _make_compact_schema_dict(self, agent, target, kind='permission'):
+        return dict(
+            _table_=self._make_table_name(agent, target, kind),
+            _indexes_=[self._make_index('agent', 'target')],
+            id=pn.PrimaryKey(int, auto=True),
+            agent=pn.Required(agent, index=True),
+            target=pn.Required(target, index=True),
+            mask=pn.Required(int, size=64, default=0),
+        )
+
 
 class PonyLoader(models.BaseLoader):
 
@@ -113,8 +361,40 @@ class PonyLoader(models.BaseLoader):
 
     def __call__(self, *args, **kwargs):
         query = {self.column: kwargs.get(self.kwarg)}
-        return pn.select(
-            row for row in self.schema
-        ).filter(
-            **query
-        ).first()
+        return self.schema.select(**query).first()
+
+    def load_with_permission(self, agent, permissions, registry, *args, **kwargs):
+        schema = registry.get_effective_permission(models._get_class(agent), self.schema)
+        permissions = registry.get_implying(permissions)
+        column, value = self.column, kwargs.get(self.kwarg)
+        bits = models._get_bits(schema)
+        if bits is not None:
+            matches = _has_bits('each', bits.encode(permissions))
+            row = pn.select(
+                (
+                    target,
+                    pn.exists(
+                        each for each in schema
+                        if each.target == target and each.agent == agent and matches
+                    ),
+                )
+                for target in self.schema
+                if getattr(target, column) == value
+            ).first()
+        else:
+            permissions = list(permissions)
+            row = pn.select(
+                (
+                    target,
+                    pn.exists(
+                        each for each in schema
+                        if each.target == target and each.agent == agent
+                        if each.permission in permissions
+                    ),
+                )
+                for target in self.schema
+                if getattr(target, column) == value
+            ).first()
+        if row is None:
+            return None, False
+        return row[0], bool(row[1])
@@ -3,7 +3,13 @@
 
 from __future__ import absolute_import
 
+import operator
+import functools
+import contextlib
+import collections
+
 import sqlalchemy as sa
+from sqlalchemy.ext import baked
 
 from guardrail.core import models
 from guardrail.core import exceptions
@@ -17,16 +23,94 @@ def _get_primary_column(schema):
     raise RuntimeError('Composite foreign keys not currently supported')
 
 
+def _match_permissions(schema, permissions):
+    """Build a condition matching rows that grant any of `permissions`, or any
+    rows if `permissions` is `None`.
+    """
+    if permissions is None:
+        return sa.true()
+    bits = models._get_bits(schema)
+    if bits is not None:
+        return schema.mask.op('&')(bits.encode(permissions)) != 0
+    return schema.permission.in_(permissions)
+
+
+def _select_permissions(schema):
+    return sa.select([schema.permission]).where(sa.and_(
+        schema.agent_id == sa.bindparam('agent_id'),
+        schema.target_id == sa.bindparam('target_id'),
+    ))
+
+
+def _select_permission(schema):
+    return _select_permissions(schema).where(
+        schema.permission == sa.bindparam('permission')
+    ).limit(1)
+
+
+def _insert_ignore(schema, dialect):
+    table = schema.__table__
+    if dialect == 'sqlite':
+        return table.insert().prefix_with('OR IGNORE')
+    if dialect == 'mysql':
+        return table.insert().prefix_with('IGNORE')
+    if dialect == 'postgresql':
+        from sqlalchemy.dialects import postgresql
+        return postgresql.insert(table).on_conflict_do_nothing()
+    return None
+
+
 class SqlalchemyPermissionManager(models.BasePermissionManager):
+    """Permission manager for use with SQLAlchemy. Permission checks that do
+    not use custom schemas or filters skip ORM query construction, executing
+    statements that are built once per permission schema and compiled once per
+    dialect.
+
+    Failed grants roll back to a savepoint rather than rolling back the
+    session. On SQLite, where pysqlite commits the enclosing transaction when a
+    savepoint is released, grants instead use `INSERT OR IGNORE`, and no
+    savepoints are issued.
+
+    :param session: SQLAlchemy session
+    :param _Registry registry: Optional registry object; use global `registry`
+        if not provided.
+    :param cache: Optional permission cache; see :mod:`guardrail.core.cache`
+    :param negative_cache: Optional negative cache; see
+        :class:`guardrail.core.cache.NegativeCache`
+    """
+    #: Statements keyed on permission schema and statement builder
+    _statements = {}
+    #: Compiled forms of `_statements`, shared between managers
+    _compiled_cache = {}
 
-    def __init__(self, session, registry=registry):
-        super(SqlalchemyPermissionManager, self).__init__(registry)
+    def __init__(self, session, registry=registry, cache=None, negative_cache=None):
+        super(SqlalchemyPermissionManager, self).__init__(registry, cache, negative_cache)
         self.session = session
 
     @staticmethod
     def _is_saved(record):
         return True
 
+    @staticmethod
+    def _get_id(record):
+        identity = sa.inspection.inspect(record).identity
+        return identity[0] if identity else None
+
+    @contextlib.contextmanager
+    def _count_queries(self, schema):
+        mapper = sa.inspection.inspect(schema) if schema is not None else None
+        connection = self.session.connection(mapper=mapper)
+        count = [0]
+
+        def listener(*args, **kwargs):
+            count[0] += 1
+
+        sa.event.listen(connection, 'before_cursor_execute', listener)
+        try:
+            yield lambda: count[0]
+        finally:
+            sa.event.remove(connection, 'before_cursor_execute', listener)
+
     @staticmethod
     def _build_query(query, agent, target, schema, Agent=None, Target=None, custom=None):
         if Agent is None:
@@ -37,8 +121,38 @@ class SqlalchemyPermissionManager(models.BasePermissionManager):
             query = custom(query, agent=agent, target=target, schema=schema)
         return query
 
+    def _get_params(self, agent, target, Agent=None, Target=None, custom=None):
+        """Get bound parameters for a precompiled statement, or `None` if the
+        query must be built through the ORM.
+        """
+        if Agent is not None or Target is not None or custom is not None:
+            return None
+        agent_id, target_id = self._get_id(agent), self._get_id(target)
+        if agent_id is None or target_id is None:
+            return None
+        return {'agent_id': agent_id, 'target_id': target_id}
+
+    def _execute(self, schema, build, params):
+        """Execute the statement produced by `build` for `schema`, compiling it
+        on first use.
+        """
+        key = (schema, build)
+        try:
+            statement = self._statements[key]
+        except KeyError:
+            statement = self._statements[key] = build(schema)
+        if self.session.autoflush:
+            self.session.flush()
+        connection = self.session.connection(mapper=sa.inspection.inspect(schema))
+        connection = connection.execution_options(compiled_cache=self._compiled_cache)
+        return connection.execute(statement, params)
+
     def _get_permissions(self, agent, target, schema,
                          Agent=None, Target=None, custom=None):
+        params = self._get_params(agent, target, Agent, Target, custom)
+        if params is not None:
+            rows = self._execute(schema, _select_permissions, params)
+            return {permission for permission, in rows}
         query = self.session.query(schema.permission)
         query = self._build_query(
             query, agent, target, schema,
@@ -48,6 +162,10 @@ class SqlalchemyPermissionManager(models.BasePermissionManager):
 
     def _has_permission(self, agent, target, schema, permission,
                         Agent=None, Target=None, custom=None):
+        params = self._get_params(agent, target, Agent, Target, custom)
+        if params is not None:
+            params['permission'] = permission
+            return self._execute(schema, _select_permission, params).first() is not None
         query = self.session.query(schema.permission)
         query = query.filter(schema.permission == permission)
         query = self._build_query(
@@ -56,20 +174,262 @@ class SqlalchemyPermissionManager(models.BasePermissionManager):
         )
         return bool(query.first())
 
+    def _has_any_permission(self, agent, target, schema, permissions,
+                            Agent=None, Target=None, custom=None):
+        query = self.session.query(schema.permission)
+        query = query.filter(schema.permission.in_(permissions))
+        query = self._build_query(
+            query, agent, target, schema,
+            Agent=Agent, Target=Target, custom=custom,
+        )
+        return bool(query.first())
+
+    def _has_all_permissions(self, agent, target, schema, permissions,
+                             Agent=None, Target=None, custom=None):
+        query = self.session.query(sa.func.count(sa.distinct(schema.permission)))
+        query = query.filter(schema.permission.in_(permissions))
+        query = self._build_query(
+            query, agent, target, schema,
+            Agent=Agent, Target=Target, custom=custom,
+        )
+        return query.scalar() == len(permissions)
+
+    def _get_permissions_many(self, agent, targets, schema):
+        query = self.session.query(schema.target_id, schema.permission)
+        query = query.filter(
+            schema.agent == agent,
+            schema.target_id.in_([self._get_id(target) for target in targets]),
+        )
+        results = collections.defaultdict(set)
+        for target_id, permission in query:
+            results[target_id].add(permission)
+        return results
+
+    def _has_permission_many(self, agent, targets, schema, permissions):
+        query = self.session.query(schema.target_id).distinct()
+        query = query.filter(
+            schema.agent == agent,
+            schema.permission.in_(list(permissions)),
+            schema.target_id.in_([self._get_id(target) for target in targets]),
+        )
+        return {each.target_id for each in query}
+
+    def _filter_targets(self, agent, Target, schema, permissions):
+        query = self.session.query(Target)
+        return query.filter(
+            sa.exists().where(sa.and_(
+                schema.target_id == _get_primary_column(Target),
+                schema.agent == agent,
+                _match_permissions(schema, permissions),
+            ))
+        )
+
+    def _agents_with_permission(self, target, Agent, schema, permissions):
+        query = self.session.query(Agent)
+        query = query.filter(
+            sa.exists().where(sa.and_(
+                schema.agent_id == _get_primary_column(Agent),
+                schema.target == target,
+                _match_permissions(schema, permissions),
+            ))
+        )
+        for agent in query.yield_per(self.batch_size):
+            yield agent
+
+    def _iter_rows(self, schema):
+        value = schema.mask if models._get_bits(schema) is not None else schema.permission
+        query = self.session.query(schema.agent_id, schema.target_id, value)
+        for row in query.yield_per(self.batch_size):
+            yield tuple(row)
+
+    def add_permissions(self, permissions, skip_duplicates=False):
+        """Grant many permissions. Batched inserts bind primary keys rather than
+        records, so agent and target records are added to the session and
+        flushed first.
+        """
+        permissions = list(permissions)
+        self.session.add_all(
+            record for agent, target, _ in permissions for record in (agent, target)
+        )
+        self.session.flush()
+        return super(SqlalchemyPermissionManager, self).add_permissions(
+            permissions,
+            skip_duplicates=skip_duplicates,
+        )
+
+    def _match_rows(self, rows, schema):
+        return sa.or_(*[
+            sa.and_(
+                schema.agent_id == agent_id,
+                schema.permission == permission,
+                schema.target_id.in_(target_ids),
+            )
+            for (agent_id, permission), target_ids in self._group_rows(rows).items()
+        ])
+
+    def _get_dialect(self, schema):
+        bind = self.session.get_bind(mapper=sa.inspection.inspect(schema))
+        return bind.dialect.name
+
+    def _supports_savepoints(self, schema):
+        """Check whether savepoints can be used without ending the enclosing
+        transaction. pysqlite commits the transaction when a savepoint is
+        released, unless its transaction handling has been overridden.
+        """
+        return self._get_dialect(schema) != 'sqlite'
+
+    def _get_existing_permissions(self, rows, schema):
+        query = self.session.query(schema.agent_id, schema.target_id, schema.permission)
+        query = query.filter(self._match_rows(rows, schema))
+        return {tuple(each) for each in query}
+
+    def _add_permissions(self, rows, schema):
+        """Insert within a savepoint; on SQLite, check for existing permissions
+        and insert with `INSERT OR IGNORE`.
+        """
+        values = [
+            dict(
+                agent_id=self._get_id(agent),
+                target_id=self._get_id(target),
+                permission=permission,
+            )
+            for agent, target, permission in rows
+        ]
+        if not self._supports_savepoints(schema):
+            keys = {
+                (each['agent_id'], each['target_id'], each['permission'])
+                for each in values
+            }
+            if len(keys) < len(values) or self._get_existing_permissions(rows, schema):
+                raise exceptions.PermissionExists()
+            self.session.execute(_insert_ignore(schema, 'sqlite'), values)
+            return
+        try:
+            with self.session.begin_nested():
+                self.session.execute(schema.__table__.insert(), values)
+        except sa.exc.IntegrityError:
+            raise exceptions.PermissionExists()
+
+    def _remove_permissions(self, rows, schema):
+        query = self.session.query(schema)
+        query = query.filter(self._match_rows(rows, schema))
+        return query.delete(synchronize_session=False)
+
     def _add_permission(self, agent, target, schema, permission):
+        """Insert within a savepoint; on SQLite, insert with `INSERT OR IGNORE`
+        and check the row count.
+        """
+        if not self._supports_savepoints(schema):
+            self.session.add_all((agent, target))
+            self.session.flush()
+            values = dict(
+                agent_id=self._get_id(agent),
+                target_id=self._get_id(target),
+                permission=permission,
+            )
+            result = self.session.execute(_insert_ignore(schema, 'sqlite'), values)
+            if not result.rowcount:
+                raise exceptions.PermissionExists()
+            row = schema(id=result.inserted_primary_key[0], **values)
+            # Attach as a persistent record, without issuing another query
+            sa.orm.make_transient_to_detached(row)
+            self.session.add(row)
+            return row
         row = schema(
             agent=agent,
             target=target,
             permission=permission,
         )
-        self.session.add(row)
         try:
-            self.session.flush()
+            with self.session.begin_nested():
+                self.session.add(row)
         except sa.exc.IntegrityError:
-            self.session.rollback()
             raise exceptions.PermissionExists()
         return row
 
+    def _ensure_permission(self, agent, target, schema, permission):
+        """Insert with `INSERT OR IGNORE` on SQLite, `INSERT IGNORE` on MySQL,
+        or `ON CONFLICT DO NOTHING` on PostgreSQL; on other databases, insert
+        within a savepoint.
+        """
+        statement = _insert_ignore(schema, self._get_dialect(schema))
+        if statement is None:
+            return super(SqlalchemyPermissionManager, self)._ensure_permission(
+                agent, target, schema, permission,
+            )
+        self.session.add_all((agent, target))
+        self.session.flush()
+        result = self.session.execute(statement, dict(
+            agent_id=self._get_id(agent),
+            target_id=self._get_id(target),
+            permission=permission,
+        ))
+        return result.rowcount > 0
+
+    def _get_mask(self, agent, target, schema,
+                  Agent=None, Target=None, custom=None):
+        query = self.session.query(schema.mask)
+        query = self._build_query(
+            query, agent, target, schema,
+            Agent=Agent, Target=Target, custom=custom,
+        )
+        return functools.reduce(operator.or_, [mask for mask, in query], 0)
+
+    def _get_masks(self, agent, targets, schema):
+        query = self.session.query(schema.target_id, schema.mask)
+        query = query.filter(
+            schema.agent == agent,
+            schema.target_id.in_([self._get_id(target) for target in targets]),
+        )
+        return dict(query)
+
+    def _update_bit(self, agent, target, schema, bit, value):
+        """Set or clear `bit` with a single conditional `UPDATE`.
+
+        :returns: Whether the bitmask was changed
+        """
+        table = schema.__table__
+        masked = table.c.mask.op('&')(bit)
+        statement = table.update().where(sa.and_(
+            table.c.agent_id == self._get_id(agent),
+            table.c.target_id == self._get_id(target),
+            masked == 0 if value else masked != 0,
+        )).values(
+            mask=table.c.mask + bit if value else table.c.mask - bit,
+        )
+        return self.session.execute(statement).rowcount > 0
+
+    def _set_bit(self, agent, target, schema, bit):
+        self.session.add_all((agent, target))
+        self.session.flush()
+        if self._update_bit(agent, target, schema, bit, True):
+            return True
+        if not self._supports_savepoints(schema):
+            result = self.session.execute(_insert_ignore(schema, 'sqlite'), dict(
+                agent_id=self._get_id(agent),
+                target_id=self._get_id(target),
+                mask=bit,
+            ))
+            # Row may have been created concurrently without `bit`
+            return bool(result.rowcount) or self._update_bit(
+                agent, target, schema, bit, True,
+            )
+        try:
+            with self.session.begin_nested():
+                self.session.execute(schema.__table__.insert(), dict(
+                    agent_id=self._get_id(agent),
+                    target_id=self._get_id(target),
+                    mask=bit,
+                ))
+        except sa.exc.IntegrityError:
+            # Row exists, but may have been created concurrently without `bit`
+            return self._update_bit(agent, target, schema, bit, True)
+        return True
+
+    def _clear_bit(self, agent, target, schema, bit):
+        self.session.flush()
+        return self._update_bit(agent, target, schema, bit, False)
+
     def _remove_permission(self, agent, target, schema, permission):
         query = self.session.query(schema)
         query = query.filter(schema.permission == permission)
@@ -97,16 +457,18 @@ class SqlalchemyPermissionSchemaFactory(models.BasePermissionSchemaFactory):
     :param tuple bases: Base classes for created schema classes
     :param bool cascade: Database backend supports `ON DELETE` and `ON UPDATE`
         cascades; see :meth:`_update_parents` for details
+    :param permissions: Optional sequence of permissions; if provided, create
+        compact join tables storing permissions as bitmasks
     """
-    def __init__(self, bases, cascade=False):
-        super(SqlalchemyPermissionSchemaFactory, self).__init__(bases)
+    def __init__(self, bases, cascade=False, permissions=None):
+        super(SqlalchemyPermissionSchemaFactory, self).__init__(bases, permissions)
         self.cascade = cascade
 
     @staticmethod
     def _get_table_name(schema):
         return schema.__tablename__
 
-    def _update_parents(self, agent, target, schema):
+    def _update_parents(self, agent, target, schema, kind='permission'):
         """Create a many-to-many `relationship` between the `agent` and `target`
         schemas, using the created `schema` as the join table.
 
@@ -126,9 +488,9 @@ class SqlalchemyPermissionSchemaFactory(models.BasePermissionSchemaFactory):
         )
         setattr(agent, attr, relation)
 
-    def _make_schema_dict(self, agent, target):
+    def _make_schema_dict(self, agent, target, kind='permission'):
         return dict(
-            __tablename__=self._make_table_name(agent, target),
+            __tablename__=self._make_table_name(agent, target, kind),
             __table_args__=(
                 sa.UniqueConstraint('agent_id', 'target_id', 'permission'),
             ),
@@ -140,8 +502,24 @@ class SqlalchemyPermissionSchemaFactory(models.BasePermissionSchemaFactory):
             permission=sa.Column(sa.String, nullable=False, index=True),
         )
 
+    def _make_compact_schema_dict(self, agent, target, kind='permission'):
+        return dict(
+            __tablename__=self._make_table_name(agent, target, kind),
+            __table_args__=(
+                sa.UniqueConstraint('agent_id', 'target_id'),
+            ),
+            id=sa.Column(sa.Integer, primary_key=True),
+            agent_id=_reference_column(agent, nullable=False, index=True),
+            agent=sa.orm.relationship(agent),
+            target_id=_reference_column(target, nullable=False, index=True),
+            target=sa.orm.relationship(target),
+            mask=sa.Column(sa.BigInteger, nullable=False, default=0),
+        )
+
 
 class SqlalchemyLoader(models.BaseLoader):
+    #: Baked fused queries, shared between loaders
+    _bakery = baked.bakery()
 
     def __init__(self, schema, session, column=None, kwarg='id'):
         column = column if column is not None else _get_primary_column(schema)
@@ -154,3 +532,40 @@ class SqlalchemyLoader(models.BaseLoader):
         ).filter(
             self.column == kwargs.get(self.kwarg)
         ).first()
+
+    def load_with_permission(self, agent, permissions, registry, *args, **kwargs):
+        """Load a target record and check permissions in a single query. The
+        query is baked once per permission schema and set of permissions, and
+        reused with the agent and target keys as bound parameters.
+        """
+        schema = registry.get_effective_permission(models._get_class(agent), self.schema)
+        permissions = registry.get_implying(permissions)
+        if permissions is not None:
+            permissions = tuple(sorted(permissions))
+
+        def build(session):
+            allowed = sa.exists().where(sa.and_(
+                schema.target_id == _get_primary_column(self.schema),
+                schema.agent_id == sa.bindparam('guardrail_agent'),
+                _match_permissions(schema, permissions),
+            ))
+            return session.query(
+                self.schema, allowed
+            ).filter(
+                self.column == sa.bindparam('guardrail_target')
+            )
+
+        session = self.session
+        if isinstance(session, sa.orm.scoped_session):
+            session = session()
+        state = sa.inspection.inspect(agent)
+        if state.pending:
+            session.flush()
+        query = self._bakery(build, self.schema, self.column, schema, permissions)
+        row = query(session).params(
+            guardrail_agent=state.mapper.primary_key_from_instance(agent)[0],
+            guardrail_target=kwargs.get(self.kwarg),
+        ).first()
+        if row is None:
+            return None, False
+        return row[0], bool(row[1])
@@ -0,0 +1,38 @@
+# -*- coding: utf-8 -*-
+"""Asyncio SQLAlchemy plugin for guardrail. Requires Python 3.5 or later and
+SQLAlchemy 1.4 or later.
+"""
+
+from __future__ import absolute_import
+
+from guardrail.core import aio
+from guardrail.core.registry import registry
+from guardrail.ext.sqlalchemy import SqlalchemyPermissionManager
+
+
+class AsyncSqlalchemyPermissionManager(aio.AsyncPermissionManager):
+    """Permission manager for use with `sqlalchemy.ext.asyncio.AsyncSession`.
+    Rather than offloading calls to a thread pool, queries run on the session's
+    own async connection through `AsyncSession.run_sync`.
+
+    :param session: `AsyncSession` instance
+    :param _Registry registry: Optional registry object; use global `registry`
+        if not provided.
+    :param cache: Optional permission cache; see :mod:`guardrail.core.cache`
+    :param negative_cache: Optional negative cache; see
+        :class:`guardrail.core.cache.NegativeCache`
+    """
+    def __init__(self, session, registry=registry, cache=None, negative_cache=None):
+        manager = SqlalchemyPermissionManager(
+            session.sync_session,
+            registry=registry,
+            cache=cache,
+            negative_cache=negative_cache,
+        )
+        super(AsyncSqlalchemyPermissionManager, self).__init__(manager)
+        self.session = session
+
+    def _run(self, name, *args, **kwargs):
+        return self.session.run_sync(
+            lambda session: getattr(self.manager, name)(*args, **kwargs)
+        )
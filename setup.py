@@ -4,6 +4,7 @@ import re
 import sys
 from setuptools import setup, find_packages
 from setuptools.command.test import test as TestCommand
+from setuptools.command.build_py import build_py as BuildPyCommand
 
 
 REQUIREMENTS = [
@@ -19,6 +20,11 @@ TEST_REQUIREMENTS = [
     'Django',
     'SQLAlchemy',
 ]
+# Modules using `async def`, which are not installed before Python 3.5
+ASYNC_MODULES = [
+    ('guardrail.core', 'aio'),
+    ('guardrail.ext', 'sqlalchemy_aio'),
+]
 
 
 class PyTest(TestCommand):
@@ -36,6 +42,17 @@ class PyTest(TestCommand):
         sys.exit(errcode)
 
 
+class BuildPy(BuildPyCommand):
+    def find_package_modules(self, package, package_dir):
+        modules = BuildPyCommand.find_package_modules(self, package, package_dir)
+        if sys.version_info >= (3, 5):
+            return modules
+        return [
+            module for module in modules
+            if (module[0], module[1]) not in ASYNC_MODULES
+        ]
+
+
 def find_version(fname):
     """Attempts to find the version number in the file names fname.
     Raises RuntimeError if not found.
@@ -73,7 +90,7 @@ setup(
     author='Joshua Carp',
     author_email='jm.carp@gmail.com',
     url='https://github.com/jmcarp/guardrail',
-    packages=find_packages(exclude=('test*', 'examples')),
+    packages=find_packages(exclude=('test*', 'examples', 'benchmarks')),
     package_dir={'guardrail': 'guardrail'},
     install_requires=REQUIREMENTS,
     license=read('LICENSE'),
@@ -93,10 +110,12 @@ setup(
         'Programming Language :: Python :: 3',
         'Programming Language :: Python :: 3.3',
         'Programming Language :: Python :: 3.4',
+        'Programming Language :: Python :: 3.5',
+        'Programming Language :: Python :: 3.6',
         'Programming Language :: Python :: Implementation :: CPython',
         'Programming Language :: Python :: Implementation :: PyPy',
     ],
     test_suite='tests',
     tests_require=TEST_REQUIREMENTS,
-    cmdclass={'test': PyTest},
+    cmdclass={'test': PyTest, 'build_py': BuildPy},
 )
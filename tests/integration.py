@@ -1,8 +1,14 @@
 # -*- coding: utf-8 -*-
 
+import copy
+
 import pytest
 
+from guardrail.core import cache
+from guardrail.core import signals
 from guardrail.core import exceptions
+from guardrail.ext import index
+from guardrail.ext.memory import MemoryPermissionManager
 
 
 class PermissionManagerMixin(object):
@@ -33,6 +39,417 @@ class PermissionManagerMixin(object):
         with pytest.raises(exceptions.PermissionExists):
             manager.add_permission(agent, target, 'read')
 
+    def test_ensure_permission(self):
+        manager, agent, target = self.manager, self.agent, self.target
+        manager.add_permission(agent, target, 'read')
+
+        assert not manager.ensure_permission(agent, target, 'read')
+        assert manager.ensure_permission(agent, target, 'write')
+        count = self.count(manager._get_permission_schema(agent, target))
+        assert not manager.ensure_permission(agent, target, 'write')
+
+        assert manager.get_permissions(agent, target) == {'read', 'write'}
+        assert self.count(manager._get_permission_schema(agent, target)) == count
+
+    def test_ensure_permission_cache(self):
+        manager, agent, target = self.manager, self.agent, self.target
+        manager.cache = cache.PermissionCache()
+        target = self.create_target()
+
+        assert not manager.has_permission(agent, target, 'read')
+        manager.ensure_permission(agent, target, 'read')
+        assert manager.has_permission(agent, target, 'read')
+
+    @pytest.mark.parametrize('chunk_size', [1, 500])
+    def test_many(self, chunk_size):
+        manager, agent, target = self.manager, self.agent, self.target
+        manager.chunk_size = chunk_size
+        other, empty = self.create_target(), self.create_target()
+        targets = [target, other, empty]
+
+        manager.add_permission(agent, target, 'read')
+        manager.add_permission(agent, target, 'write')
+        manager.add_permission(agent, other, 'read')
+
+        assert manager.get_permissions_many(agent, targets) == {
+            target: {'read', 'write'},
+            other: {'read'},
+            empty: set(),
+        }
+        assert manager.has_permission_many(agent, targets, 'write') == {
+            target: True,
+            other: False,
+            empty: False,
+        }
+
+    def test_many_cache(self):
+        manager, agent = self.manager, self.agent
+        manager.cache = cache.PermissionCache()
+        target, other = self.create_target(), self.create_target()
+        manager.add_permission(agent, other, 'read')
+
+        assert manager.has_permission_many(agent, [target, other], 'read') == {
+            target: False,
+            other: True,
+        }
+        assert manager.has_permission(agent, other, 'read')
+        assert (manager.cache.hits, manager.cache.misses) == (1, 2)
+
+    def test_has_any_all(self):
+        manager, agent, target = self.manager, self.agent, self.target
+        manager.add_permission(agent, target, 'read')
+        manager.add_permission(agent, target, 'write')
+
+        assert manager.has_any_permission(agent, target, ['read', 'admin'])
+        assert not manager.has_any_permission(agent, target, ['admin', 'delete'])
+        assert manager.has_all_permissions(agent, target, ['read', 'write'])
+        assert not manager.has_all_permissions(agent, target, ['read', 'admin'])
+
+    def test_add_many_exists(self):
+        manager, agent, target = self.manager, self.agent, self.target
+        manager.add_permission(agent, target, 'read')
+
+        with pytest.raises(exceptions.PermissionExists):
+            manager.add_permissions([(agent, target, 'read')])
+
+    @pytest.mark.parametrize('chunk_size', [1, 500])
+    def test_add_remove_many_skip_duplicates(self, chunk_size):
+        manager, agent, target = self.manager, self.agent, self.target
+        manager.chunk_size = chunk_size
+        other = self.create_target()
+        manager.add_permission(agent, target, 'read')
+
+        count = manager.add_permissions([
+            (agent, target, 'read'),
+            (agent, target, 'write'),
+            (agent, other, 'read'),
+            (agent, other, 'read'),
+        ], skip_duplicates=True)
+
+        assert count == 2
+        assert manager.get_permissions(agent, target) == {'read', 'write'}
+        assert manager.get_permissions(agent, other) == {'read'}
+
+        count = manager.remove_permissions([
+            (agent, target, 'write'),
+            (agent, other, 'read'),
+            (agent, other, 'write'),
+        ])
+
+        assert count == 2
+        assert manager.get_permissions(agent, target) == {'read'}
+        assert manager.get_permissions(agent, other) == set()
+
+    def test_add_remove_many_cache(self):
+        manager, agent = self.manager, self.agent
+        manager.cache = cache.PermissionCache()
+        target = self.create_target()
+        manager.add_permission(agent, target, 'read')
+
+        assert manager.get_permissions(agent, target) == {'read'}
+        manager.add_permissions([(agent, target, 'write')])
+        assert manager.get_permissions(agent, target) == {'read', 'write'}
+        manager.remove_permissions([(agent, target, 'read')])
+        assert manager.get_permissions(agent, target) == {'write'}
+
+    def test_filter_targets(self):
+        manager, agent, target = self.manager, self.agent, self.target
+        other, _ = self.create_target(), self.create_target()
+        manager.add_permission(agent, target, 'read')
+        manager.add_permission(agent, target, 'write')
+        manager.add_permission(agent, other, 'read')
+
+        query = manager.filter_targets(agent, type(target), 'read')
+        assert set(query) == {target, other}
+        query = manager.filter_targets(agent, type(target), 'write')
+        assert set(query) == {target}
+        query = manager.filter_targets(agent, type(target), 'delete')
+        assert set(query) == set()
+
+    @pytest.mark.parametrize('batch_size', [1, 1000])
+    def test_agents_with_permission(self, batch_size):
+        manager, agent, target = self.manager, self.agent, self.target
+        manager.batch_size = batch_size
+        other, _ = self.create_agent(), self.create_agent()
+        manager.add_permission(agent, target, 'read')
+        manager.add_permission(agent, target, 'write')
+        manager.add_permission(other, target, 'read')
+
+        agents = manager.agents_with_permission(target, 'read', type(agent))
+        assert sorted(agents, key=self.manager._get_id) == sorted(
+            [agent, other], key=self.manager._get_id,
+        )
+        agents = manager.agents_with_permission(target, 'write', type(agent))
+        assert list(agents) == [agent]
+
+    def test_load_with_permission(self):
+        manager, agent = self.manager, self.agent
+        target, other = self.create_target(), self.create_target()
+        loader = self.create_loader(type(target))
+        manager.add_permission(agent, target, 'read')
+
+        def load(permissions, **kwargs):
+            return loader.load_with_permission(agent, permissions, manager.registry, **kwargs)
+
+        assert load(['read'], id=target.id) == (target, True)
+        assert load(['write'], id=target.id) == (target, False)
+        assert load(['write', 'read'], id=target.id) == (target, True)
+        assert load(['read'], id=other.id) == (other, False)
+        assert load(['read'], id=other.id + 1) == (None, False)
+
+    @pytest.mark.parametrize('cached', [False, True])
+    def test_implied_permissions(self, cached):
+        manager, agent, target = self.manager, self.agent, self.target
+        manager.registry = copy.copy(manager.registry)
+        manager.registry.imply('admin', 'write')
+        manager.registry.imply('write', 'read')
+        if cached:
+            manager.cache = cache.PermissionCache()
+        other, empty = self.create_target(), self.create_target()
+        loader = self.create_loader(type(target))
+        manager.add_permission(agent, target, 'admin')
+        manager.add_permission(agent, other, 'read')
+
+        assert manager.has_permission(agent, target, 'read')
+        assert manager.has_permission(agent, target, 'write')
+        assert not manager.has_permission(agent, other, 'write')
+        assert manager.has_any_permission(agent, other, ['write', 'read'])
+        assert manager.has_all_permissions(agent, target, ['read', 'write', 'admin'])
+        assert not manager.has_all_permissions(agent, other, ['read', 'write'])
+        assert manager.get_permissions(agent, target) == {'read', 'write', 'admin'}
+        assert manager.get_permissions_many(agent, [target, other, empty]) == {
+            target: {'read', 'write', 'admin'},
+            other: {'read'},
+            empty: set(),
+        }
+        assert manager.has_permission_many(agent, [target, other, empty], 'read') == {
+            target: True,
+            other: True,
+            empty: False,
+        }
+        assert set(manager.filter_targets(agent, type(target), 'read')) == {target, other}
+        assert set(manager.filter_targets(agent, type(target), 'write')) == {target}
+        assert list(manager.agents_with_permission(target, 'read', type(agent))) == [agent]
+        assert loader.load_with_permission(
+            agent, ['write'], manager.registry, id=target.id,
+        ) == (target, True)
+        assert loader.load_with_permission(
+            agent, ['write'], manager.registry, id=other.id,
+        ) == (other, False)
+
+    @pytest.mark.parametrize('cached', [False, True])
+    def test_groups(self, cached):
+        manager, agent, target, group = self.manager, self.agent, self.target, self.group
+        if cached:
+            manager.cache = cache.PermissionCache()
+        other, second = self.create_target(), self.create_group()
+        manager.add_permission(group, target, 'write')
+        manager.add_permission(second, target, 'write')
+        manager.add_permission(agent, target, 'read')
+
+        assert manager.get_permissions(agent, target) == {'read'}
+
+        manager.add_member(agent, group)
+        manager.add_member(agent, second)
+
+        assert sorted(manager.get_groups(agent), key=manager._get_id) == sorted(
+            [group, second], key=manager._get_id,
+        )
+        assert manager.get_permissions(agent, target) == {'read', 'write'}
+        assert manager.has_permission(agent, target, 'write')
+        assert set(manager.filter_targets(agent, type(target), 'write')) == {target}
+
+        manager.add_permissions([(group, other, 'read'), (group, other, 'admin')])
+
+        assert manager.get_permissions_many(agent, [target, other]) == {
+            target: {'read', 'write'},
+            other: {'read', 'admin'},
+        }
+
+        manager.remove_permission(group, target, 'write')
+
+        assert manager.has_permission(agent, target, 'write')
+
+        manager.remove_member(agent, second)
+
+        assert not manager.has_permission(agent, target, 'write')
+        assert manager.get_permissions(agent, target) == {'read'}
+
+        manager.remove_permissions([(group, other, 'admin')])
+        manager.remove_permission(agent, target, 'read')
+
+        assert manager.get_permissions(agent, other) == {'read'}
+        assert manager.get_permissions(agent, target) == set()
+
+        manager.remove_member(agent, group)
+
+        assert manager.get_permissions(agent, other) == set()
+        assert manager.get_groups(agent) == []
+
+        with pytest.raises(exceptions.MembershipNotFound):
+            manager.remove_member(agent, group)
+        manager.add_member(agent, group)
+        with pytest.raises(exceptions.MembershipExists):
+            manager.add_member(agent, group)
+
+    def test_refresh_permissions(self):
+        manager, agent, target, group = self.manager, self.agent, self.target, self.group
+        manager.add_member(agent, group)
+        manager.add_permission(group, target, 'read')
+        manager.add_permission(agent, target, 'write')
+        manager.remove_permission(agent, target, 'write')
+        # Simulate changes made outside the manager
+        effective = manager.registry.get_effective_permission(type(agent), type(target))
+        manager._remove_rows([(agent, target, 'read')], effective)
+
+        assert manager.get_permissions(agent, target) == set()
+
+        manager.refresh_permissions(agent)
+
+        assert manager.get_permissions(agent, target) == {'read'}
+
+    def test_signals(self):
+        manager, agent, target = self.manager, self.agent, self.target
+        schema = manager.registry.get_permission(type(agent), type(target))
+        events = []
+        signals.add_permission.connect(events.append)
+        signals.has_permission.connect(events.append)
+        try:
+            manager.add_permission(agent, target, 'read')
+            assert manager.has_permission(agent, target, 'read')
+            with pytest.raises(exceptions.PermissionExists):
+                manager.add_permission(agent, target, 'read')
+        finally:
+            signals.add_permission.disconnect(events.append)
+            signals.has_permission.disconnect(events.append)
+
+        assert [event.name for event in events] == [
+            'add_permission', 'has_permission', 'add_permission',
+        ]
+        added, checked, failed = events
+        assert added.sender is manager
+        assert added.schema is schema
+        assert added.arguments == {'agent': agent, 'target': target, 'permission': 'read'}
+        assert checked.result is True
+        assert checked.error is None
+        assert isinstance(failed.error, exceptions.PermissionExists)
+        for event in events:
+            assert event.duration >= 0
+            assert event.queries is None or event.queries >= 0
+
+    def test_memory_snapshot(self):
+        manager, agent, target, group = self.manager, self.agent, self.target, self.group
+        other = self.create_target()
+        manager.add_member(agent, group)
+        manager.add_permission(agent, target, 'read')
+        manager.add_permission(agent, target, 'write')
+        manager.add_permission(group, other, 'read')
+        manager.batch_size = 1
+
+        memory = MemoryPermissionManager(manager)
+
+        assert memory.load() == 7
+        assert memory.get_permissions(agent, target) == {'read', 'write'}
+        assert memory.has_permission(agent, other, 'read')
+        assert not memory.has_permission(group, target, 'read')
+        effective = manager.registry.get_effective_permission(type(agent), type(target))
+        assert set(memory._by_target[effective][other.id]) == {agent.id}
+
+    def test_index(self, tmpdir):
+        manager, agent, target = self.manager, self.agent, self.target
+        other = self.create_target()
+        path = str(tmpdir.join('permissions.idx'))
+        manager.add_permission(agent, target, 'read')
+        manager.add_permission(agent, target, 'write')
+
+        assert index.write_index(manager, path) == 4
+        reader = index.IndexPermissionManager(manager, path, check_interval=None)
+
+        assert reader.get_permissions(agent, target) == {'read', 'write'}
+        assert reader.has_permission(agent, target, 'read')
+        assert not reader.has_permission(agent, other, 'read')
+
+        # Writes reach the backing manager, and are read once published
+        reader.add_permission(agent, other, 'read')
+        assert manager.has_permission(agent, other, 'read')
+        assert not reader.has_permission(agent, other, 'read')
+        assert not reader.load()
+        index.write_index(manager, path)
+        assert reader.load()
+        assert reader.has_permission(agent, other, 'read')
+
+    def test_cache(self):
+        manager, agent, target = self.manager, self.agent, self.target
+        manager.cache = cache.PermissionCache()
+
+        manager.add_permission(agent, target, 'read')
+
+        assert manager.has_permission(agent, target, 'read')
+        assert not manager.has_permission(agent, target, 'write')
+        assert manager.get_permissions(agent, target) == {'read'}
+        assert (manager.cache.hits, manager.cache.misses) == (2, 1)
+
+        manager.add_permission(agent, target, 'write')
+
+        assert manager.has_permission(agent, target, 'write')
+        assert (manager.cache.hits, manager.cache.misses) == (2, 2)
+
+        manager.remove_permission(agent, target, 'read')
+
+        assert manager.get_permissions(agent, target) == {'write'}
+        assert (manager.cache.hits, manager.cache.misses) == (2, 3)
+
+    def test_negative_cache(self):
+        manager, agent, target, group = self.manager, self.agent, self.target, self.group
+        manager.registry = copy.copy(manager.registry)
+        manager.registry.imply('write', 'read')
+        other, third = self.create_target(), self.create_target()
+        manager.add_permission(agent, target, 'read')
+        manager.negative_cache = cache.NegativeCache()
+
+        # Filters are built from existing rows on first check
+        assert manager.has_permission(agent, target, 'read')
+        assert not manager.has_permission(agent, other, 'read')
+        assert not manager.has_any_permission(agent, other, ['read', 'write'])
+        assert manager.negative_cache.hits >= 2
+
+        # Grants through the manager are added before they are written
+        manager.add_permission(agent, other, 'write')
+        manager.ensure_permission(agent, third, 'read')
+        manager.add_member(agent, group)
+        manager.add_permissions([(group, third, 'admin')])
+
+        assert manager.has_permission(agent, other, 'read')
+        assert manager.has_permission(agent, third, 'read')
+        assert manager.has_permission(agent, third, 'admin')
+        assert not manager.has_permission(agent, other, 'admin')
+
+        # Revoked permissions remain in filters, but are still checked
+        manager.remove_permission(agent, other, 'write')
+        assert not manager.has_permission(agent, other, 'write')
+        manager.negative_cache.rebuild(manager)
+        assert not manager.has_permission(agent, other, 'write')
+
+        schema = manager._get_permission_schema(agent, target, effective=True)
+        stats = manager.negative_cache.get_stats(schema)
+        assert stats['count'] >= 3
+        assert 0 <= stats['false_positive_rate'] < manager.negative_cache.error_rate
+        assert stats['memory'] > 0
+        assert stats['build_time'] >= 0
+
+    def test_shared_cache(self, tmpdir):
+        agent, target = self.agent, self.target
+        path = str(tmpdir.join('cache.db'))
+        reader, writer = self.manager, copy.copy(self.manager)
+        reader.cache = cache.VersionedPermissionCache(cache.SqliteStore(path))
+        writer.cache = cache.VersionedPermissionCache(cache.SqliteStore(path))
+
+        assert not reader.has_permission(agent, target, 'read')
+        writer.add_permission(agent, target, 'read')
+        assert reader.has_permission(agent, target, 'read')
+        assert writer.has_permission(agent, target, 'read')
+        assert (writer.cache.hits, writer.cache.misses) == (1, 0)
+
     def test_agent_delete_cascade(self):
         manager, agent, target = self.manager, self.agent, self.target
         Permission = manager.registry.get_permission(agent.__class__, target.__class__)
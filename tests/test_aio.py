@@ -0,0 +1,154 @@
+# -*- coding: utf-8 -*-
+
+import asyncio
+import threading
+
+import mock
+import pytest
+
+from guardrail.core import aio
+from guardrail.core import signals
+from guardrail.core import decorators
+
+
+class ErrorHandlerException(Exception):
+    pass
+
+
+def run(coroutine):
+    loop = asyncio.new_event_loop()
+    try:
+        return loop.run_until_complete(coroutine)
+    finally:
+        loop.close()
+
+
+@pytest.fixture
+def manager():
+    return aio.AsyncPermissionManager(mock.Mock(), max_workers=1)
+
+
+@pytest.fixture
+def error_handler():
+    def side_effect(code):
+        raise ErrorHandlerException(code)
+    return mock.Mock(side_effect=side_effect)
+
+
+def test_manager_offloads_to_executor(manager):
+    threads = []
+    def has_permission(*args, **kwargs):
+        threads.append(threading.current_thread())
+        return True
+    manager.manager.has_permission.side_effect = has_permission
+    assert run(manager.has_permission('agent', 'target', 'read'))
+    manager.manager.has_permission.assert_called_with('agent', 'target', 'read')
+    assert threads[0] is not threading.current_thread()
+
+
+@pytest.mark.parametrize('allowed', [True, False])
+def test_has_permission(manager, error_handler, allowed):
+    async def agent_loader(**kwargs):
+        return 'agent'
+    def target_loader(**kwargs):
+        return 'target'
+    manager.manager.has_permission.return_value = allowed
+    decorator = aio.has_permission(
+        'read', manager, agent_loader, target_loader, error_handler,
+    )
+    @decorator
+    async def protected(agent=None, target=None, **kwargs):
+        return agent, target, kwargs
+    if allowed:
+        assert run(protected(id=1)) == ('agent', 'target', {'id': 1})
+    else:
+        with pytest.raises(ErrorHandlerException):
+            run(protected(id=1))
+        error_handler.assert_called_with(decorators.FORBIDDEN)
+
+
+def test_has_permission_target_not_found(manager, error_handler):
+    async def target_loader(**kwargs):
+        return None
+    decorator = aio.has_permission(
+        'read', manager, lambda **kwargs: 'agent', target_loader, error_handler,
+    )
+    @decorator
+    async def protected(**kwargs):
+        pass
+    with pytest.raises(ErrorHandlerException):
+        run(protected())
+    error_handler.assert_called_with(decorators.TARGET_NOT_FOUND)
+    assert not manager.manager.has_permission.called
+
+
+def test_has_permission_load_signal(manager, error_handler):
+    async def agent_loader(**kwargs):
+        return 'agent'
+    def target_loader(**kwargs):
+        raise LookupError()
+    decorator = aio.has_permission(
+        'read', manager, agent_loader, target_loader, error_handler,
+    )
+    @decorator
+    async def protected(**kwargs):
+        pass
+    events = []
+    signals.load.connect(events.append)
+    try:
+        with pytest.raises(LookupError):
+            run(protected(id=1))
+    finally:
+        signals.load.disconnect(events.append)
+    assert [event.sender for event in events] == [agent_loader, target_loader]
+    assert [event.result for event in events] == ['agent', None]
+    assert isinstance(events[1].error, LookupError)
+    assert all(event.arguments == {'args': (), 'kwargs': {'id': 1}} for event in events)
+    assert all(event.queries is None for event in events)
+
+
+def test_sqlalchemy_manager():
+    pytest.importorskip('sqlalchemy.ext.asyncio')
+    pytest.importorskip('aiosqlite')
+
+    import sqlalchemy as sa
+    from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+    from sqlalchemy.ext.declarative import declarative_base
+
+    from guardrail.core.registry import _Registry
+    from guardrail.ext.sqlalchemy import SqlalchemyPermissionSchemaFactory
+    from guardrail.ext.sqlalchemy_aio import AsyncSqlalchemyPermissionManager
+
+    registry = _Registry()
+    Base = declarative_base()
+
+    @registry.agent
+    class Agent(Base):
+        __tablename__ = 'agent'
+        id = sa.Column(sa.Integer, primary_key=True)
+
+    @registry.target
+    class Target(Base):
+        __tablename__ = 'target'
+        id = sa.Column(sa.Integer, primary_key=True)
+
+    registry.make_schemas(SqlalchemyPermissionSchemaFactory((Base, )))
+
+    async def scenario():
+        engine = create_async_engine('sqlite+aiosqlite://')
+        async with engine.begin() as connection:
+            await connection.run_sync(Base.metadata.create_all)
+        async with AsyncSession(engine) as session:
+            agent, target = Agent(), Target()
+            session.add_all([agent, target])
+            await session.flush()
+            manager = AsyncSqlalchemyPermissionManager(session, registry=registry)
+            assert not await manager.has_permission(agent, target, 'read')
+            await manager.add_permission(agent, target, 'read')
+            assert await manager.has_permission(agent, target, 'read')
+            assert await manager.get_permissions(agent, target) == {'read'}
+            await manager.remove_permission(agent, target, 'read')
+            assert not await manager.has_permission(agent, target, 'read')
+        await engine.dispose()
+
+    run(scenario())
@@ -0,0 +1,181 @@
+# -*- coding: utf-8 -*-
+
+import threading
+
+import pytest
+
+from guardrail.core import cache
+
+
+class Schema(object):
+    pass
+
+
+@pytest.fixture
+def key():
+    return (Schema, 1, 2)
+
+
+def test_permission_cache(key):
+    permission_cache = cache.PermissionCache()
+    assert permission_cache.get(key) is None
+    permission_cache.set(key, frozenset(['read']))
+    assert permission_cache.get(key) == {'read'}
+    assert (permission_cache.hits, permission_cache.misses) == (1, 1)
+    permission_cache.invalidate(key)
+    assert permission_cache.get(key) is None
+
+
+def test_memory_store_lru():
+    store = cache.MemoryStore(max_size=2)
+    store.set('a', 1)
+    store.set('b', 2)
+    store.get('a')
+    store.set('c', 3)
+    assert store.get('a') == 1
+    assert store.get('b') is None
+    assert store.get('c') == 3
+
+
+def test_memory_store_timeout():
+    store = cache.MemoryStore(timeout=-1)
+    store.set('a', 1)
+    assert store.get('a') is None
+
+
+def test_sqlite_store(tmpdir):
+    store = cache.SqliteStore(str(tmpdir.join('cache.db')), max_size=2, prune_interval=1)
+    store.set('a', [0, ['read']])
+    store.set('b', [0, ['write']])
+    store.set('c', [0, []])
+    assert store.get('a') is None
+    assert store.get('c') == [0, []]
+    version = store.get_version('a')
+    assert store.get_version('a') == version
+    assert store.incr_version('a') == version + 1
+    assert store.get_version('a') == version + 1
+
+
+@pytest.mark.parametrize('make_store', [
+    lambda tmpdir, **kwargs: cache.MemoryStore(**kwargs),
+    lambda tmpdir, **kwargs: cache.SqliteStore(
+        str(tmpdir.join('cache.db')), prune_interval=1, **kwargs
+    ),
+])
+def test_store_evicts_versions(tmpdir, make_store):
+    store = make_store(tmpdir, max_size=2)
+    version = store.incr_version('a')
+    store.incr_version('b')
+    store.incr_version('c')
+    # Recreated counters never return to values entries may be tagged with
+    assert store.get_version('a') not in (version, 0)
+
+    store = make_store(tmpdir.mkdir('timeout'), timeout=-1)
+    version = store.incr_version('a')
+    assert store.get_version('a') != version
+
+
+@pytest.mark.parametrize('local', [None, cache.MemoryStore()])
+def test_versioned_cache_shared(tmpdir, key, local):
+    path = str(tmpdir.join('cache.db'))
+    reader = cache.VersionedPermissionCache(cache.SqliteStore(path), local=local)
+    writer = cache.VersionedPermissionCache(cache.SqliteStore(path))
+
+    assert reader.get(key) is None
+    reader.set(key, frozenset(['read']))
+    assert reader.get(key) == {'read'}
+    assert writer.get(key) == {'read'}
+
+    writer.invalidate(key)
+
+    assert reader.get(key) is None
+    assert writer.get(key) is None
+    assert (reader.hits, reader.misses) == (1, 2)
+
+
+def test_versioned_cache_keys_on_table_name():
+    first = type('Permission', (object, ), {'permission_table': 'first_permission'})
+    second = type('Permission', (object, ), {'permission_table': 'second_permission'})
+    versioned_cache = cache.VersionedPermissionCache(cache.MemoryStore())
+    assert versioned_cache.get((first, 1, 2)) is None
+    versioned_cache.set((first, 1, 2), frozenset(['read']))
+    assert versioned_cache.get((second, 1, 2)) is None
+    versioned_cache.invalidate((second, 1, 2))
+    assert versioned_cache.get((first, 1, 2)) == {'read'}
+
+
+def test_versioned_cache_ignores_stale_set(key):
+    versioned_cache = cache.VersionedPermissionCache(cache.MemoryStore())
+    assert versioned_cache.get(key) is None
+    versioned_cache.store.incr_version(versioned_cache._make_key(key))
+    versioned_cache.set(key, frozenset(['read']))
+    assert versioned_cache.get(key) is None
+
+
+def test_versioned_cache_bounds_pending():
+    versioned_cache = cache.VersionedPermissionCache(cache.MemoryStore(), max_pending=2)
+    for target_id in range(5):
+        assert versioned_cache.get((Schema, 1, target_id)) is None
+    assert list(versioned_cache._pending) == [(Schema, 1, 3), (Schema, 1, 4)]
+    versioned_cache.set((Schema, 1, 4), frozenset(['read']))
+    assert list(versioned_cache._pending) == [(Schema, 1, 3)]
+
+
+def test_versioned_cache_pending_per_thread(key):
+    versioned_cache = cache.VersionedPermissionCache(cache.MemoryStore())
+    assert versioned_cache.get(key) is None
+    thread = threading.Thread(target=versioned_cache.get, args=(key, ))
+    thread.start()
+    thread.join()
+    assert list(versioned_cache._pending) == [key]
+
+
+def test_bloom_filter():
+    bloom = cache.BloomFilter(1000, error_rate=0.01)
+    for value in range(1000):
+        bloom.add((1, value, 'read'))
+    assert all((1, value, 'read') in bloom for value in range(1000))
+    false_positives = sum((2, value, 'read') in bloom for value in range(10000))
+    assert false_positives < 300
+    assert bloom.false_positive_rate < 0.02
+    assert bloom.memory == len(bloom.bits)
+
+
+class Manager(object):
+
+    def __init__(self, rows):
+        self.rows = rows
+
+    def _iter_permissions(self, schema):
+        return iter(self.rows)
+
+
+def test_negative_cache():
+    manager = Manager([(1, 2, 'read')])
+    negative_cache = cache.NegativeCache()
+    assert negative_cache.get_stats(Schema) is None
+
+    assert negative_cache.may_contain(manager, Schema, 1, 2, {'read'})
+    assert not negative_cache.may_contain(manager, Schema, 1, 2, {'write'})
+    assert not negative_cache.may_contain(manager, Schema, 1, 3, {'read', 'write'})
+    assert (negative_cache.hits, negative_cache.misses) == (2, 1)
+
+    negative_cache.add(Schema, [(1, 3, 'write')])
+    assert negative_cache.may_contain(manager, Schema, 1, 3, {'read', 'write'})
+
+    stats = negative_cache.get_stats(Schema)
+    assert (stats['capacity'], stats['count']) == (1024, 2)
+    assert stats['memory'] == negative_cache.memory
+    negative_cache.clear()
+    assert negative_cache.filters == {}
+
+
+def test_negative_cache_keeps_recent_grants():
+    manager = Manager([])
+    negative_cache = cache.NegativeCache()
+    # Recorded before the filter exists, e.g. in a transaction that has not
+    # committed when the table is read
+    negative_cache.add(Schema, [(1, 2, 'read')])
+    assert negative_cache.may_contain(manager, Schema, 1, 2, {'read'})
+    negative_cache.rebuild(manager)
+    assert negative_cache.may_contain(manager, Schema, 1, 2, {'read'})
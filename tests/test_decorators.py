@@ -3,6 +3,7 @@
 import mock
 import pytest
 
+from guardrail.core import signals
 from guardrail.core import decorators
 
 
@@ -83,9 +84,113 @@ def test_has_permission_target_not_found(manager, agent_loader, target_loader,
     error_handler.assert_called_with(decorators.TARGET_NOT_FOUND)
 
 
+@pytest.mark.parametrize(['require', 'method'], [
+    (decorators.ALL, 'has_all_permissions'),
+    (decorators.ANY, 'has_any_permission'),
+])
+def test_has_permission_many(manager, agent_loader, target_loader,
+                             error_handler, require, method):
+    decorator = decorators.has_permission(
+        {'read', 'write'},
+        manager,
+        agent_loader,
+        target_loader,
+        error_handler,
+        require=require,
+    )
+    protected = decorator(lambda agent=None, target=None: (agent, target))
+    getattr(manager, method).return_value = True
+    assert protected() == (agent_loader.return_value, target_loader.return_value)
+    getattr(manager, method).assert_called_with(
+        agent_loader.return_value,
+        target_loader.return_value,
+        {'read', 'write'},
+    )
+    assert not manager.has_permission.called
+    assert not error_handler.called
+
+
+def test_has_permission_invalid_require(manager, agent_loader, target_loader,
+                                        error_handler):
+    with pytest.raises(ValueError):
+        decorators.has_permission(
+            'code', manager, agent_loader, target_loader, error_handler,
+            require='some',
+        )
+
+
+@pytest.mark.parametrize(['allowed', 'calls'], [(True, 0), (False, 1)])
+def test_has_permission_fused(manager, agent_loader, target_loader,
+                              error_handler, allowed, calls):
+    error_handler.side_effect = None
+    target_loader.load_with_permission.return_value = (mock.sentinel.target, allowed)
+    decorator = decorators.has_permission(
+        'code',
+        manager,
+        agent_loader,
+        target_loader,
+        error_handler,
+        fused=True,
+    )
+    protected = decorator(lambda agent=None, target=None, **kwargs: (agent, target))
+    assert protected(id=1) == (agent_loader.return_value, mock.sentinel.target)
+    target_loader.load_with_permission.assert_called_with(
+        agent_loader.return_value, ['code'], manager.registry, id=1,
+    )
+    assert not target_loader.called
+    assert not manager.has_permission.called
+    assert error_handler.call_count == calls
+
+
+def test_has_permission_fused_target_not_found(manager, agent_loader, target_loader,
+                                               error_handler):
+    target_loader.load_with_permission.return_value = (None, False)
+    decorator = decorators.has_permission(
+        'code',
+        manager,
+        agent_loader,
+        target_loader,
+        error_handler,
+        fused=True,
+    )
+    protected = decorator(lambda agent=None, target=None: (agent, target))
+    with pytest.raises(ErrorHandlerException):
+        protected()
+    error_handler.assert_called_with(decorators.TARGET_NOT_FOUND)
+
+
+def test_has_permission_fused_requires_any(manager, agent_loader, target_loader,
+                                           error_handler):
+    with pytest.raises(ValueError):
+        decorators.has_permission(
+            {'read', 'write'}, manager, agent_loader, target_loader, error_handler,
+            fused=True,
+        )
+
+
 def test_has_permission_false(manager, agent_loader, target_loader,
                               error_handler, protected):
     manager.has_permission.return_value = False
     with pytest.raises(ErrorHandlerException):
         agent, target, kwargs = protected()
     error_handler.assert_called_with(decorators.FORBIDDEN)
+
+
+def test_has_permission_load_signal(manager, agent_loader, target_loader,
+                                    error_handler, protected):
+    manager.has_permission.return_value = True
+    manager._count_queries.return_value = mock.MagicMock()
+    manager._count_queries.return_value.__enter__.return_value = lambda: 1
+    events = []
+    signals.load.connect(events.append)
+    try:
+        protected(id=1)
+    finally:
+        signals.load.disconnect(events.append)
+    assert [event.sender for event in events] == [agent_loader, target_loader]
+    assert [event.result for event in events] == [
+        agent_loader.return_value,
+        target_loader.return_value,
+    ]
+    assert all(event.arguments == {'args': (), 'kwargs': {'id': 1}} for event in events)
+    assert all(event.queries == 1 for event in events)
@@ -5,6 +5,7 @@ from django import db
 from guardrail.ext.django.models import DjangoPermissionSchemaFactory
 
 from .registry import registry
+from .registry import compact_registry
 
 
 @registry.agent
@@ -17,5 +18,34 @@ class Target(db.models.Model):
     pass
 
 
+@registry.agent
+class Team(db.models.Model):
+    pass
+
+
+registry.group(Agent, Team)
 factory = DjangoPermissionSchemaFactory((db.models.Model, ))
 registry.make_schemas(factory)
+
+
+@compact_registry.agent
+class CompactAgent(db.models.Model):
+    pass
+
+
+@compact_registry.target
+class CompactTarget(db.models.Model):
+    pass
+
+
+@compact_registry.agent
+class CompactTeam(db.models.Model):
+    pass
+
+
+compact_registry.group(CompactAgent, CompactTeam)
+factory = DjangoPermissionSchemaFactory(
+    (db.models.Model, ),
+    permissions=['read', 'write', 'admin'],
+)
+compact_registry.make_schemas(factory)
@@ -4,3 +4,4 @@ from guardrail.core.registry import _Registry
 
 
 registry = _Registry()
+compact_registry = _Registry()
@@ -8,11 +8,16 @@ from tests.utils import patch
 from tests.loaders import LoaderMixin
 from tests.integration import PermissionManagerMixin
 
+from guardrail.core import exceptions
 from guardrail.ext.django.models import DjangoLoader
 from guardrail.ext.django.models import DjangoPermissionManager
+from guardrail.ext.django.models import annotate_permissions
+from guardrail.ext.django.models import prefetch_permissions
+from guardrail.ext.django.backends import ObjectPermissionBackend
 
 from . import models
 from .registry import registry
+from .registry import compact_registry
 
 
 @pytest.fixture
@@ -21,13 +26,23 @@ def integration(request):
         request.cls,
         agent=models.Agent.objects.create(),
         target=models.Target.objects.create(),
+        group=models.Team.objects.create(),
         manager=DjangoPermissionManager(registry=registry),
     )
 
 
-@pytest.mark.django_db
-@pytest.mark.usefixtures('integration')
-class TestDjangoPermissionManager(PermissionManagerMixin):
+@pytest.fixture
+def compact_integration(request):
+    patch(
+        request.cls,
+        agent=models.CompactAgent.objects.create(),
+        target=models.CompactTarget.objects.create(),
+        group=models.CompactTeam.objects.create(),
+        manager=DjangoPermissionManager(registry=compact_registry),
+    )
+
+
+class DjangoPermissionManagerMixin(PermissionManagerMixin):
 
     def delete(self, record):
         record.delete()
@@ -35,6 +50,62 @@ class TestDjangoPermissionManager(PermissionManagerMixin):
     def count(self, schema):
         return schema.objects.count()
 
+    def create_loader(self, schema):
+        return DjangoLoader(schema)
+
+    def create_agent(self):
+        return type(self.agent).objects.create()
+
+    def create_target(self):
+        return type(self.target).objects.create()
+
+    def create_group(self):
+        return type(self.group).objects.create()
+
+
+@pytest.mark.django_db
+@pytest.mark.usefixtures('integration')
+class TestDjangoPermissionManager(DjangoPermissionManagerMixin):
+
+    def test_remove_permission_single_query(self, django_assert_num_queries):
+        self.manager.add_permission(self.group, self.target, 'read')
+        # Delete, then look up members of the group to update
+        with django_assert_num_queries(2):
+            self.manager.remove_permission(self.group, self.target, 'read')
+        with django_assert_num_queries(1):
+            with pytest.raises(exceptions.PermissionNotFound):
+                self.manager.remove_permission(self.group, self.target, 'read')
+
+
+@pytest.mark.django_db
+@pytest.mark.usefixtures('compact_integration')
+class TestDjangoCompactPermissionManager(DjangoPermissionManagerMixin):
+
+    def test_compact_storage(self):
+        manager, agent, target = self.manager, self.agent, self.target
+        Permission = compact_registry.get_permission(models.CompactAgent, models.CompactTarget)
+        manager.add_permission(agent, target, 'read')
+        manager.add_permission(agent, target, 'admin')
+
+        assert list(Permission.objects.values_list('mask', flat=True)) == [0b101]
+
+    def test_annotate_permissions(self):
+        manager, agent, target = self.manager, self.agent, self.target
+        manager.add_permission(agent, target, 'write')
+        query = annotate_permissions(
+            models.CompactTarget.objects.all(), agent, ['read', 'write'],
+            registry=compact_registry,
+        )
+        assert [(each.can_read, each.can_write) for each in query] == [(False, True)]
+
+    def test_backend(self):
+        manager, agent, target = self.manager, self.agent, self.target
+        manager.add_permission(agent, target, 'write')
+        backend = Backend()
+        backend.registry = compact_registry
+
+        assert backend.get_all_permissions(agent, target) == {'write'}
+
 
 @pytest.fixture
 def loaders(request):
@@ -53,3 +124,69 @@ def loaders(request):
 @pytest.mark.usefixtures('loaders')
 class TestDjangoLoader(LoaderMixin):
     pass
+
+
+class Backend(ObjectPermissionBackend):
+    registry = registry
+
+
+@pytest.mark.django_db
+@pytest.mark.usefixtures('integration')
+class TestObjectPermissionBackend(object):
+
+    def test_has_perm(self, django_assert_num_queries):
+        manager, agent, target = self.manager, self.agent, self.target
+        other = models.Target.objects.create()
+        manager.add_permission(agent, target, 'read')
+        manager.add_permission(agent, other, 'write')
+        backend = Backend()
+
+        with django_assert_num_queries(1):
+            assert backend.has_perm(agent, 'read', target)
+            assert not backend.has_perm(agent, 'write', target)
+            assert backend.has_perm(agent, 'write', other)
+            assert not backend.has_perm(agent, 'read')
+
+    def test_get_all_permissions(self):
+        manager, agent, target = self.manager, self.agent, self.target
+        other = models.Target.objects.create()
+        manager.add_permission(agent, target, 'read')
+        manager.add_permission(agent, other, 'write')
+        backend = Backend()
+
+        assert backend.get_all_permissions(agent, target) == {'read'}
+        assert backend.get_all_permissions(agent) == {'read', 'write'}
+
+
+@pytest.mark.django_db
+@pytest.mark.usefixtures('integration')
+class TestQuerysetPermissions(object):
+
+    def test_annotate_permissions(self, django_assert_num_queries):
+        manager, agent, target = self.manager, self.agent, self.target
+        other = models.Target.objects.create()
+        manager.add_permission(agent, target, 'read')
+        manager.add_permission(agent, target, 'write')
+        manager.add_permission(agent, other, 'read')
+        query = annotate_permissions(
+            models.Target.objects.order_by('pk'), agent, ['read', 'write'],
+            registry=registry,
+        )
+        with django_assert_num_queries(1):
+            records = list(query)
+        assert [(each.can_read, each.can_write) for each in records] == [
+            (True, True),
+            (True, False),
+        ]
+
+    def test_prefetch_permissions(self, django_assert_num_queries):
+        manager, agent, target = self.manager, self.agent, self.target
+        other = models.Target.objects.create()
+        manager.add_permission(agent, target, 'read')
+        manager.add_permission(agent, target, 'write')
+        with django_assert_num_queries(2):
+            records = prefetch_permissions(
+                models.Target.objects.order_by('pk'), agent, registry=registry,
+            )
+        assert records == [target, other]
+        assert [each.permissions for each in records] == [{'read', 'write'}, set()]
@@ -0,0 +1,96 @@
+# -*- coding: utf-8 -*-
+
+import pytest
+
+from guardrail.core.registry import _Registry
+from guardrail.ext import index
+from guardrail.ext.memory import MemoryPermissionManager
+
+
+class Record(object):
+    def __init__(self, id):
+        self.id = id
+
+
+class Agent(Record):
+    pass
+
+
+class Target(Record):
+    pass
+
+
+class Schema(object):
+    def __init__(self, agent, target, kind='permission', prefix=''):
+        self.__name__ = '{0}{1}{2}'.format(agent.__name__, target.__name__, kind)
+        self.permission_table = '{0}{1}_{2}_{3}'.format(
+            prefix, agent.__name__, target.__name__, kind,
+        )
+
+
+@pytest.fixture
+def manager():
+    registry = _Registry()
+    registry.agent(Agent)
+    registry.target(Target)
+    registry.make_schemas(Schema)
+    return MemoryPermissionManager(registry=registry)
+
+
+@pytest.fixture
+def path(tmpdir):
+    return str(tmpdir.join('permissions.idx'))
+
+
+def test_round_trip(manager, path):
+    rows = [
+        (Agent(2), Target(-1), u'read'),
+        (Agent(1), Target(2 ** 40), u'write'),
+        (Agent(1), Target(2 ** 40), u'lire'),
+        (Agent(-5), Target(3), u'read'),
+    ]
+    manager.add_permissions(rows)
+    schema = manager.registry.get_permission(Agent, Target)
+
+    assert index.write_index(manager, path) == 4
+    permissions = index.PermissionIndex(path)
+
+    assert len(permissions) == 4
+    assert permissions.get(schema, 1, 2 ** 40) == {u'write', u'lire'}
+    assert permissions.get(schema, 2, -1) == {u'read'}
+    assert permissions.get(schema, -5, 3) == {u'read'}
+    assert permissions.get(schema, 2, 3) == set()
+    assert sorted(permissions.iter_permissions(schema)) == sorted(
+        (agent.id, target.id, permission) for agent, target, permission in rows
+    )
+
+
+def test_same_schema_names(path):
+    schema = Schema(Agent, Target)
+    other = Schema(Agent, Target, prefix='other_')
+    rows = {schema: [(1, 2, u'read')], other: [(1, 2, u'write')]}
+
+    class Exporter(object):
+        @staticmethod
+        def _iter_permissions(schema):
+            return iter(rows[schema])
+
+    assert schema.__name__ == other.__name__
+    assert index.write_index(Exporter, path, schemas=[schema, other]) == 2
+    permissions = index.PermissionIndex(path)
+
+    assert permissions.get(schema, 1, 2) == {u'read'}
+    assert permissions.get(other, 1, 2) == {u'write'}
+
+
+def test_non_integer_keys(manager, path):
+    manager.add_permission(Agent('a'), Target(1), 'read')
+    with pytest.raises(ValueError):
+        index.write_index(manager, path)
+
+
+def test_invalid_file(path):
+    with open(path, 'wb') as fp:
+        fp.write(b'\0' * 64)
+    with pytest.raises(ValueError):
+        index.PermissionIndex(path)
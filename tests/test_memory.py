@@ -0,0 +1,69 @@
+# -*- coding: utf-8 -*-
+
+import pytest
+
+from guardrail.core import exceptions
+from guardrail.core.registry import _Registry
+from guardrail.ext.memory import MemoryPermissionManager
+
+
+class Record(object):
+    def __init__(self, id):
+        self.id = id
+
+
+class Agent(Record):
+    pass
+
+
+class Target(Record):
+    pass
+
+
+@pytest.fixture
+def registry():
+    registry = _Registry()
+    registry.agent(Agent)
+    registry.target(Target)
+    registry.make_schemas(lambda agent, target, kind='permission': (agent, target, kind))
+    return registry
+
+
+@pytest.fixture
+def manager(registry):
+    return MemoryPermissionManager(registry=registry)
+
+
+def test_crud(manager):
+    agent, target, other, missing = Agent(1), Target(1), Target(2), Target(3)
+    schema = manager.registry.get_permission(Agent, Target)
+    manager.add_permission(agent, target, 'read')
+    manager.add_permission(agent, other, 'read')
+
+    assert manager.has_permission(agent, target, 'read')
+    assert manager.get_permissions_many(agent, [target, other, missing]) == {
+        target: {'read'},
+        other: {'read'},
+        missing: set(),
+    }
+    assert manager._by_target[schema] == {1: {1: {'read'}}, 2: {1: {'read'}}}
+    with pytest.raises(exceptions.PermissionExists):
+        manager.add_permissions([(agent, target, 'write'), (agent, target, 'read')])
+    assert not manager.has_permission(agent, target, 'write')
+
+    manager.remove_permission(agent, target, 'read')
+
+    assert not manager.has_permission(agent, target, 'read')
+    assert manager._by_agent[schema] == {1: {2: {'read'}}}
+    assert manager._by_target[schema] == {2: {1: {'read'}}}
+    with pytest.raises(exceptions.PermissionNotFound):
+        manager.remove_permission(agent, target, 'read')
+
+
+def test_requires_backend(manager):
+    with pytest.raises(ValueError):
+        MemoryPermissionManager(write_through=True)
+    with pytest.raises(ValueError):
+        manager.load()
+    with pytest.raises(ValueError):
+        manager.filter_targets(Agent(1), Target, 'read')
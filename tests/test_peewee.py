@@ -16,6 +16,7 @@ from guardrail.ext.peewee import PeeweePermissionSchemaFactory
 
 
 registry = _Registry()
+compact_registry = _Registry()
 
 
 @pytest.fixture(scope='session')
@@ -50,11 +51,57 @@ def Target(Base):
 
 
 @pytest.fixture(scope='session')
-def permissions(db, Base, Agent, Target):
+def Team(Base, Agent):
+    @registry.agent
+    class Team(Base):
+        id = pw.PrimaryKeyField()
+        name = pw.CharField()
+    registry.group(Agent, Team)
+    return Team
+
+
+@pytest.fixture(scope='session')
+def CompactAgent(Base):
+    @compact_registry.agent
+    class CompactAgent(Base):
+        id = pw.PrimaryKeyField()
+        name = pw.CharField()
+    return CompactAgent
+
+
+@pytest.fixture(scope='session')
+def CompactTarget(Base):
+    @compact_registry.target
+    class CompactTarget(Base):
+        id = pw.PrimaryKeyField()
+        name = pw.CharField()
+    return CompactTarget
+
+
+@pytest.fixture(scope='session')
+def CompactTeam(Base, CompactAgent):
+    @compact_registry.agent
+    class CompactTeam(Base):
+        id = pw.PrimaryKeyField()
+        name = pw.CharField()
+    compact_registry.group(CompactAgent, CompactTeam)
+    return CompactTeam
+
+
+@pytest.fixture(scope='session')
+def permissions(db, Base, Agent, Target, Team):
     factory = PeeweePermissionSchemaFactory((Base, ))
     registry.make_schemas(factory)
-    db.create_tables([Agent, Target], safe=True)
-    db.create_tables(registry.permissions, safe=True)
+    db.create_tables([Agent, Target, Team], safe=True)
+    db.create_tables(registry.schemas, safe=True)
+
+
+@pytest.fixture(scope='session')
+def compact_permissions(db, Base, CompactAgent, CompactTarget, CompactTeam):
+    factory = PeeweePermissionSchemaFactory((Base, ), permissions=['read', 'write', 'admin'])
+    compact_registry.make_schemas(factory)
+    db.create_tables([CompactAgent, CompactTarget, CompactTeam], safe=True)
+    db.create_tables(compact_registry.schemas, safe=True)
 
 
 @pytest.yield_fixture
@@ -65,17 +112,29 @@ def transaction(db, Agent, Target, permissions):
 
 
 @pytest.fixture
-def integration(request, Agent, Target, permissions, transaction):
+def integration(request, Agent, Target, Team, permissions, transaction):
     patch(
         request.cls,
         agent=Agent.create(name='agent'),
         target=Target.create(name='target'),
+        group=Team.create(name='group'),
         manager=PeeweePermissionManager(registry=registry),
     )
 
 
-@pytest.mark.usefixtures('integration')
-class TestPeeweePermissionManager(PermissionManagerMixin):
+@pytest.fixture
+def compact_integration(request, CompactAgent, CompactTarget, CompactTeam,
+                        compact_permissions, transaction):
+    patch(
+        request.cls,
+        agent=CompactAgent.create(name='agent'),
+        target=CompactTarget.create(name='target'),
+        group=CompactTeam.create(name='group'),
+        manager=PeeweePermissionManager(registry=compact_registry),
+    )
+
+
+class PeeweePermissionManagerMixin(PermissionManagerMixin):
 
     def delete(self, record):
         record.delete_instance(recursive=True)
@@ -83,6 +142,35 @@ class TestPeeweePermissionManager(PermissionManagerMixin):
     def count(self, schema):
         return schema.select().count()
 
+    def create_loader(self, schema):
+        return PeeweeLoader(schema)
+
+    def create_agent(self):
+        return type(self.agent).create(name='agent')
+
+    def create_target(self):
+        return type(self.target).create(name='target')
+
+    def create_group(self):
+        return type(self.group).create(name='group')
+
+
+@pytest.mark.usefixtures('integration')
+class TestPeeweePermissionManager(PeeweePermissionManagerMixin):
+    pass
+
+
+@pytest.mark.usefixtures('compact_integration')
+class TestPeeweeCompactPermissionManager(PeeweePermissionManagerMixin):
+
+    def test_compact_storage(self):
+        manager, agent, target = self.manager, self.agent, self.target
+        Permission = manager.registry.get_permission(type(agent), type(target))
+        manager.add_permission(agent, target, 'read')
+        manager.add_permission(agent, target, 'admin')
+
+        assert list(Permission.select(Permission.mask).tuples()) == [(0b101, )]
+
 
 @pytest.fixture
 def loaders(request, Agent, transaction):
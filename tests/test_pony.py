@@ -16,6 +16,7 @@ from guardrail.ext.pony import PonyPermissionSchemaFactory
 
 
 registry = _Registry()
+compact_registry = _Registry()
 
 
 @pytest.fixture(scope='session')
@@ -42,9 +43,48 @@ def Target(database):
 
 
 @pytest.fixture(scope='session')
-def permissions(database):
+def Team(database, Agent):
+    @registry.agent
+    class Team(database.Entity):
+        id = pn.PrimaryKey(int, auto=True)
+    registry.group(Agent, Team)
+    return Team
+
+
+@pytest.fixture(scope='session')
+def CompactAgent(database):
+    @compact_registry.agent
+    class CompactAgent(database.Entity):
+        id = pn.PrimaryKey(int, auto=True)
+    return CompactAgent
+
+
+@pytest.fixture(scope='session')
+def CompactTarget(database):
+    @compact_registry.target
+    class CompactTarget(database.Entity):
+        id = pn.PrimaryKey(int, auto=True)
+    return CompactTarget
+
+
+@pytest.fixture(scope='session')
+def CompactTeam(database, CompactAgent):
+    @compact_registry.agent
+    class CompactTeam(database.Entity):
+        id = pn.PrimaryKey(int, auto=True)
+    compact_registry.group(CompactAgent, CompactTeam)
+    return CompactTeam
+
+
+@pytest.fixture(scope='session')
+def permissions(database, Team, CompactAgent, CompactTarget, CompactTeam):
     factory = PonyPermissionSchemaFactory((database.Entity, ))
     registry.make_schemas(factory)
+    factory = PonyPermissionSchemaFactory(
+        (database.Entity, ),
+        permissions=['read', 'write', 'admin'],
+    )
+    compact_registry.make_schemas(factory)
     database.generate_mapping(create_tables=True)
 
 
@@ -56,17 +96,33 @@ def transaction(Agent, Target):
 
 
 @pytest.fixture
-def integration(request, Agent, Target, permissions, transaction):
+def integration(request, Agent, Target, Team, permissions, transaction):
+    agent, target, group = Agent(), Target(), Team()
+    pn.flush()
     patch(
         request.cls,
-        agent=Agent(),
-        target=Target(),
+        agent=agent,
+        target=target,
+        group=group,
         manager=PonyPermissionManager(registry=registry),
     )
 
 
-@pytest.mark.usefixtures('integration')
-class TestPonyPermissionManager(PermissionManagerMixin):
+@pytest.fixture
+def compact_integration(request, CompactAgent, CompactTarget, CompactTeam,
+                        permissions, transaction):
+    agent, target, group = CompactAgent(), CompactTarget(), CompactTeam()
+    pn.flush()
+    patch(
+        request.cls,
+        agent=agent,
+        target=target,
+        group=group,
+        manager=PonyPermissionManager(registry=compact_registry),
+    )
+
+
+class PonyPermissionManagerMixin(PermissionManagerMixin):
 
     def delete(self, record):
         record.delete()
@@ -75,6 +131,67 @@ class TestPonyPermissionManager(PermissionManagerMixin):
     def count(self, schema):
         return pn.count(each for each in schema)
 
+    def create_loader(self, schema):
+        return PonyLoader(schema)
+
+    def create_agent(self):
+        agent = type(self.agent)()
+        pn.flush()
+        return agent
+
+    def create_target(self):
+        target = type(self.target)()
+        pn.flush()
+        return target
+
+    def create_group(self):
+        group = type(self.group)()
+        pn.flush()
+        return group
+
+
+@pytest.mark.usefixtures('integration')
+class TestPonyPermissionManager(PonyPermissionManagerMixin):
+
+    def test_remove_permissions_bulk(self, database):
+        manager, agent = self.manager, self.agent
+        targets = [self.create_target() for _ in range(3)]
+        Permission = manager.registry.get_permission(type(agent), type(self.target))
+        for target in targets:
+            database.insert(Permission, agent=agent.id, target=target.id, permission='read')
+
+        counts = []
+        for chunk in (targets[:1], targets[1:]):
+            with manager._count_queries(Permission) as count:
+                rows = [(agent, target, 'read') for target in chunk]
+                assert manager.remove_permissions(rows) == len(chunk)
+            counts.append(count())
+        assert counts[0] == counts[1]
+        assert manager.get_permissions_many(agent, targets) == {
+            target: set() for target in targets
+        }
+
+    def test_remove_permissions_evicts_cached(self):
+        manager, agent, target = self.manager, self.agent, self.target
+        manager.add_permission(agent, target, 'read')
+
+        assert manager.remove_permissions([(agent, target, 'read')]) == 1
+        assert manager.get_permissions(agent, target) == set()
+        manager.add_permission(agent, target, 'read')
+        assert manager.get_permissions(agent, target) == {'read'}
+
+
+@pytest.mark.usefixtures('compact_integration')
+class TestPonyCompactPermissionManager(PonyPermissionManagerMixin):
+
+    def test_compact_storage(self):
+        manager, agent, target = self.manager, self.agent, self.target
+        Permission = manager.registry.get_permission(type(agent), type(target))
+        manager.add_permission(agent, target, 'read')
+        manager.add_permission(agent, target, 'admin')
+
+        assert pn.select(row.mask for row in Permission)[:] == [0b101]
+
 
 @pytest.fixture
 def loaders(request, Agent, transaction):
@@ -0,0 +1,153 @@
+# -*- coding: utf-8 -*-
+
+import pytest
+
+from guardrail.core import models
+from guardrail.core import exceptions
+from guardrail.core.registry import _Registry
+
+
+class Agent(object):
+    pass
+
+
+class SubAgent(Agent):
+    pass
+
+
+class Target(object):
+    pass
+
+
+class SubTarget(Target):
+    pass
+
+
+@pytest.fixture
+def registry():
+    registry = _Registry()
+    registry.agent(Agent)
+    registry.target(Target)
+    registry.make_schemas(lambda agent, target, kind='permission': (agent, target, kind))
+    return registry
+
+
+def test_get_permission(registry):
+    assert registry.get_permission(Agent, Target) == (Agent, Target, 'permission')
+
+
+def test_get_permission_subclass(registry):
+    assert registry.get_permission(SubAgent, Target) == (Agent, Target, 'permission')
+    assert registry.get_permission(Agent, SubTarget) == (Agent, Target, 'permission')
+    assert registry.get_permission(SubAgent, SubTarget) == (Agent, Target, 'permission')
+
+
+def test_get_permission_not_found(registry):
+    with pytest.raises(exceptions.SchemaNotFound):
+        registry.get_permission(Target, Agent)
+    # Misses are memoized, and still raise
+    with pytest.raises(exceptions.SchemaNotFound):
+        registry.get_permission(Target, Agent)
+
+
+def test_get_permission_invalidate(registry):
+    assert registry.get_permission(SubAgent, Target) == (Agent, Target, 'permission')
+    registry.add_permission(SubAgent, Target, 'sub')
+    assert registry.get_permission(SubAgent, Target) == 'sub'
+    assert registry.get_permission(Agent, Target) == (Agent, Target, 'permission')
+
+
+def test_get_effective_permission(registry):
+    assert registry.get_effective_permission(SubAgent, Target) == (Agent, Target, 'permission')
+    registry.add_effective_permission(Agent, Target, 'effective')
+    assert registry.get_effective_permission(SubAgent, Target) == 'effective'
+
+
+def test_get_agent_permissions(registry):
+    registry.add_permission(SubAgent, Target, 'sub')
+    assert registry.get_agent_permissions(Agent) == {Target: (Agent, Target, 'permission')}
+    assert registry.get_agent_permissions(SubAgent) == {Target: 'sub'}
+
+
+def test_get_groups(registry):
+    registry.group(Agent, Target)
+    assert registry.get_groups(SubAgent) == {Target}
+    assert registry.get_members(SubTarget) == {Agent}
+
+
+class Other(object):
+    pass
+
+
+def make_schema(agent, target, kind='permission'):
+    return (agent, target, kind)
+
+
+def test_link():
+    registry = _Registry()
+    registry.link(Agent, Target)
+    registry.link(Other, Target, Agent)
+    registry.make_schemas(make_schema)
+
+    assert registry.agents == {Agent, Other}
+    assert registry.targets == {Target, Agent}
+    assert set(registry.permissions) == {
+        (Agent, Target, 'permission'),
+        (Other, Target, 'permission'),
+        (Other, Agent, 'permission'),
+    }
+    with pytest.raises(exceptions.SchemaNotFound):
+        registry.get_permission(Agent, Agent)
+
+
+def test_effective_permission_subclass_member():
+    registry = _Registry()
+    registry.link(Agent, Target)
+    registry.link(SubAgent, Target)
+    registry.group(Agent, Other)
+    registry.make_schemas(make_schema)
+
+    assert registry.get_effective_permission(SubAgent, Target) == (
+        SubAgent, Target, 'effective'
+    )
+
+
+def test_lazy():
+    registry = _Registry()
+    registry.link(Agent, Target)
+    registry.link(Other, Target)
+    registry.group(Agent, Other)
+    registry.make_schemas(make_schema, lazy=True)
+
+    assert list(registry.schemas) == []
+    assert registry.get_permission(SubAgent, SubTarget) == (Agent, Target, 'permission')
+    assert registry.get_effective_permission(Agent, Target) == (Agent, Target, 'effective')
+    assert registry.get_membership(Agent, Other) == (Agent, Other, 'membership')
+    assert len(registry.schemas) == 3
+    with pytest.raises(exceptions.SchemaNotFound):
+        registry.get_permission(Target, Agent)
+    assert registry.get_permission(Other, Target) == (Other, Target, 'permission')
+    assert len(registry.schemas) == 4
+
+
+class Factory(models.BasePermissionSchemaFactory):
+
+    def _get_table_name(self, schema):
+        return schema.__name__
+
+    def _make_schema_dict(self, agent, target, kind='permission'):
+        return {}
+
+
+def test_compact_not_supported():
+    registry = _Registry()
+    registry.link(Agent, Target)
+    registry.make_schemas(Factory((object, )))
+    assert registry.get_permission(Agent, Target).permission_table == (
+        'Agent_Target_permission'
+    )
+
+    registry = _Registry()
+    registry.link(Agent, Target)
+    with pytest.raises(exceptions.CompactSchemaNotSupported):
+        registry.make_schemas(Factory((object, ), permissions=['read']))
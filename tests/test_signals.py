@@ -0,0 +1,50 @@
+# -*- coding: utf-8 -*-
+
+import pytest
+
+from guardrail.core import signals
+
+
+class SignalError(Exception):
+    pass
+
+
+@pytest.fixture
+def signal():
+    return signals.Signal('test')
+
+
+def test_connect_disconnect(signal):
+    events = []
+    assert signal.connect(events.append) == events.append
+    signal.send('event')
+    signal.disconnect(events.append)
+    signal.send('event')
+    assert events == ['event']
+    assert signal.receivers == ()
+
+
+def test_call(signal):
+    events = []
+    signal.connect(events.append)
+    assert signal.call(lambda: 42, 'sender', 'schema', {'key': 'value'}) == 42
+    event, = events
+    assert (event.name, event.sender, event.schema) == ('test', 'sender', 'schema')
+    assert event.arguments == {'key': 'value'}
+    assert (event.result, event.error) == (42, None)
+    assert event.duration >= 0
+    assert event.queries is None
+
+
+def test_call_error(signal):
+    events = []
+    signal.connect(events.append)
+
+    def fail():
+        raise SignalError()
+
+    with pytest.raises(SignalError):
+        signal.call(fail, 'sender', 'schema', {})
+    event, = events
+    assert event.result is None
+    assert isinstance(event.error, SignalError)
@@ -11,8 +11,10 @@ from tests.integration import PermissionManagerMixin
 import sqlalchemy as sa
 from sqlalchemy.ext.declarative import declarative_base
 
+from guardrail.core import exceptions
 from guardrail.core.registry import _Registry
 
+from guardrail.ext.memory import MemoryPermissionManager
 from guardrail.ext.sqlalchemy import SqlalchemyLoader
 from guardrail.ext.sqlalchemy import SqlalchemyPermissionManager
 from guardrail.ext.sqlalchemy import SqlalchemyPermissionSchemaFactory
@@ -36,6 +38,45 @@ class Target(Base):
     __tablename__ = 'target'
     id = sa.Column(sa.Integer, primary_key=True)
     name = sa.Column(sa.String)
+    kind = sa.Column(sa.String)
+    __mapper_args__ = {'polymorphic_on': kind, 'polymorphic_identity': 'target'}
+
+
+class SubTarget(Target):
+    __mapper_args__ = {'polymorphic_identity': 'sub_target'}
+
+
+@registry.agent
+class Team(Base):
+    __tablename__ = 'team'
+    id = sa.Column(sa.Integer, primary_key=True)
+
+
+registry.group(Agent, Team)
+
+
+compact_registry = _Registry()
+
+
+@compact_registry.agent
+class CompactAgent(Base):
+    __tablename__ = 'compact_agent'
+    id = sa.Column(sa.Integer, primary_key=True)
+
+
+@compact_registry.target
+class CompactTarget(Base):
+    __tablename__ = 'compact_target'
+    id = sa.Column(sa.Integer, primary_key=True)
+
+
+@compact_registry.agent
+class CompactTeam(Base):
+    __tablename__ = 'compact_team'
+    id = sa.Column(sa.Integer, primary_key=True)
+
+
+compact_registry.group(CompactAgent, CompactTeam)
 
 
 @pytest.fixture(scope='session')
@@ -47,6 +88,11 @@ def engine():
 def database(engine):
     factory = SqlalchemyPermissionSchemaFactory((Base, ))
     registry.make_schemas(factory)
+    factory = SqlalchemyPermissionSchemaFactory(
+        (Base, ),
+        permissions=['read', 'write', 'admin'],
+    )
+    compact_registry.make_schemas(factory)
     Base.metadata.create_all(engine)
 
 
@@ -68,13 +114,69 @@ def integration(request, session):
         request.cls,
         agent=Agent(),
         target=Target(),
+        group=Team(),
         session=session,
         manager=SqlalchemyPermissionManager(session, registry=registry),
     )
 
 
-@pytest.mark.usefixtures('integration')
-class TestSqlalchemyPermissionManager(PermissionManagerMixin):
+@pytest.fixture
+def compact_integration(request, session):
+    patch(
+        request.cls,
+        agent=CompactAgent(),
+        target=CompactTarget(),
+        group=CompactTeam(),
+        session=session,
+        manager=SqlalchemyPermissionManager(session, registry=compact_registry),
+    )
+
+
+@pytest.fixture
+def memory_integration(request, session):
+    backend = SqlalchemyPermissionManager(session, registry=registry)
+    patch(
+        request.cls,
+        agent=Agent(),
+        target=Target(),
+        group=Team(),
+        session=session,
+        manager=MemoryPermissionManager(backend, write_through=True),
+    )
+
+
+@pytest.mark.parametrize('grant', [
+    lambda manager, agent, target: manager.add_permission(agent, target, 'read'),
+    lambda manager, agent, target: manager.add_permissions(
+        [(agent, target, 'read'), (agent, target, 'write')]
+    ),
+    lambda manager, agent, target: manager.ensure_permission(agent, target, 'read'),
+])
+@pytest.mark.parametrize('models', [
+    (registry, Agent, Target),
+    (compact_registry, CompactAgent, CompactTarget),
+])
+def test_rollback_discards_grants(engine, database, grant, models):
+    session = sa.orm.Session(bind=engine)
+    schemas, Agent, Target = models
+    agent, target = Agent(), Target()
+    session.add_all([agent, target])
+    session.commit()
+    manager = SqlalchemyPermissionManager(session, registry=schemas)
+    schema = schemas.get_permission(Agent, Target)
+    try:
+        grant(manager, agent, target)
+        session.rollback()
+        assert session.query(schema).filter_by(agent_id=agent.id).count() == 0
+    finally:
+        session.rollback()
+        session.delete(agent)
+        session.delete(target)
+        session.commit()
+        session.close()
+
+
+class SqlalchemyPermissionManagerMixin(PermissionManagerMixin):
 
     def delete(self, record):
         self.session.delete(record)
@@ -83,6 +185,141 @@ class TestSqlalchemyPermissionManager(PermissionManagerMixin):
     def count(self, schema):
         return self.session.query(schema).count()
 
+    def create_loader(self, schema):
+        return SqlalchemyLoader(schema, self.session)
+
+    def create_agent(self):
+        agent = type(self.agent)()
+        self.session.add(agent)
+        self.session.flush()
+        return agent
+
+    def create_target(self):
+        target = type(self.target)()
+        self.session.add(target)
+        self.session.flush()
+        return target
+
+    def create_group(self):
+        group = type(self.group)()
+        self.session.add(group)
+        self.session.flush()
+        return group
+
+
+@pytest.mark.usefixtures('integration')
+class TestSqlalchemyPermissionManager(SqlalchemyPermissionManagerMixin):
+
+    def test_add_permission_exists_keeps_transaction(self):
+        manager, agent, target = self.manager, self.agent, self.target
+        manager.add_permission(agent, target, 'read')
+        other = self.create_agent()
+        count = self.session.query(Agent).count()
+
+        with pytest.raises(exceptions.PermissionExists):
+            manager.add_permission(agent, target, 'read')
+        with pytest.raises(exceptions.PermissionExists):
+            manager.add_permissions([(agent, target, 'read')])
+
+        assert other in self.session
+        assert self.session.query(Agent).count() == count
+        assert manager.has_permission(agent, target, 'read')
+
+    def test_polymorphic_target(self):
+        manager, agent = self.manager, self.agent
+        target = SubTarget()
+        self.session.add(target)
+        self.session.flush()
+        manager.add_permission(agent, target, 'read')
+
+        assert manager.has_permission(agent, target, 'read')
+        assert manager.get_permissions(agent, target) == {'read'}
+        assert set(manager.filter_targets(agent, Target, 'read')) == {target}
+
+    def test_precompiled_statements(self):
+        manager, agent = self.manager, self.agent
+        target = self.create_target()
+        manager.add_permission(agent, target, 'read')
+        manager._statements.clear()
+        custom = lambda query, **kwargs: query
+
+        assert manager.has_permission(agent, target, 'read')
+        assert manager.get_permissions(agent, target) == {'read'}
+        assert len(manager._statements) == 2
+        assert manager.has_permission(agent, target, 'read', custom=custom)
+        assert len(manager._statements) == 2
+
+    def test_baked_load_with_permission(self):
+        manager, agent, target = self.manager, self.agent, self.target
+        other = self.create_agent()
+        loader = self.create_loader(Target)
+        manager.add_permission(agent, target, 'read')
+        loader._bakery.cache.clear()
+
+        assert loader.load_with_permission(
+            agent, ['read'], manager.registry, id=target.id,
+        ) == (target, True)
+        baked = len(loader._bakery.cache)
+        assert loader.load_with_permission(
+            other, ['read'], manager.registry, id=target.id,
+        ) == (target, False)
+        assert len(loader._bakery.cache) == baked
+
+
+@pytest.mark.usefixtures('compact_integration')
+class TestSqlalchemyCompactPermissionManager(SqlalchemyPermissionManagerMixin):
+
+    def test_compact_storage(self):
+        manager, agent, target = self.manager, self.agent, self.target
+        Permission = manager.registry.get_permission(CompactAgent, CompactTarget)
+        manager.add_permission(agent, target, 'read')
+        manager.add_permission(agent, target, 'admin')
+
+        assert self.session.query(Permission.mask).all() == [(0b101, )]
+
+        manager.remove_permission(agent, target, 'read')
+
+        assert self.session.query(Permission.mask).all() == [(0b100, )]
+
+    def test_unknown_permission(self):
+        manager, agent, target = self.manager, self.agent, self.target
+
+        with pytest.raises(exceptions.UnknownPermission):
+            manager.add_permission(agent, target, 'delete')
+        with pytest.raises(exceptions.PermissionNotFound):
+            manager.remove_permission(agent, target, 'delete')
+        assert not manager.has_permission(agent, target, 'delete')
+
+
+def test_lazy_schemas(engine):
+    lazy_registry = _Registry()
+    LazyBase = declarative_base()
+
+    class LazyAgent(LazyBase):
+        __tablename__ = 'lazy_agent'
+        id = sa.Column(sa.Integer, primary_key=True)
+
+    class LazyTarget(LazyBase):
+        __tablename__ = 'lazy_target'
+        id = sa.Column(sa.Integer, primary_key=True)
+
+    lazy_registry.link(LazyAgent, LazyTarget)
+    lazy_registry.make_schemas(SqlalchemyPermissionSchemaFactory((LazyBase, )), lazy=True)
+    assert not LazyBase.metadata.tables.get('lazy_agent_lazy_target_permission')
+
+    schema = lazy_registry.get_permission(LazyAgent, LazyTarget)
+    LazyBase.metadata.create_all(engine)
+    session = sa.orm.sessionmaker(bind=engine)()
+    manager = SqlalchemyPermissionManager(session, registry=lazy_registry)
+    agent, target = LazyAgent(), LazyTarget()
+    session.add_all([agent, target])
+    session.flush()
+    manager.add_permission(agent, target, 'read')
+
+    assert schema.__tablename__ == 'lazy_agent_lazy_target_permission'
+    assert manager.has_permission(agent, target, 'read')
+    session.rollback()
+
 
 @pytest.fixture
 def loaders(request, session):
@@ -102,3 +339,8 @@ def loaders(request, session):
 @pytest.mark.usefixtures('loaders')
 class TestSqlalchemyLoader(LoaderMixin):
     pass
+
+
+@pytest.mark.usefixtures('memory_integration')
+class TestSqlalchemyMemoryPermissionManager(SqlalchemyPermissionManagerMixin):
+    pass